@@ -0,0 +1,179 @@
+import dataclasses
+import hashlib
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, List, Optional
+
+from .loadtest import summarize
+
+if TYPE_CHECKING:
+    import requests
+
+LOGIN_PATH = "/api/stable/auth/login"
+VERSIONS_PATH = "/api/stable/repository/collection/{collection_id}/versions"
+UPLOAD_PATH = "/api/stable/repository/collection/{collection_id}/version"
+DOWNLOAD_PATH = "/api/stable/repository/collection/{collection_id}/version/{version}"
+
+
+class BackupRepositoryError(Exception):
+    status: int
+    body: str
+
+    def __init__(self, method: str, path: str, status: int, body: str):
+        super().__init__(f"{method} {path} failed with HTTP {status}: {body[:500]}")
+        self.status = status
+        self.body = body
+
+
+@dataclasses.dataclass
+class DownloadResult:
+    size: int
+    sha256: str
+
+
+class BackupRepositoryClient(object):
+    """
+    Backup Repository HTTP API client with a keep-alive connection pool.
+
+    Uploads are streamed from a generator of chunks (chunked transfer encoding), downloads are hashed
+    while they are read - nothing is buffered in memory
+    """
+
+    _url: str
+    _session: "requests.Session"
+    _timeout: float
+    token: Optional[str]
+
+    def __init__(self, url: str, pool_size: int = 16, timeout: float = 300):
+        self._url = url.rstrip("/")
+        self._timeout = timeout
+        import requests  # imported on first use, it is slow to import
+        from requests.adapters import HTTPAdapter
+
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self._session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.token = None
+
+    def close(self):
+        self._session.close()
+
+    def request(self, method: str, path: str, stream: bool = False, **kwargs) -> "requests.Response":
+        headers = kwargs.pop("headers", {})
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+
+        response = self._session.request(method, self._url + path, headers=headers, stream=stream,
+                                         timeout=self._timeout, **kwargs)
+        if response.status_code >= 400:
+            raise BackupRepositoryError(method, path, response.status_code, response.text)
+
+        return response
+
+    def login(self, username: str, password: str) -> str:
+        """
+        Returns a JWT and uses it for next requests
+        """
+        response = self.request("POST", LOGIN_PATH, json={"username": username, "password": password})
+        self.token = response.json()["data"]["token"]
+        return self.token
+
+    def list_versions(self, collection_id: str) -> List[dict]:
+        return self.request("GET", VERSIONS_PATH.format(collection_id=collection_id)).json()["data"]["versions"]
+
+    def upload(self, collection_id: str, chunks: Iterable[bytes]) -> dict:
+        """
+        Uploads a new version as a raw request body, streamed from `chunks`
+        """
+        return self.request("POST", UPLOAD_PATH.format(collection_id=collection_id), data=iter(chunks),
+                            headers={"Content-Type": "application/octet-stream"}).json()
+
+    def download(self, collection_id: str, version: str = "latest", chunk_size: int = 1024 * 1024,
+                 sink: Callable[[bytes], None] = None) -> DownloadResult:
+        """
+        Streams a version, computing its size and sha256 on the fly. Optionally passes chunks to a `sink`
+        """
+        digest = hashlib.sha256()
+        size = 0
+
+        path = DOWNLOAD_PATH.format(collection_id=collection_id, version=version)
+        with self.request("GET", path, stream=True) as response:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                digest.update(chunk)
+                size += len(chunk)
+                if sink:
+                    sink(chunk)
+
+        return DownloadResult(size=size, sha256=digest.hexdigest())
+
+
+def generate_payload(size: int, chunk_size: int = 1024 * 1024, seed: int = 161) -> Iterator[bytes]:
+    """
+    Deterministic, incompressible payload of given size, produced chunk by chunk
+    """
+    rnd = random.Random(seed)
+    remaining = size
+
+    while remaining > 0:
+        chunk = rnd.randbytes(min(chunk_size, remaining))
+        remaining -= len(chunk)
+        yield chunk
+
+
+def payload_sha256(size: int, chunk_size: int = 1024 * 1024, seed: int = 161) -> str:
+    digest = hashlib.sha256()
+    for chunk in generate_payload(size, chunk_size, seed):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+@dataclasses.dataclass
+class ServerIOResult:
+    operation: str
+    concurrency: int
+    payload_bytes: int
+    requests: int
+    errors: List[str]
+    wall_seconds: float
+    latencies: List[float]
+
+    def to_dict(self) -> dict:
+        transferred = self.payload_bytes * (self.requests - len(self.errors))
+
+        return {
+            "operation": self.operation,
+            "concurrency": self.concurrency,
+            "payload_bytes": self.payload_bytes,
+            "requests": self.requests,
+            "errors": self.errors,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "mb_per_second": round(transferred / 1024 / 1024 / self.wall_seconds, 3) if self.wall_seconds else None,
+            "latency_seconds": summarize(self.latencies),
+        }
+
+
+def measure_server_io(operation: str, concurrency: int, requests_count: int, call: Callable[[int], None],
+                      payload_bytes: int) -> ServerIOResult:
+    """
+    Runs `requests_count` calls of an operation with `concurrency` parallel requests over the shared pool
+    """
+    import requests
+
+    latencies, errors = [], []
+
+    def timed_call(index: int):
+        started = time.monotonic()
+        try:
+            call(index)
+            latencies.append(time.monotonic() - started)
+        except (requests.RequestException, BackupRepositoryError) as err:
+            errors.append(repr(err))
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed_call, range(requests_count)))
+
+    return ServerIOResult(operation=operation, concurrency=concurrency, payload_bytes=payload_bytes,
+                          requests=requests_count, errors=errors, wall_seconds=time.monotonic() - started,
+                          latencies=latencies)
@@ -0,0 +1,186 @@
+import dataclasses
+import datetime
+import hashlib
+import json
+import os
+import random
+import string
+import time
+from typing import Dict, Iterator, List, Optional
+
+from .postgresbase import PostgresTestingHelper
+from .transport import KubernetesTransport
+
+
+@dataclasses.dataclass(frozen=True)
+class DatasetSpec:
+    """
+    Shape of a generated dataset. Same spec + seed always produces exactly the same data
+    """
+
+    name: str
+    tables: int = 1
+    rows_per_table: int = 100000
+    row_width: int = 100
+    blob_size: int = 0
+    seed: int = 161
+
+    @property
+    def raw_bytes(self) -> int:
+        """
+        Approximate size of generated payload (without Postgres storage overhead)
+        """
+        return self.tables * self.rows_per_table * (8 + self.row_width + self.blob_size)
+
+
+# predefined data volumes, select with BENCHMARK_PROFILES=small,wide,...
+PROFILES: Dict[str, DatasetSpec] = {
+    "small": DatasetSpec(name="small", tables=1, rows_per_table=100000, row_width=100),
+    "many-tables": DatasetSpec(name="many-tables", tables=50, rows_per_table=20000, row_width=100),
+    "wide": DatasetSpec(name="wide", tables=2, rows_per_table=100000, row_width=2000),
+    "blobs": DatasetSpec(name="blobs", tables=1, rows_per_table=20000, row_width=50, blob_size=64 * 1024),
+}
+
+
+def dataset_from_env() -> List[DatasetSpec]:
+    """
+    BENCHMARK_PROFILES selects predefined profiles, BENCHMARK_TABLES/ROWS/ROW_WIDTH/BLOB_SIZE define a custom one
+    """
+    if os.getenv("BENCHMARK_ROWS"):
+        return [DatasetSpec(
+            name="custom",
+            tables=int(os.getenv("BENCHMARK_TABLES", "1")),
+            rows_per_table=int(os.getenv("BENCHMARK_ROWS")),
+            row_width=int(os.getenv("BENCHMARK_ROW_WIDTH", "100")),
+            blob_size=int(os.getenv("BENCHMARK_BLOB_SIZE", "0")),
+        )]
+
+    return [PROFILES[name.strip()] for name in os.getenv("BENCHMARK_PROFILES", "small").split(",")]
+
+
+# bump when generate_rows() or seed_dataset() produce different data - invalidates template databases
+DATASET_GENERATOR_VERSION = 1
+
+
+def table_name(index: int) -> str:
+    return f"bench_{index}"
+
+
+def dataset_template(spec: DatasetSpec) -> str:
+    """
+    Name of the template database holding a generated dataset (see PostgresTestingHelper.reset_from_template()).
+    Changes with the spec and with the generator
+    """
+    digest = hashlib.sha256(json.dumps([dataclasses.asdict(spec), DATASET_GENERATOR_VERSION]).encode('utf-8'))
+    return f"bmt_{spec.name.replace('-', '_')}_{digest.hexdigest()[:12]}"
+
+
+def generate_rows(spec: DatasetSpec, table_index: int) -> Iterator[tuple]:
+    """
+    Deterministic rows: (id, payload) or (id, payload, blob)
+    """
+    rnd = random.Random(f"{spec.seed}-{table_index}")
+    alphabet = string.ascii_letters + string.digits
+
+    for row_id in range(1, spec.rows_per_table + 1):
+        payload = "".join(rnd.choices(alphabet, k=spec.row_width))
+        if spec.blob_size:
+            yield row_id, payload, rnd.randbytes(spec.blob_size)
+        else:
+            yield row_id, payload
+
+
+def seed_dataset(postgres: PostgresTestingHelper, spec: DatasetSpec, batch_rows: int = 50000):
+    """
+    Creates and fills tables using COPY, committing in batches
+    """
+    for index in range(spec.tables):
+        table = table_name(index)
+        blob_column = ", blob BYTEA NOT NULL" if spec.blob_size else ""
+
+        postgres.query(f"DROP TABLE IF EXISTS {table}; "
+                       f"CREATE TABLE {table} (id BIGINT PRIMARY KEY, payload TEXT NOT NULL{blob_column})")
+        postgres.copy_batches(table, generate_rows(spec, index), batch_rows=batch_rows)
+
+
+def database_size(postgres: PostgresTestingHelper) -> int:
+    return postgres.select("SELECT pg_database_size(current_database())")[0][0]
+
+
+def job_duration(transport: KubernetesTransport, ns: str, action_name: str) -> Optional[float]:
+    """
+    How long the Job created for a RequestedBackupAction was running (from the Job status)
+    """
+    def parse(value: str) -> datetime.datetime:
+        return datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+
+    for job in transport.list("job", ns):
+        owners = [owner.get("name") for owner in job["metadata"].get("ownerReferences", [])]
+        status = job.get("status", {})
+
+        if action_name in owners and status.get("startTime") and status.get("completionTime"):
+            return (parse(status["completionTime"]) - parse(status["startTime"])).total_seconds()
+
+    return None
+
+
+def version_size(version: dict) -> Optional[int]:
+    """
+    Size of a stored backup version, as reported by Backup Repository
+    """
+    for key in ("filesize", "fileSize", "size"):
+        if key in version:
+            return int(version[key])
+    return None
+
+
+@dataclasses.dataclass
+class BenchmarkResult:
+    dataset: DatasetSpec
+    raw_db_bytes: int
+    backup_latency_seconds: float
+    backup_job_seconds: Optional[float]
+    restore_latency_seconds: float
+    restore_job_seconds: Optional[float]
+    stored_backup_bytes: Optional[int]
+
+    @staticmethod
+    def _throughput(size: int, seconds: Optional[float]) -> Optional[float]:
+        return round(size / 1024 / 1024 / seconds, 3) if seconds else None
+
+    def to_dict(self) -> dict:
+        result = dataclasses.asdict(self)
+        result.update({
+            "backup_mb_per_second": self._throughput(self.raw_db_bytes,
+                                                     self.backup_job_seconds or self.backup_latency_seconds),
+            "restore_mb_per_second": self._throughput(self.raw_db_bytes,
+                                                      self.restore_job_seconds or self.restore_latency_seconds),
+            "stored_to_raw_ratio": round(self.stored_backup_bytes / self.raw_db_bytes, 4)
+            if self.stored_backup_bytes and self.raw_db_bytes else None,
+        })
+        return result
+
+
+def report_path(name: str, default_dir: str) -> str:
+    """
+    Report of a benchmark in BENCHMARK_OUTPUT directory (or `default_dir`), named by the benchmark and time,
+    so benchmarks of one run do not overwrite each other
+    """
+    return f"{os.getenv('BENCHMARK_OUTPUT') or default_dir}/{name}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+
+
+def write_report(path: str, release: Dict[str, str], results: List):
+    """
+    Writes results (BenchmarkResult, LoadTestResult - anything with to_dict()) as JSON,
+    together with tested component versions, so the runs can be compared
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "w") as f:
+        json.dump({
+            "created_at": datetime.datetime.utcnow().isoformat() + "Z",
+            "release": release,
+            "results": [result.to_dict() for result in results],
+        }, f, indent=4)
+
+    print(f"Benchmark report written to {path}")
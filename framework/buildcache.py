@@ -0,0 +1,213 @@
+import contextlib
+import dataclasses
+import fcntl
+import hashlib
+import json
+import os
+import subprocess as sp
+import threading
+import time
+from typing import Dict, List, Optional
+
+MANIFEST_MEDIA_TYPES = ", ".join([
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.oci.image.index.v1+json",
+])
+
+
+@dataclasses.dataclass
+class BuildCacheEntry:
+    key: str
+    tag: str
+    images: List[str]
+    created_at: float
+    last_used_at: float
+
+
+class BuildCache(object):
+    """
+    Remembers images built by Skaffold, keyed by the content that was built:
+    resolved git commit + skaffold.yaml + uncommitted changes. When the key is already known and its images
+    are still present in the registry, build and push can be skipped.
+
+    Index is kept on disk, so it survives between test sessions, and is guarded by a file lock.
+    """
+
+    _root: str
+    _max_entries: int
+    _max_age: float
+    _lock: threading.Lock
+
+    def __init__(self, root: str, max_entries: int = 20, max_age: float = 7 * 24 * 3600):
+        self._root = root
+        self._max_entries = max_entries
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    # ---
+    #  Keys
+    # ---
+
+    @staticmethod
+    def _git(args: List[str], path: str) -> bytes:
+        return sp.check_output(["git"] + args, cwd=path, stderr=sp.DEVNULL)
+
+    @staticmethod
+    def key_for(path: str) -> Optional[str]:
+        """
+        Computes a content key for a directory with skaffold.yaml. Returns None if the directory is not versioned
+        """
+        digest = hashlib.sha256()
+
+        try:
+            digest.update(BuildCache._git(["rev-parse", "HEAD"], path))
+            status = BuildCache._git(["status", "--porcelain"], path)
+        except (sp.CalledProcessError, FileNotFoundError):
+            return None
+
+        with open(path + "/skaffold.yaml", "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+
+        # dirty working tree: changes are a part of the built image
+        if status.strip():
+            digest.update(BuildCache._git(["diff", "HEAD", "--binary"], path))
+
+            for untracked in BuildCache._git(["ls-files", "--others", "--exclude-standard", "-z"], path).split(b"\0"):
+                if untracked and os.path.isfile(os.path.join(path, untracked.decode('utf-8'))):
+                    digest.update(untracked)
+                    with open(os.path.join(path, untracked.decode('utf-8')), "rb") as f:
+                        digest.update(hashlib.sha256(f.read()).digest())
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def tag_for(key: str) -> str:
+        return "e2e-" + key[:16]
+
+    def artifacts_path(self, key: str) -> str:
+        """
+        Output of `skaffold build --file-output`, consumed by `skaffold deploy --build-artifacts`
+        """
+        return f"{self._root}/{key}.json"
+
+    @contextlib.contextmanager
+    def building(self, key: str):
+        """
+        Exclusive lock for building a key - other processes wait, then find the images in the cache
+        """
+        with open(f"{self._root}/{key}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # ---
+    #  Index
+    # ---
+
+    @contextlib.contextmanager
+    def _index(self):
+        with self._lock, open(self._root + "/index.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                index = {"entries": {}, "hits": 0, "misses": 0}
+                if os.path.isfile(self._root + "/index.json"):
+                    with open(self._root + "/index.json", "r") as f:
+                        index = json.load(f)
+
+                yield index
+
+                with open(self._root + "/index.json.tmp", "w") as f:
+                    json.dump(index, f, indent=4)
+                os.replace(self._root + "/index.json.tmp", self._root + "/index.json")
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def lookup(self, key: str) -> Optional[BuildCacheEntry]:
+        with self._index() as index:
+            self._evict(index)
+            entry = index["entries"].get(key)
+
+            if entry and os.path.isfile(self.artifacts_path(key)) and self._images_present(entry["images"]):
+                entry["last_used_at"] = time.time()
+                index["hits"] += 1
+                return BuildCacheEntry(**entry)
+
+            index["entries"].pop(key, None)
+            index["misses"] += 1
+            return None
+
+    def store(self, key: str):
+        with open(self.artifacts_path(key), "r") as f:
+            images = [build["tag"] for build in json.load(f).get("builds", [])]
+
+        now = time.time()
+        with self._index() as index:
+            index["entries"][key] = dataclasses.asdict(BuildCacheEntry(
+                key=key, tag=self.tag_for(key), images=images, created_at=now, last_used_at=now,
+            ))
+            self._evict(index)
+
+    def stats(self) -> Dict[str, int]:
+        with self._index() as index:
+            return {"hits": index["hits"], "misses": index["misses"], "entries": len(index["entries"])}
+
+    def _evict(self, index: dict):
+        """
+        Drops entries older than max age, then least recently used ones above the max number of entries
+        """
+        now = time.time()
+        entries = sorted(index["entries"].values(), key=lambda e: e["last_used_at"], reverse=True)
+        keep = [e for e in entries if now - e["created_at"] <= self._max_age][:self._max_entries]
+        keep_keys = {e["key"] for e in keep}
+
+        for entry in entries:
+            if entry["key"] not in keep_keys:
+                del index["entries"][entry["key"]]
+                if os.path.isfile(self.artifacts_path(entry["key"])):
+                    os.unlink(self.artifacts_path(entry["key"]))
+
+    @staticmethod
+    def _images_present(images: List[str]) -> bool:
+        """
+        Asks the registry if the pushed images were not garbage collected or lost together with the cluster
+        """
+        import requests
+
+        for image in images:
+            # e.g. bmt-registry:5000/backup-repository:e2e-0123456789abcdef@sha256:...
+            name, _, digest = image.partition("@")
+            host, _, name = name.partition("/")
+            repository, _, tag = name.partition(":")
+            reference = digest or tag
+
+            try:
+                response = requests.head(f"http://{host}/v2/{repository}/manifests/{reference}",
+                                         headers={"Accept": MANIFEST_MEDIA_TYPES}, timeout=5)
+                if response.status_code != 200:
+                    return False
+            except requests.RequestException:
+                return False
+
+        return True
+
+
+_default_build_cache: Optional[BuildCache] = None
+
+
+def default_build_cache(root: str) -> Optional[BuildCache]:
+    """
+    Returns a process-wide build cache, or None when disabled with BMT_BUILD_CACHE=false
+    """
+    global _default_build_cache
+
+    if os.getenv("BMT_BUILD_CACHE") == "false":
+        return None
+    if _default_build_cache is None:
+        _default_build_cache = BuildCache(root)
+
+    return _default_build_cache
@@ -0,0 +1,209 @@
+"""
+Keeps a warm test environment (cluster, deployments, port-forwards) in a background daemon.
+Tests started while the daemon is running attach to it, instead of setting everything up again.
+
+    python -m framework up                  # creates the cluster, deploys, starts the daemon
+    python -m framework status
+    python -m framework deploy [--force]    # redeploys what changed (or everything)
+    python -m framework down [--delete-cluster]
+"""
+
+import argparse
+import json
+import os
+import subprocess as sp
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from .clientserverbase import COMPONENT_NAMESPACES, ClientServerBase
+from .daemon import Daemon, DaemonClient, DaemonError, Handler, socket_path
+from .endtoendbase import BUILD_DIR, EndToEndTestBase, default_transport, run
+from .portforwards import default_port_forward_pool, probe_from_spec
+from .workers import cluster_name, per_worker
+
+
+class WarmEnvironment(object):
+    """
+    Environment built once and kept by the daemon. Test processes attached to it ask for deployments
+    and port-forwards, which outlive them
+    """
+
+    _base: ClientServerBase
+    _deploy_lock: threading.Lock
+
+    def __init__(self):
+        ClientServerBase.setUpClass()
+        self._base = ClientServerBase()
+        EndToEndTestBase.setUp(self._base)
+        self._deploy_lock = threading.Lock()
+
+    def handlers(self) -> Dict[str, Handler]:
+        return {
+            "env": self.env,
+            "status": self.status,
+            "deploy": self.deploy,
+            "ensure_deployed": self.ensure_deployed,
+            "port_forward": self.port_forward,
+            "stop_port_forwards": self.stop_port_forwards,
+        }
+
+    @staticmethod
+    def env() -> dict:
+        return {
+            "release": dict(EndToEndTestBase.release),
+            "environ": {name: os.environ[name] for name in ("PATH", "KUBECONFIG") if name in os.environ},
+        }
+
+    def status(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "cluster": cluster_name(),
+            "release": dict(EndToEndTestBase.release),
+            "deployed": self._base.deployments.verified(),
+            "port_forwards": default_port_forward_pool(default_transport).forwards(),
+        }
+
+    def ensure_deployed(self) -> List[str]:
+        """
+        Asked by every attached test: components already verified by the daemon are not checked again,
+        only missing ones (e.g. after `up --no-deploy`, or a deleted namespace) are deployed
+        """
+        with self._deploy_lock:
+            self._base._deploy_client_and_server(delete=False)
+            return self._base.deployments.verified()
+
+    def deploy(self, force: bool = False) -> List[str]:
+        """
+        Explicit `python -m framework deploy [--force]`
+        """
+        with self._deploy_lock:
+            # release.env or the sources could have changed since the daemon started - compare fingerprints again
+            EndToEndTestBase._load_release()
+            for component, ns in COMPONENT_NAMESPACES.items():
+                if force:
+                    self._base.deployments.invalidate(component, ns)
+                else:
+                    self._base.deployments.forget_verified(component)
+
+            self._base._deploy_client_and_server(delete=False)
+            return self._base.deployments.verified()
+
+    @staticmethod
+    def port_forward(ns: str, pod_label: str, remote_port: int, probe: str = "tcp", local_port: int = 0) -> int:
+        return default_port_forward_pool(default_transport).get(ns, pod_label, remote_port,
+                                                                probe=probe_from_spec(probe), local_port=local_port)
+
+    @staticmethod
+    def stop_port_forwards(ns: str):
+        default_port_forward_pool(default_transport).stop_namespace(ns)
+
+
+def _serve(deploy: bool) -> int:
+    os.environ["BMT_DAEMON"] = "false"  # the daemon must not attach to itself
+
+    environment = WarmEnvironment()
+    if deploy:
+        environment.deploy()
+
+    daemon = Daemon(socket_path(BUILD_DIR), environment.handlers())
+    print(f"Listening on {daemon.path}")
+    try:
+        daemon.serve()
+    finally:
+        default_port_forward_pool(default_transport).stop_all()
+
+    return 0
+
+
+def _up(client: DaemonClient, args: argparse.Namespace) -> int:
+    if client.is_running():
+        print(f"Already running at {client.path}")
+        return _status(client)
+
+    if args.foreground:
+        return _serve(deploy=not args.no_deploy)
+
+    os.makedirs(BUILD_DIR + "/logs", exist_ok=True)
+    log_path = per_worker(BUILD_DIR + "/logs/daemon.log")
+    with open(log_path, "ab") as log:
+        proc = sp.Popen([sys.executable, "-m", "framework", "up", "--foreground"]
+                        + (["--no-deploy"] if args.no_deploy else []),
+                        stdout=log, stderr=sp.STDOUT, stdin=sp.DEVNULL, start_new_session=True)
+
+    print(f"Starting the daemon (pid {proc.pid}), log: {log_path}")
+    deadline = time.monotonic() + args.timeout
+
+    while not client.is_running():
+        if proc.poll() is not None:
+            print(f"Daemon exited with code {proc.returncode}, see {log_path}")
+            return 1
+        if time.monotonic() > deadline:
+            print(f"Daemon is not ready after {args.timeout}s, see {log_path}")
+            return 1
+        time.sleep(0.5)
+
+    return _status(client)
+
+
+def _status(client: DaemonClient) -> int:
+    if not client.is_running():
+        print(f"Not running (no daemon at {client.path})")
+        return 1
+
+    print(json.dumps(client.call("status"), indent=4))
+    return 0
+
+
+def _deploy(client: DaemonClient, args: argparse.Namespace) -> int:
+    print("Deployed: " + ", ".join(client.call("deploy", force=args.force)))
+    return 0
+
+
+def _down(client: DaemonClient, args: argparse.Namespace) -> int:
+    if client.is_running():
+        client.call("shutdown")
+        print("Daemon stopped")
+    else:
+        print("Daemon is not running")
+
+    if args.delete_cluster:
+        EndToEndTestBase._setup_env()
+        run(["k3d", "cluster", "delete", cluster_name()])
+
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m framework", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    up = commands.add_parser("up", help="Set up the environment and keep it in a background daemon")
+    up.add_argument("--foreground", action="store_true", help="Run the daemon in this process")
+    up.add_argument("--no-deploy", action="store_true", help="Only create the cluster, deploy on first use")
+    up.add_argument("--timeout", type=float, default=1800, help="Seconds to wait for the daemon to be ready")
+
+    commands.add_parser("status", help="Show what the daemon keeps")
+
+    deploy = commands.add_parser("deploy", help="Deploy server and controller, if they changed")
+    deploy.add_argument("--force", action="store_true", help="Redeploy even if up to date")
+
+    down = commands.add_parser("down", help="Stop the daemon")
+    down.add_argument("--delete-cluster", action="store_true", help="Also delete the k3d cluster")
+
+    args = parser.parse_args(argv)
+    client = DaemonClient(socket_path(BUILD_DIR))
+
+    try:
+        if args.command == "up":
+            return _up(client, args)
+        if args.command == "status":
+            return _status(client)
+        if args.command == "deploy":
+            return _deploy(client, args)
+        return _down(client, args)
+    except (OSError, DaemonError) as err:
+        print(f"{args.command} failed: {err}")
+        return 1
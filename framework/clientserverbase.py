@@ -1,107 +1,137 @@
 import contextlib
 import dataclasses
+import hashlib
 import os
 import subprocess as sp
 import textwrap
-import time
-from json import loads as json_loads
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
 
-import requests
-from .endtoendbase import EndToEndTestBase, cloned_repository_at_revision
+from .backuprepository import BackupRepositoryClient
+from .deployment import DeploymentRegistry, crd_names, default_deployment_registry, deployment_fingerprint
+from .daemon import attached_daemon
+from .endtoendbase import BUILD_DIR, DEPLOY_STEP_RETRY, TESTS_DIR, EndToEndTestBase, \
+    cloned_repository_at_revision, default_transport
+from .retry import retry
+from .waiters import RequestedBackupActionWaiter
+from .portforwards import http_probe
+from .timing import timed
+
+SERVER_REPOSITORY = "https://github.com/riotkit-org/backup-repository"
+CONTROLLER_REPOSITORY = "https://github.com/riotkit-org/backup-maker-controller"
+
+# component -> namespace it is deployed into
+COMPONENT_NAMESPACES = {
+    "backup-repository": "backups",
+    "backup-maker-controller": "backup-maker-controller",
+}
+
+# PostgreSQL backed up by the tests, shared by all of them (see ClientServerBase.postgres_subject())
+POSTGRES_SUBJECT_NS = "postgres-subject"
 
 
 class _Server:
     _parent: EndToEndTestBase
     _url: str
     _ns: str
+    api: BackupRepositoryClient
 
     def __init__(self, parent: EndToEndTestBase, url: str, ns: str):
         self._parent = parent
         self._url = url
         self._ns = ns
+        self.api = BackupRepositoryClient(url)
 
+    @timed()
     def i_create_a_user(self, name: str, email: str, password: str):
         encoded_password = sp.check_output(["br", "--encode-password", password], stderr=sp.STDOUT) \
             .strip().decode('utf-8')
 
-        self._parent.apply_yaml(f"""
-        ---
-        apiVersion: backups.riotkit.org/v1alpha1
-        kind: BackupUser
-        metadata:
-            name: {name}
-        spec:
-            # best practice is to set this e-mail to same e-mail as GPG key owner e-mail (GPG key used on client side to encrypt files)
-            email: {email}
-            deactivated: false
-            organization: "Riotkit"
-            about: "Some user"
-            passwordFromRef: 
-                name: {name}-secret
-                entry: password
-            #restrictByIP:
-            #    - 1.2.3.4
-            roles:
-                - systemAdmin
+        step = f"i_create_a_user({name})"
+        with self._parent.batched_apply():
+            self._parent.apply_yaml(f"""
+            ---
+            apiVersion: backups.riotkit.org/v1alpha1
+            kind: BackupUser
+            metadata:
+                name: {name}
+            spec:
+                # best practice is to set this e-mail to same e-mail as GPG key owner e-mail (GPG key used on client side to encrypt files)
+                email: {email}
+                deactivated: false
+                organization: "Riotkit"
+                about: "Some user"
+                passwordFromRef: 
+                    name: {name}-secret
+                    entry: password
+                #restrictByIP:
+                #    - 1.2.3.4
+                roles:
+                    - systemAdmin
              
-        """, ns="backups")
-        self._parent.apply_yaml(f"""
-        ---
-        apiVersion: v1
-        kind: Secret
-        metadata:
-            name: {name}-secret
-        data:
-            password: {encoded_password}
-        """, ns="backups")
+            """, ns="backups", step=step)
+            self._parent.apply_yaml(f"""
+            ---
+            apiVersion: v1
+            kind: Secret
+            metadata:
+                name: {name}-secret
+            data:
+                password: {encoded_password}
+            """, ns="backups", step=step)
 
+    @timed()
     def i_create_a_collection(self, name: str, description: str, filename_template: str, max_backups_count: int,
                               max_one_version_size: str, max_collection_size: str, strategy_name: str):
-        self._parent.apply_yaml("""
-        ---
-        apiVersion: v1
-        kind: Secret
-        metadata:
-            name: backup-repository-collection-secrets
-        type: Opaque
-        data:
-            # to generate: use echo -n "admin" | sha256sum
-            iwa-ait: "8c6976e5b5410415bde908bd4dee15dfb167a9c873fc4bb8a81f6f2ab448a918"
-        """, ns="backups")
-
-        self._parent.apply_yaml(f"""
-        ---
-        apiVersion: backups.riotkit.org/v1alpha1
-        kind: BackupCollection
-        metadata:
-            name: {name}
-        spec:
-            description: "{description}"
-            filenameTemplate: {filename_template}
-            maxBackupsCount: {max_backups_count}
-            maxOneVersionSize: "{max_one_version_size}"
-            maxCollectionSize: "{max_collection_size}"
-            #windows:
-            #    - from: "*/30 * * * *"
-            #      duration: 30m
-            strategyName: {strategy_name}
-            strategySpec: {"{}"}
-            healthSecretRef:
+        step = f"i_create_a_collection({name})"
+        with self._parent.batched_apply():
+            self._parent.apply_yaml("""
+            ---
+            apiVersion: v1
+            kind: Secret
+            metadata:
                 name: backup-repository-collection-secrets
-                entry: iwa-ait
-            accessControl:
-                - userName: admin
-                  roles:
-                      - collectionManager
-        """, ns="backups")
+            type: Opaque
+            data:
+                # to generate: use echo -n "admin" | sha256sum
+                iwa-ait: "8c6976e5b5410415bde908bd4dee15dfb167a9c873fc4bb8a81f6f2ab448a918"
+            """, ns="backups", step=step)
+
+            self._parent.apply_yaml(f"""
+            ---
+            apiVersion: backups.riotkit.org/v1alpha1
+            kind: BackupCollection
+            metadata:
+                name: {name}
+            spec:
+                description: "{description}"
+                filenameTemplate: {filename_template}
+                maxBackupsCount: {max_backups_count}
+                maxOneVersionSize: "{max_one_version_size}"
+                maxCollectionSize: "{max_collection_size}"
+                #windows:
+                #    - from: "*/30 * * * *"
+                #      duration: 30m
+                strategyName: {strategy_name}
+                strategySpec: {"{}"}
+                healthSecretRef:
+                    name: backup-repository-collection-secrets
+                    entry: iwa-ait
+                accessControl:
+                    - userName: admin
+                      roles:
+                          - collectionManager
+            """, ns="backups", step=step)
 
+    @timed()
     def i_login(self, username: str, password: str) -> str:
-        response = requests.post(self._url + "/api/stable/auth/login", json={
-            "username": username,
-            "password": password,
-        })
-        body = response.json()
-        return body["data"]["token"]
+        return self.api.login(username, password)
+
+    @timed()
+    def i_list_versions(self, collection_id: str, access_token: str = None) -> List[dict]:
+        if access_token:
+            self.api.token = access_token
+        return self.api.list_versions(collection_id)
 
 
 @dataclasses.dataclass
@@ -109,54 +139,58 @@ class _Client:
     ns: str
     _parent: EndToEndTestBase
 
+    @timed()
     def i_schedule_a_backup(self, name: str, operation: str, email: str, cronjob_enabled: bool, schedule_every: str,
                             collection_id: str, access_token: str, template_name: str, template_vars: str, template_kind: str):
-        self._parent.apply_yaml(ns=self.ns, yaml=f"""
-        ---
-        apiVersion: v1
-        kind: Secret
-        metadata:
-            name: backup-keys
-            namespace: {self.ns}
-        stringData:
-            passphrase: ""
-            token: "{access_token}"
-        """)
+        step = f"i_schedule_a_backup({name})"
+        with self._parent.batched_apply():
+            self._parent.apply_yaml(ns=self.ns, step=step, yaml=f"""
+            ---
+            apiVersion: v1
+            kind: Secret
+            metadata:
+                name: backup-keys
+                namespace: {self.ns}
+            stringData:
+                passphrase: ""
+                token: "{access_token}"
+            """)
 
-        self._parent.apply_yaml(ns=self.ns, yaml=f"""
-        ---
-        apiVersion: riotkit.org/v1alpha1
-        kind: ScheduledBackup
-        metadata:
-            name: {name}
-            namespace: {self.ns}
-        spec:
-            operation: {operation}
-            cronJob:
-                enabled: {str(cronjob_enabled).lower()}
-                scheduleEvery: "{schedule_every}"
-            collectionId: {collection_id}
-            gpgKeySecretRef:
-                createIfNotExists: true
-                email: {email}
-                passphraseKey: passphrase
-                privateKey: private
-                publicKey: public
-                secretName: backup-keys
-            tokenSecretRef:
-                secretName: backup-keys
-                tokenKey: token
-            templateRef:
-                kind: {template_kind}
-                name: {template_name}
+            self._parent.apply_yaml(ns=self.ns, step=step, yaml=f"""
+            ---
+            apiVersion: riotkit.org/v1alpha1
+            kind: ScheduledBackup
+            metadata:
+                name: {name}
+                namespace: {self.ns}
+            spec:
+                operation: {operation}
+                cronJob:
+                    enabled: {str(cronjob_enabled).lower()}
+                    scheduleEvery: "{schedule_every}"
+                collectionId: {collection_id}
+                gpgKeySecretRef:
+                    createIfNotExists: true
+                    email: {email}
+                    passphraseKey: passphrase
+                    privateKey: private
+                    publicKey: public
+                    secretName: backup-keys
+                tokenSecretRef:
+                    secretName: backup-keys
+                    tokenKey: token
+                templateRef:
+                    kind: {template_kind}
+                    name: {template_name}
         
-            vars: |
-{textwrap.indent(template_vars, "                ")}
-            varsSecretRef: {"{}"}
-        """)
+                vars: |
+    {textwrap.indent(template_vars, "                    ")}
+                varsSecretRef: {"{}"}
+            """)
 
+    @timed()
     def i_request_backup_action(self, name: str, action: str, ref: str, kind_type: str = "Job"):
-        self._parent.apply_yaml(ns=self.ns, yaml=f"""
+        self._parent.apply_yaml(ns=self.ns, step=f"i_request_backup_action({name})", yaml=f"""
         ---
         apiVersion: riotkit.org/v1alpha1
         kind: RequestedBackupAction
@@ -170,42 +204,34 @@ class _Client:
                 name: {ref}
         """)
 
-    def backup_has_status(self, name: str, expected: bool, kubectl_timeout: int = 10,
-                          retries_left: int = 30, wait_time: int = 1) -> bool:
-        try:
-            cmd = ["get", "requestedbackupaction", name, "-o", "json"]
-            out = json_loads(self._parent.kubectl(cmd).lower().strip().strip("'"))
-            print("backup_has_status = " + str(out['status']))
+    @timed()
+    def backup_has_status(self, name: str, expected: bool, timeout: float = 300) -> bool:
+        """
+        Waits until the RequestedBackupAction is finished and HEALTHY (or not, depending on `expected`)
+        """
+        return self.backups_have_status([name], expected, timeout)[name]
 
-            healthy = out['status']['healthy'] is True
-            any_resource_running = False
-            for resource in out['status']['childrenresourceshealth']:
-                if resource['running']:
-                    any_resource_running = True
+    @timed()
+    def backups_have_status(self, names: List[str], expected: bool, timeout: float = 300) -> Dict[str, bool]:
+        """
+        Waits for multiple RequestedBackupActions at once, using a single watch
+        """
+        return RequestedBackupActionWaiter(self._parent, ns=self.ns).wait(names, expected=expected, timeout=timeout)
 
-            # CONDITION: backup/restore needs to be finished and HEALTHY
-            result = not any_resource_running and healthy
 
-            if result != expected and retries_left > 0:
-                time.sleep(wait_time)
-                return self.backup_has_status(name, expected, kubectl_timeout, retries_left - 1)
+class DeploymentError(Exception):
+    """
+    Deployment of one or more components failed
+    """
 
-            return result
+    errors: Dict[str, BaseException]
 
-        except KeyError:
-            if retries_left > 0:
-                time.sleep(wait_time)
-                return self.backup_has_status(name, expected, kubectl_timeout, retries_left - 1)
-            raise
-        except sp.CalledProcessError:
-            if retries_left > 0:
-                time.sleep(wait_time)
-                return self.backup_has_status(name, expected, kubectl_timeout, retries_left - 1)
-            raise
+    def __init__(self, errors: Dict[str, BaseException]):
+        super().__init__("Deployment failed: " + ", ".join(f"{name}: {error!r}" for name, error in errors.items()))
+        self.errors = errors
 
 
 class ClientServerBase(EndToEndTestBase):
-    last_test_class: str = ""
     server: _Server
     client: _Client
 
@@ -215,56 +241,162 @@ class ClientServerBase(EndToEndTestBase):
 
     def setUp(self) -> None:
         EndToEndTestBase.setUp(self)
-        self.server = _Server(self, "http://127.0.0.1:8070", ns="backups")
         self.client = _Client(_parent=self, ns="subject")
 
-        # --- hack: deploy only once, before first test starts
-        current_test_class = self.__class__.__name__
-        if ClientServerBase.last_test_class != current_test_class:
-            self._deploy_client_and_server(delete=False, retries_left=5)
-            self.port_forward(local_port=8070, remote_port=8080, ns="backups",
-                              pod_label="app.kubernetes.io/name=backup-repository-server")
-            ClientServerBase.last_test_class = current_test_class
-        # --- end of hack
+        # checked once per session, deployed only when the fingerprint changed (see DeploymentRegistry).
+        # A daemon has checked them already - changes are deployed with `python -m framework deploy`
+        daemon = attached_daemon(BUILD_DIR)
+        if daemon:
+            daemon.call("ensure_deployed")
+        else:
+            self._deploy_client_and_server(delete=False)
+
+        if self.log_collector:
+            self.log_collector.follow("backups")
+            self.log_collector.follow("backup-maker-controller")
+
+        # reuses the forward from previous test, unless the server Pod was replaced in the meantime
+        server_port = self.port_forward(remote_port=8080, ns="backups",
+                                        pod_label="app.kubernetes.io/name=backup-repository-server",
+                                        probe=http_probe("/"))
+        self.server = _Server(self, f"http://127.0.0.1:{server_port}", ns="backups")
+
+    @contextlib.contextmanager
+    def subject_namespace(self, prefix: str = "subject"):
+        """
+        Unique namespace for the backed up application. The client (ScheduledBackup, RequestedBackupAction)
+        is pointed to it. Deleted in the background after the test
+        """
+        with self.kubernetes_namespace(prefix, unique=True) as ns:
+            self.client.ns = ns
+            if self.log_collector:
+                self.log_collector.follow(ns)
+            try:
+                yield ns
+            finally:
+                if self.log_collector:
+                    self.log_collector.stop(ns)
 
     @contextlib.contextmanager
     def show_logs_on_failure(self):
         try:
             yield
         except:
-            self.logs(pod_label="app.kubernetes.io/name=backup-repository-server", ns="backups", allow_failure=True)
-            self.logs(pod_label="app=backup-maker-controller", ns="backup-maker-controller", allow_failure=True)
+            if not self.log_collector:
+                self.logs(pod_label="app.kubernetes.io/name=backup-repository-server", ns="backups",
+                          allow_failure=True)
+                self.logs(pod_label="app=backup-maker-controller", ns="backup-maker-controller", allow_failure=True)
+                raise
+
+            # already collected in the background, includes Job Pods that may no longer exist
+            print(self.log_collector.tail("backups", "app.kubernetes.io/name=backup-repository-server"))
+            print(self.log_collector.tail("backup-maker-controller", "app=backup-maker-controller"))
+            print(self.log_collector.tail(self.client.ns))
             raise
 
-    def _deploy_client_and_server(self, delete: bool = True, retries_left: int = 0):
+    @timed()
+    def postgres_subject(self) -> str:
+        """
+        PostgreSQL from test/data/postgres_backup_test, deployed once into a persistent namespace and kept
+        across tests and sessions - tests reset its database from a template (see PostgresTestingHelper.reset()).
+        Redeployed when its skaffold.yaml changes. Returns the namespace
+        """
+        if self.deployments.is_verified("postgres-subject"):
+            return POSTGRES_SUBJECT_NS
+
+        # only the Helm release matters - not commits of this repository
+        with open(TESTS_DIR + "/data/postgres_backup_test/skaffold.yaml", "rb") as f:
+            fingerprint = hashlib.sha256(f.read()).hexdigest()
+
+        if self.deployments.is_current("postgres-subject", POSTGRES_SUBJECT_NS, fingerprint):
+            print(f"{POSTGRES_SUBJECT_NS} is up to date ({fingerprint[:12]}), not redeploying")
+        else:
+            with self.kubernetes_namespace(POSTGRES_SUBJECT_NS, persistent=True, switch=False):
+                self.skaffold_deploy(path=TESTS_DIR + "/data/postgres_backup_test", ns=POSTGRES_SUBJECT_NS)
+                retry("record postgres-subject deployment",
+                      lambda: self.deployments.record(POSTGRES_SUBJECT_NS, fingerprint), DEPLOY_STEP_RETRY)
+
+        self.deployments.mark_verified("postgres-subject", POSTGRES_SUBJECT_NS)
+        return POSTGRES_SUBJECT_NS
+
+    @timed()
+    def _deploy_client_and_server(self, delete: bool = True):
         """
         Deploys Backup Repository (server) + Backup Maker Controller (client)
-        on the Kubernetes cluster
+        on the Kubernetes cluster. Both are cloned, built and deployed at the same time.
+        Components already verified in this session are skipped.
+
+        Each step is retried on its own (see DEPLOY_STEP_RETRY), so a failure resumes from the failed step
         """
-        pwd = os.getcwd()
-        server_ver = self.release["SERVER_VERSION"]
-        client_ver = self.release["CONTROLLER_VERSION"]
+        pending = {name: deploy for name, deploy in {
+            "backup-repository": self._deploy_server,
+            "backup-maker-controller": self._deploy_controller,
+        }.items() if not self.deployments.is_verified(name)}
 
-        # server
-        try:
-            with cloned_repository_at_revision("https://github.com/riotkit-org/backup-repository", server_ver):
-                with self.kubernetes_namespace("backups", persistent=not delete):
-                    self.skaffold_deploy(skip_when=os.getenv("SKIP_SERVER_INSTALL") == "true")
-
-                    # client
-                    with cloned_repository_at_revision("https://github.com/riotkit-org/backup-maker-controller",
-                                                       client_ver):
-                        with self.kubernetes_namespace("backup-maker-controller", persistent=not delete):
-                            self.apply_manifests("config/crd/bases")
-                            self.skaffold_deploy(skip_when=os.getenv("SKIP_CLIENT_INSTALL") == "true")
-                            os.chdir(pwd)
-
-        # be bulletproof on CI, avoid random failures sacrificing execution time
-        except:
-            if retries_left > 0:
-                self._deploy_client_and_server(delete=delete, retries_left=retries_left-1)
+        if not pending:
+            return
+
+        with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            futures = {name: executor.submit(deploy, delete) for name, deploy in pending.items()}
+
+        errors = {name: future.exception() for name, future in futures.items() if future.exception()}
+        for name, error in errors.items():
+            print(f" >>> Deployment of {name} failed: {error!r}")
+        for name in pending:
+            if name not in errors:
+                self.deployments.mark_verified(name, COMPONENT_NAMESPACES[name])
+
+        if errors:
+            raise DeploymentError(errors)
+
+    @property
+    def deployments(self) -> DeploymentRegistry:
+        return default_deployment_registry(default_transport)
+
+    @timed()
+    def _deploy_server(self, delete: bool):
+        if os.getenv("SKIP_SERVER_INSTALL") == "true":
+            print("Skipping installation of backup-repository")
+            return
+
+        with cloned_repository_at_revision(SERVER_REPOSITORY,
+                                           self.release["SERVER_VERSION"], chdir=False) as path:
+            fingerprint = deployment_fingerprint(path, SERVER_VERSION=self.release["SERVER_VERSION"])
+            if self.deployments.is_current("backup-repository", "backups", fingerprint):
+                print(f"backup-repository is up to date ({fingerprint[:12]}), not redeploying")
                 return
-            raise
+
+            with self.kubernetes_namespace("backups", persistent=not delete, switch=False):
+                self.skaffold_deploy(path=path, ns="backups")
+                if not delete:
+                    retry("record backup-repository deployment",
+                          lambda: self.deployments.record("backups", fingerprint), DEPLOY_STEP_RETRY)
+
+    @timed()
+    def _deploy_controller(self, delete: bool):
+        if os.getenv("SKIP_CLIENT_INSTALL") == "true":
+            print("Skipping installation of backup-maker-controller")
+            return
+
+        with cloned_repository_at_revision(CONTROLLER_REPOSITORY,
+                                           self.release["CONTROLLER_VERSION"], chdir=False) as path:
+            crds = crd_names(path + "/config/crd/bases")
+            fingerprint = deployment_fingerprint(path, crds=crds,
+                                                 CONTROLLER_VERSION=self.release["CONTROLLER_VERSION"],
+                                                 BACKUP_MAKER_VERSION=self.release.get("BACKUP_MAKER_VERSION", ""))
+            if self.deployments.is_current("backup-maker-controller", "backup-maker-controller", fingerprint):
+                print(f"backup-maker-controller is up to date ({fingerprint[:12]}), not redeploying")
+                return
+
+            with self.kubernetes_namespace("backup-maker-controller", persistent=not delete, switch=False):
+                retry("apply backup-maker-controller CRDs",
+                      lambda: self.apply_manifests(path + "/config/crd/bases", ns="backup-maker-controller"),
+                      DEPLOY_STEP_RETRY)
+                self.skaffold_deploy(path=path, ns="backup-maker-controller")
+                if not delete:
+                    retry("record backup-maker-controller deployment",
+                          lambda: self.deployments.record("backup-maker-controller", fingerprint, crds=crds),
+                          DEPLOY_STEP_RETRY)
 
     # ---
     #  End of technical methods
@@ -0,0 +1,138 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from .workers import cluster_name
+
+Handler = Callable[..., Any]
+
+
+class DaemonError(Exception):
+    """
+    Command failed inside the daemon
+    """
+
+
+def socket_path(build_dir: str) -> str:
+    """
+    One daemon per cluster, so parallel workers (see framework.workers) do not share it
+    """
+    return os.getenv("BMT_DAEMON_SOCKET") or f"{os.path.realpath(build_dir)}/{cluster_name()}.sock"
+
+
+class DaemonClient(object):
+    """
+    Talks to the daemon over a unix socket: one JSON line per request, one per response
+    """
+
+    path: str
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def call(self, command: str, timeout: Optional[float] = None, **args) -> Any:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(self.path)
+            sock.sendall(json.dumps({"command": command, "args": args}).encode('utf-8') + b"\n")
+
+            with sock.makefile("rb") as f:
+                line = f.readline()
+
+        if not line:
+            raise DaemonError(f"Daemon at {self.path} closed the connection during '{command}'")
+
+        response = json.loads(line)
+        if not response["ok"]:
+            raise DaemonError(response["error"])
+
+        return response["result"]
+
+    def is_running(self) -> bool:
+        try:
+            return self.call("ping", timeout=2) == "pong"
+        except (OSError, DaemonError, ValueError):
+            return False
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+
+        request = json.loads(line)
+        handler = self.server.daemon.handlers.get(request.get("command"))
+
+        if handler is None:
+            response = {"ok": False, "error": f"Unknown command '{request.get('command')}'"}
+        else:
+            try:
+                response = {"ok": True, "result": handler(**request.get("args", {}))}
+            except Exception as err:
+                response = {"ok": False, "error": f"{err.__class__.__name__}: {err}"}
+
+        self.wfile.write(json.dumps(response).encode('utf-8') + b"\n")
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    daemon: "Daemon"
+
+
+class Daemon(object):
+    """
+    Serves commands from `handlers` (name -> function taking keyword arguments, returning JSON) on a unix socket.
+    Each connection is handled in its own thread
+    """
+
+    path: str
+    handlers: Dict[str, Handler]
+    _server: Optional[_Server]
+
+    def __init__(self, path: str, handlers: Dict[str, Handler]):
+        self.path = path
+        self.handlers = dict(handlers, ping=lambda: "pong", shutdown=self.shutdown)
+        self._server = None
+
+    def serve(self):
+        if DaemonClient(self.path).is_running():
+            raise DaemonError(f"Another daemon is already listening on {self.path}")
+        if os.path.exists(self.path):
+            os.unlink(self.path)  # left by a daemon that was killed
+
+        self._server = _Server(self.path, _RequestHandler)
+        self._server.daemon = self
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def shutdown(self) -> str:
+        # serve_forever() must be stopped from another thread than the one handling this request
+        threading.Thread(target=self._server.shutdown, daemon=True).start()
+        return "bye"
+
+
+_attached: Dict[str, Optional[DaemonClient]] = {}
+
+
+def attached_daemon(build_dir: str) -> Optional[DaemonClient]:
+    """
+    Client of a running daemon holding the warm environment, or None when there is none
+    (or when disabled with BMT_DAEMON=false). Checked once per process
+    """
+    if os.getenv("BMT_DAEMON") == "false":
+        return None
+
+    path = socket_path(build_dir)
+    if path not in _attached:
+        client = DaemonClient(path)
+        _attached[path] = client if client.is_running() else None
+
+    return _attached[path]
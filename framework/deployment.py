@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+
+from .buildcache import BuildCache
+from .transport import KubernetesTransport, read_manifests
+
+FINGERPRINT_ANNOTATION = "bmt.riotkit.org/deployment-fingerprint"
+IMAGES_ANNOTATION = "bmt.riotkit.org/deployed-images"
+CRDS_ANNOTATION = "bmt.riotkit.org/applied-crds"
+
+
+def crd_names(path: str) -> List[str]:
+    return sorted(document["metadata"]["name"] for document in read_manifests(path)
+                  if document.get("kind") == "CustomResourceDefinition")
+
+
+def deployment_fingerprint(path: str, crds: List[str] = None, **versions: str) -> Optional[str]:
+    """
+    Identifies what is going to be deployed: versions from release.env, the checked out source
+    (commit + uncommitted changes, see BuildCache.key_for) and applied CRDs.
+    Returns None when the source is not versioned - then the deployment cannot be reused
+    """
+    source = BuildCache.key_for(path)
+    if source is None:
+        return None
+
+    return hashlib.sha256(json.dumps({
+        "versions": versions,
+        "source": source,
+        "crds": crds or [],
+    }, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def running_images(transport: KubernetesTransport, ns: str) -> List[str]:
+    """
+    Image digests of all containers running in a namespace
+    """
+    images = set()
+    for pod in transport.list("pod", ns):
+        # Pods of the previous rollout can be still terminating
+        if pod["metadata"].get("deletionTimestamp"):
+            continue
+        for status in pod.get("status", {}).get("containerStatuses", []):
+            if status.get("imageID"):
+                images.add(status["imageID"])
+
+    return sorted(images)
+
+
+class DeploymentRegistry(object):
+    """
+    Remembers what is deployed as annotations on the component's namespace, so a deployment is reused
+    across test classes and test sessions until its fingerprint changes.
+
+    A reused deployment is verified against the cluster: the same image digests must be running
+    and the CRDs must still exist. Each component is verified once per session.
+    BMT_REDEPLOY=true (or a comma separated list of components) forces a redeployment
+    """
+
+    _transport: Callable[[], KubernetesTransport]
+    _verified: Dict[str, str]
+    _lock: threading.Lock
+
+    def __init__(self, transport: Callable[[], KubernetesTransport]):
+        self._transport = transport
+        self._verified = {}
+        self._lock = threading.Lock()
+
+    def is_verified(self, component: str) -> bool:
+        with self._lock:
+            return component in self._verified
+
+    def mark_verified(self, component: str, ns: str):
+        with self._lock:
+            self._verified[component] = ns
+
+    def forget_verified(self, component: str = None):
+        """
+        The component (or all of them) is checked against its fingerprint again on the next deployment
+        """
+        with self._lock:
+            if component is None:
+                self._verified.clear()
+            else:
+                self._verified.pop(component, None)
+
+    def forget_namespace(self, ns: str):
+        """
+        Components deployed into a namespace that is being deleted have to be deployed again
+        """
+        with self._lock:
+            for component in [component for component, component_ns in self._verified.items() if component_ns == ns]:
+                del self._verified[component]
+
+    def verified(self) -> List[str]:
+        with self._lock:
+            return sorted(self._verified)
+
+    @staticmethod
+    def redeploy_requested(component: str) -> bool:
+        requested = [name.strip() for name in os.getenv("BMT_REDEPLOY", "").split(",")]
+        return "true" in requested or component in requested
+
+    def is_current(self, component: str, ns: str, fingerprint: Optional[str]) -> bool:
+        if fingerprint is None or self.redeploy_requested(component):
+            return False
+
+        transport = self._transport()
+        namespace = transport.get("namespace", ns, ns="")
+        if namespace is None:
+            return False
+
+        annotations = namespace["metadata"].get("annotations") or {}
+        if annotations.get(FINGERPRINT_ANNOTATION) != fingerprint:
+            return False
+
+        images = json.loads(annotations.get(IMAGES_ANNOTATION) or "[]")
+        if images and images != running_images(transport, ns):
+            print(f" >>> Images running in '{ns}' differ from the deployed ones, redeploying")
+            return False
+
+        for crd in json.loads(annotations.get(CRDS_ANNOTATION) or "[]"):
+            if transport.get("customresourcedefinition", crd, ns="") is None:
+                print(f" >>> CRD '{crd}' is missing, redeploying")
+                return False
+
+        return True
+
+    def record(self, ns: str, fingerprint: Optional[str], crds: List[str] = None):
+        """
+        Stores the fingerprint of a successful deployment
+        """
+        transport = self._transport()
+        self._annotate(transport, ns, {
+            FINGERPRINT_ANNOTATION: fingerprint or "",
+            IMAGES_ANNOTATION: json.dumps(running_images(transport, ns)),
+            CRDS_ANNOTATION: json.dumps(crds or []),
+        })
+
+    def invalidate(self, component: str, ns: str):
+        """
+        Forces a redeployment of the component, in this and in following sessions
+        """
+        self.forget_verified(component)
+
+        if self._transport().get("namespace", ns, ns="") is not None:
+            self._annotate(self._transport(), ns, {FINGERPRINT_ANNOTATION: ""})
+
+    @staticmethod
+    def _annotate(transport: KubernetesTransport, ns: str, annotations: dict):
+        transport.apply([{
+            "apiVersion": "v1",
+            "kind": "Namespace",
+            "metadata": {"name": ns, "annotations": annotations},
+        }], ns="")
+
+
+_default_registry: Optional[DeploymentRegistry] = None
+_default_registry_lock = threading.Lock()
+
+
+def default_deployment_registry(transport: Callable[[], KubernetesTransport]) -> DeploymentRegistry:
+    global _default_registry
+
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = DeploymentRegistry(transport)
+
+    return _default_registry
@@ -1,12 +1,32 @@
+import collections
+import dataclasses
+import itertools
 import os.path
+import re
+import signal
 import subprocess
 import subprocess as sp
 import contextlib
 import dotenv
 import unittest
-import _portforward as portforward
-import portforward as portforwardpub
-from typing import Dict, Union, List
+import sys
+import threading
+import time
+from typing import Dict, Union, List, Optional
+from .transport import KubernetesTransport, KubernetesApiError, default_transport
+from .manifests import ManifestBatch, apply_changed, cached_manifests, default_applied_hashes, \
+    rendered_documents
+from .buildcache import default_build_cache
+from .daemon import attached_daemon
+from .deployment import default_deployment_registry
+from .gitcache import default_git_cache
+from .images import default_image_preloader, registry_mirror_args, scenario_dirs
+from .logcollector import LogCollector, default_log_collector
+from .namespaces import default_namespace_reaper, unique_namespace_name
+from .portforwards import Probe, default_port_forward_pool, probe_spec, tcp_probe
+from .retry import RetryPolicy, is_network_failure, retry
+from .timing import tracer, timed
+from .workers import cluster_name, per_worker
 
 TESTS_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 
@@ -15,17 +35,32 @@ if not TESTS_DIR.endswith("/test"):
 
 BUILD_DIR = TESTS_DIR + "/../.build"
 
+# each step of a deployment (checkout, build & push, deploy, apply) is retried on its own,
+# so a registry hiccup does not throw away a finished checkout or build
+DEPLOY_STEP_RETRY = RetryPolicy(attempts=5, initial_delay=2, max_delay=60, deadline=1800)
+
+# a failed build or deploy is repeated only when the registry or the network failed, not the build itself
+SKAFFOLD_RETRY = dataclasses.replace(DEPLOY_STEP_RETRY, classify=is_network_failure)
+
 
 class EndToEndTestBase(unittest.TestCase):
     release: Dict[str, str]
     current_ns: str
+    _batch: Optional[ManifestBatch] = None
+
+    @classmethod
+    def _load_release(cls):
+        """
+        Loads release configuration (release.env, or BMT_RELEASE_FILE - see framework.matrix)
+        """
+        cls.release = dotenv.dotenv_values(os.getenv("BMT_RELEASE_FILE") or TESTS_DIR + "/../release.env")
 
     @classmethod
     def _setup_env(cls):
         """
-        Loads release configuration
+        Loads release configuration and tools
         """
-        cls.release = dotenv.dotenv_values(TESTS_DIR + "/../release.env")
+        cls._load_release()
         os.environ["PATH"] = BUILD_DIR + ":" + os.getenv("PATH")
 
         # append GOROOT/bin to the path for the Skaffold's KO builder which not always can find right Go binary
@@ -33,17 +68,33 @@ class EndToEndTestBase(unittest.TestCase):
             os.environ["PATH"] = os.environ["PATH"] + ":" + os.environ["GOROOT"] + "/bin"
 
     @staticmethod
+    @timed()
     def _setup_cluster():
         """
-        Creates a new K3s cluster using K3d if existing is not active
+        Creates a new K3s cluster using K3d if existing is not active.
+        Parallel workers get their own clusters, all of them use the same registry and pull-through caches
         """
+        name = cluster_name()
+        exists = sp.run(f"docker ps | grep k3d-{name}-server-0 > /dev/null 2>&1", shell=True).returncode == 0
+
+        if name == "bmt":
+            # create a new k3d cluster if it does not exist
+            if not exists:
+                run(f"k3d cluster create bmt --registry-create bmt-registry:0.0.0.0:5000 "
+                    f"{registry_mirror_args(BUILD_DIR)}", shell=True)
+
+            # create a KUBECONFIG
+            run(["k3d", "kubeconfig", "merge", "bmt"])
+            return
 
-        # create a new k3d cluster if it does not exist
-        run("(docker ps | grep k3d-bmt-server-0 > /dev/null 2>&1) "
-            "|| k3d cluster create bmt --registry-create bmt-registry:0.0.0.0:5000", shell=True)
+        if not exists:
+            run(f"k3d cluster create {name} --registry-use k3d-bmt-registry:5000 {registry_mirror_args(BUILD_DIR)}",
+                shell=True)
 
-        # create a KUBECONFIG
-        run(["k3d", "kubeconfig", "merge", "bmt"])
+        # separate KUBECONFIG, so the worker does not switch the context of other workers
+        kubeconfig = f"{BUILD_DIR}/kubeconfig-{name}.yaml"
+        run(["k3d", "kubeconfig", "write", name, "--output", kubeconfig])
+        os.environ["KUBECONFIG"] = kubeconfig
 
     @staticmethod
     def _setup_hosts():
@@ -56,14 +107,29 @@ class EndToEndTestBase(unittest.TestCase):
 
     @classmethod
     def setUpClass(cls) -> None:
-        cls._setup_env()
+        daemon = attached_daemon(BUILD_DIR)
+
+        if daemon:
+            # cluster and hosts are kept warm by `python -m framework up`
+            env = daemon.call("env")
+            cls.release = env["release"]
+            os.environ.update(env["environ"])
+        else:
+            cls._setup_env()
 
         if not os.path.isdir(BUILD_DIR):
             os.mkdir(BUILD_DIR)
         os.chdir(BUILD_DIR)
 
-        cls._setup_cluster()
-        cls._setup_hosts()
+        if not daemon:
+            cls._setup_cluster()
+            cls._setup_hosts()
+
+        # images of all scenarios are pulled and imported in the background, while the tests deploy other things
+        preloader = default_image_preloader(BUILD_DIR + "/images")
+        if preloader:
+            for path in scenario_dirs(TESTS_DIR + "/data"):
+                preloader.prefetch(path, cluster_name())
 
     def setUp(self) -> None:
         self.current_ns = "default"
@@ -74,7 +140,14 @@ class EndToEndTestBase(unittest.TestCase):
 
     @contextlib.contextmanager
     def in_dir(self, path: str):
+        """
+        Switches to a scenario directory, when its images (see framework.images) are already in the cluster
+        """
         prev_cwd = os.getcwd()
+        preloader = default_image_preloader(BUILD_DIR + "/images")
+        if preloader and os.path.isdir(TESTS_DIR + "/../" + path):
+            preloader.wait(TESTS_DIR + "/../" + path, cluster_name())
+
         try:
             os.chdir(TESTS_DIR + "/../" + path)
             yield
@@ -82,48 +155,93 @@ class EndToEndTestBase(unittest.TestCase):
             os.chdir(prev_cwd)
 
     @contextlib.contextmanager
-    def kubernetes_namespace(self, name: str, persistent: bool = False):
+    def kubernetes_namespace(self, name: str, persistent: bool = False, switch: bool = True, unique: bool = False):
         """
-        Create a Kubernetes namespace temporarily
+        Create a Kubernetes namespace temporarily. Yields the namespace name.
+        With switch=False the current namespace is not changed, so it is safe to use from multiple threads.
+        With unique=True a random suffix is added to the name, and the namespace is deleted in the background
         """
         prev_ns = self.current_ns
 
+        if unique:
+            name = unique_namespace_name(name)
+
         try:
-            self.current_ns = name
-            sp.call(["kubectl", "create", "ns", name], stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
-            run(["kubens", name])
-            yield
+            if switch:
+                self.current_ns = name
+            self.transport.create_namespace(name)
+            yield name
         finally:
             if not persistent:
-                self.current_ns = prev_ns
-                run(["kubectl", "delete", "ns", name, "--wait=true"])
-
-    def skaffold_deploy(self, skip_when: bool = None):
+                if switch:
+                    self.current_ns = prev_ns
+
+                self._stop_port_forwards(name)
+                default_deployment_registry(default_transport).forget_namespace(name)
+                if default_applied_hashes() is not None:
+                    default_applied_hashes().forget_namespace(name)
+
+                if unique:
+                    default_namespace_reaper(default_transport).schedule(name)
+                else:
+                    # a fixed name is going to be re-created, so it has to be gone before we continue
+                    self.transport.delete_namespace(name, wait=True)
+
+    @timed()
+    def skaffold_deploy(self, skip_when: bool = None, path: str = '', ns: str = ''):
         """
         Deploy a Kubernetes application using Skaffold
         """
+        if not path:
+            path = os.getcwd()
+        if not ns:
+            ns = self.current_ns
 
         if skip_when:
-            print(f"Skipping skaffold in {os.getcwd()}")
+            print(f"Skipping skaffold in {path}")
             return
 
-        print(f"Running skaffold in {os.getcwd()}")
+        print(f"Running skaffold in {path}")
 
-        assert os.path.isfile("skaffold.yaml"), "Cannot find skaffold.yaml in " + os.getcwd()
+        assert os.path.isfile(path + "/skaffold.yaml"), "Cannot find skaffold.yaml in " + path
 
-        with open("skaffold.yaml", "r") as f:
+        with open(path + "/skaffold.yaml", "r") as f:
             content = f.read()
 
-        if "build:" in content:
-            run(["skaffold", "build",
-                 "--tag", "e2e",
-                 "--default-repo", "bmt-registry:5000",
-                 "--push",
-                 "--insecure-registry", "bmt-registry:5000", "--disable-multi-platform-build=true",
-                 "--detect-minikube=false", "--cache-artifacts=false"])
+        if "build:" not in content:
+            retry(f"skaffold deploy ({os.path.basename(path)})",
+                  lambda: run(["skaffold", "deploy", "--tag", "e2e", "--assume-yes=true", "--default-repo",
+                               "bmt-registry:5000", "--namespace", ns], cwd=path), SKAFFOLD_RETRY)
+            return
 
-        run(["skaffold", "deploy", "--tag", "e2e", "--assume-yes=true", "--default-repo",
-             "bmt-registry:5000"])
+        cache = default_build_cache(BUILD_DIR + "/image-cache")
+        key = cache.key_for(path) if cache else None
+
+        # parallel workers wait for each other, so the same images are built only once
+        with cache.building(key) if key else contextlib.nullcontext():
+            if key and cache.lookup(key):
+                print(f"Reusing images built from {path} ({cache.tag_for(key)}), stats: {cache.stats()}")
+                artifacts = cache.artifacts_path(key)
+            else:
+                tag = cache.tag_for(key) if key else "e2e"
+                artifacts = cache.artifacts_path(key) if key else \
+                    per_worker(f"{BUILD_DIR}/build-artifacts/{os.path.basename(path)}.json")
+                os.makedirs(os.path.dirname(artifacts), exist_ok=True)
+
+                build = ["skaffold", "build",
+                         "--tag", tag,
+                         "--default-repo", "bmt-registry:5000",
+                         "--push",
+                         "--insecure-registry", "bmt-registry:5000", "--disable-multi-platform-build=true",
+                         "--detect-minikube=false", "--cache-artifacts=false",
+                         "--file-output", artifacts]
+                retry(f"skaffold build ({os.path.basename(path)})", lambda: run(build, cwd=path), SKAFFOLD_RETRY)
+                if key:
+                    cache.store(key)
+
+        retry(f"skaffold deploy ({os.path.basename(path)})",
+              lambda: run(["skaffold", "deploy", "--build-artifacts", artifacts, "--assume-yes=true",
+                           "--default-repo", "bmt-registry:5000", "--namespace", ns], cwd=path), SKAFFOLD_RETRY)
 
     def has_pod_with_label_present(self, label: str, ns: str = '') -> bool:
         """
@@ -133,14 +251,14 @@ class EndToEndTestBase(unittest.TestCase):
             ns = self.current_ns
 
         try:
-            run(["kubectl", "get", "pods", "-n", ns, "-l", label])
-            return True
-        except subprocess.CalledProcessError:
+            return len(self.transport.list("pod", ns, label)) > 0
+        except (subprocess.CalledProcessError, KubernetesApiError):
             return False
 
     def kubectl(self, popenargs: Union[str, List[str]], **kwargs) -> str:
         """
-        Executes a kubectl command and returns output
+        Executes a kubectl command and returns output. Kept for ad-hoc commands the transport does not cover
+        (exec, rollout, port-forward...) - the framework and the tests use `self.transport` for everything else
         """
         if type(popenargs) == list:
             if "kubectl" not in popenargs:
@@ -153,7 +271,31 @@ class EndToEndTestBase(unittest.TestCase):
             if "-n " not in popenargs and "--namespace " not in popenargs:
                 popenargs += " -n " + self.current_ns + " "
 
-        return sp.check_output(popenargs, **kwargs, timeout=None).decode('utf-8')
+        with tracer.span("kubectl", command=popenargs):
+            return sp.check_output(popenargs, **kwargs, timeout=None).decode('utf-8')
+
+    @property
+    def transport(self) -> KubernetesTransport:
+        """
+        Connection to the cluster - pooled HTTP session to the API server, or forked kubectl as a fallback
+        """
+        return default_transport()
+
+    @property
+    def log_collector(self) -> Optional[LogCollector]:
+        """
+        Background collector of Pod logs (None when disabled with BMT_LOG_COLLECTOR=false)
+        """
+        return default_log_collector(default_transport, per_worker(BUILD_DIR + "/logs/pods"))
+
+    def watch(self, kind: str, ns: str = ''):
+        """
+        Opens a streaming watch on all objects of given kind in a namespace
+        """
+        if not ns:
+            ns = self.current_ns
+
+        return self.transport.watch(kind, ns)
 
     def logs(self, pod_label: str, ns: str, allow_failure: bool = True):
         """
@@ -161,95 +303,185 @@ class EndToEndTestBase(unittest.TestCase):
         """
         try:
             print(f" >>> Logs: {pod_label} from '{ns}' namespace")
-            print(self.kubectl(["logs", "-l", pod_label, "-n", ns]))
+            print(self.transport.logs(pod_label, ns))
         except:
             if allow_failure:
                 raise
 
-    def apply_manifests(self, path: str, ns: str = ''):
+    @contextlib.contextmanager
+    def batched_apply(self):
+        """
+        Collects everything applied inside the block, then applies it at once in dependency order.
+        Nested blocks join the outermost batch
+        """
+        if self._batch is not None:
+            yield self._batch
+            return
+
+        self._batch = ManifestBatch()
+        try:
+            yield self._batch
+            with tracer.span("batched_apply", documents=len(self._batch)):
+                self._batch.submit(self.transport, default_applied_hashes())
+        finally:
+            self._batch = None
+
+    def apply_manifests(self, path: str, ns: str = '', step: str = ''):
         """
         Applies a file or directory to Kubernetes
         """
         if not ns:
             ns = self.current_ns
-        run(["kubectl", "apply", "-f", path, "-n", ns])
 
-    def apply_yaml(self, yaml: str, ns: str = ''):
+        documents = cached_manifests(path)
+
+        if self._batch is not None:
+            self._batch.add(documents, ns, step or path)
+            return
+
+        apply_changed(self.transport, documents, ns, default_applied_hashes())
+
+    def apply_yaml(self, yaml: str, ns: str = '', step: str = ''):
         """
-        Applies a plain YAML on Kubernetes from stdin
+        Applies a plain YAML on Kubernetes (or adds to the current batch, see batched_apply()).
+        `step` names the scenario step in errors of the batch, by default the applied objects are listed
         """
         if not ns:
             ns = self.current_ns
 
         yaml = yaml.strip()
 
+        if self._batch is not None:
+            documents = rendered_documents(yaml)
+            self._batch.add(documents, ns, step or "apply_yaml(" + ", ".join(
+                f"{document.get('kind')}/{document.get('metadata', {}).get('name')}" for document in documents) + ")")
+            return
+
         try:
-            run(["kubectl", "apply", "-f", "-", "-n", ns], input=yaml.encode('utf-8'))
+            apply_changed(self.transport, rendered_documents(yaml), ns, default_applied_hashes())
         except:
             print(yaml)
             raise
 
     @staticmethod
-    def port_forward(local_port: int, remote_port: int, pod_label: str, ns: str, retry_left: int = 5) -> None:
-        pod_name = "?"
-        try:
-            try:
-                pod_name = sp.check_output(["kubectl", "get", "pod", "-l", pod_label, "-n", ns, "-o", "name"]) \
-                    .replace(b"pod/", b"", 1).decode("utf-8").strip()
-            except sp.CalledProcessError:
-                raise Exception(f"Cannot make a port-forward, Pod not found for label {pod_label}")
+    def _stop_port_forwards(ns: str):
+        default_port_forward_pool(default_transport).stop_namespace(ns)
 
-            try:
-                portforward.stop(ns, pod_name)
-            except:
-                pass
-            portforward.forward(ns, pod_name, local_port, remote_port,
-                                portforwardpub._config_path(None),
-                                portforwardpub.LogLevel.ERROR.value)
-        except:
-            if retry_left > 0:
-                print(f"pod_name: {pod_name}")
-                EndToEndTestBase.port_forward(local_port, remote_port, pod_label, ns, retry_left-1)
-                return
-            raise
+        daemon = attached_daemon(BUILD_DIR)
+        if daemon:
+            daemon.call("stop_port_forwards", ns=ns)
+
+    @staticmethod
+    @timed()
+    def port_forward(remote_port: int, pod_label: str, ns: str, local_port: int = 0,
+                     probe: Probe = tcp_probe) -> int:
+        """
+        Forwards a local port to a running Pod and returns the local port once the probe succeeds.
+        Forwards are pooled - calling it again for same target returns the existing forward
+        or re-establishes it, when the Pod was replaced. With a running daemon the forward is kept by the daemon
+        """
+        daemon = attached_daemon(BUILD_DIR)
+        if daemon:
+            return daemon.call("port_forward", ns=ns, pod_label=pod_label, remote_port=remote_port,
+                               probe=probe_spec(probe), local_port=local_port)
+
+        return default_port_forward_pool(default_transport).get(ns, pod_label, remote_port, probe=probe,
+                                                                local_port=local_port)
 
 
 @contextlib.contextmanager
-def cloned_repository_at_revision(url: str, version: str):
+def cloned_repository_at_revision(url: str, version: str, chdir: bool = True):
+    """
+    Yields a path to the repository checked out at given revision (see GitMirrorCache).
+    With chdir=False the process working directory is left untouched, so it is safe to use from multiple threads
+    """
     repo_name = url.split("/")[-1].replace(".git", "")
+    link = BUILD_DIR + "/" + repo_name
 
-    pwd = os.getcwd()
+    if os.path.islink(link):
+        print(f"Using {link} as it is, because it is a link")
+        path = link
+    else:
+        with tracer.span("cloned_repository_at_revision", url=url, version=version):
+            path = retry(f"checkout {url.split('/')[-1]}@{version}",
+                         lambda: default_git_cache(BUILD_DIR + "/git").worktree(url, version), DEPLOY_STEP_RETRY)
 
-    if not os.path.isdir(BUILD_DIR + "/" + repo_name):
-        os.chdir(BUILD_DIR)
-        run(["git", "clone", url])
+    pwd = os.getcwd()
 
     try:
-        os.chdir(BUILD_DIR + "/" + repo_name)
-        run(["git", "checkout", version])
-        is_not_on_branch = sp.check_output(["git", "rev-parse",
-                                            "--abbrev-ref", "--symbolic-full-name", "HEAD"]).strip() == b"HEAD"
-
-        if os.getenv("SKIP_GIT_PULL") == "true":
-            print("Skipping git pull because of SKIP_GIT_PULL=true")
-        elif os.path.islink(BUILD_DIR + "/" + repo_name):
-            print(f"Skipping git pull because {BUILD_DIR}/{repo_name} is a link")
-        elif is_not_on_branch:
-            print("Skipping git pull, because we are not on a branch right now")
-        else:
-            run(["git", "pull"])
-            run(["git", "reset", "--hard", "HEAD"])
-            run(["git", "clean", "-fx"])
-        yield
+        if chdir:
+            os.chdir(path)
+        yield path
     finally:
-        os.chdir(pwd)
+        if chdir:
+            os.chdir(pwd)
+
+
+_command_counter = itertools.count(1)
+
+
+def run(*popenargs, timeout: Optional[float] = None, tail_lines: int = 200, input: bytes = None, **kwargs):
+    """
+    Runs a command, streaming its output line by line: to the console when VERBOSE=true,
+    and always to a log file in .build/logs. Only the last `tail_lines` lines are kept in memory for error reports.
+
+    Timeout (in seconds) defaults to BMT_COMMAND_TIMEOUT, when set
+    """
+    args = popenargs[0] if popenargs else kwargs.get("args")
+    name = "run: " + (" ".join(args[:2]) if isinstance(args, list) else args.split(" ")[0].strip("("))
+    verbose = os.getenv('VERBOSE') == "true"
+    if timeout is None and os.getenv("BMT_COMMAND_TIMEOUT"):
+        timeout = float(os.getenv("BMT_COMMAND_TIMEOUT"))
+
+    os.makedirs(BUILD_DIR + "/logs", exist_ok=True)
+    log_path = per_worker(BUILD_DIR + "/logs/" + time.strftime("%Y%m%d-%H%M%S") + f"-{next(_command_counter)}-"
+                          + re.sub(r"[^a-zA-Z0-9]+", "-", name[5:])[:60].strip("-") + ".log")
+    tail = collections.deque(maxlen=tail_lines)
+    timed_out = threading.Event()
+
+    with tracer.span(name, command=args), open(log_path, "wb") as log:
+        # own process group, so a timeout kills also children of `shell=True` commands, which hold the output pipe
+        proc = sp.Popen(*popenargs, **kwargs, stdout=sp.PIPE, stderr=sp.STDOUT,
+                        stdin=sp.PIPE if input is not None else None, start_new_session=True)
+
+        if input is not None:
+            def write_input():
+                try:
+                    proc.stdin.write(input)
+                    proc.stdin.close()
+                except BrokenPipeError:
+                    pass
+            threading.Thread(target=write_input, daemon=True).start()
+
+        def kill():
+            timed_out.set()
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        timer = threading.Timer(timeout, kill) if timeout else None
+        if timer:
+            timer.start()
+
+        try:
+            for line in proc.stdout:
+                log.write(line)
+                tail.append(line)
+                if verbose:
+                    sys.stdout.write(line.decode('utf-8', errors='replace'))
+                    sys.stdout.flush()
+            return_code = proc.wait()
+        finally:
+            if timer:
+                timer.cancel()
 
+    output = b"".join(tail)
 
-def run(*popenargs, **kwargs):
-    try:
-        out = sp.check_output(*popenargs, **kwargs, stderr=sp.STDOUT)
-        if os.getenv('VERBOSE') == "true":
-            print(out.decode('utf-8'))
-    except sp.CalledProcessError as err:
-        print(err.output.decode('utf-8'))
-        raise err
+    if timed_out.is_set() or return_code != 0:
+        if not verbose:
+            print(output.decode('utf-8', errors='replace'))
+        print(f" >>> Full output of the command: {log_path}")
+
+        if timed_out.is_set():
+            raise sp.TimeoutExpired(args, timeout, output=output)
+        raise sp.CalledProcessError(return_code, args, output=output)
@@ -0,0 +1,317 @@
+import copy
+import dataclasses
+import fnmatch
+import itertools
+import queue
+import threading
+import time
+import uuid
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .logcollector import matches_selector
+from .transport import ApplyError, KubernetesApiError, KubernetesTransport, _StreamingWatch
+
+
+def action_status(healthy: bool, running: bool = False) -> dict:
+    """
+    Status of a RequestedBackupAction as reported by backup-maker-controller
+    """
+    return {
+        "healthy": healthy,
+        "childrenResourcesHealth": [{"kind": "Job", "running": running, "healthy": healthy and not running}],
+    }
+
+
+@dataclasses.dataclass
+class Transition:
+    """
+    Status set on an object `after` seconds since it was created
+    """
+
+    after: float
+    status: dict
+
+
+def succeeding(job_seconds: float = 0.01) -> List[Transition]:
+    """
+    Job is started right away, finishes successfully after `job_seconds`
+    """
+    return [Transition(0, action_status(healthy=False, running=True)),
+            Transition(job_seconds, action_status(healthy=True))]
+
+
+def failing(job_seconds: float = 0.01) -> List[Transition]:
+    return [Transition(0, action_status(healthy=False, running=True)),
+            Transition(job_seconds, action_status(healthy=False))]
+
+
+def _kind(kind: str) -> str:
+    return kind.split(".")[0].lower()
+
+
+class _FakeWatch(_StreamingWatch):
+    """
+    Watch on FakeCluster: starts with ADDED events for existing objects, like the API server does
+    """
+
+    _cluster: "FakeCluster"
+    _kind: str
+    _ns: str
+    _queue: queue.Queue
+    _closed = object()
+
+    def __init__(self, cluster: "FakeCluster", kind: str, ns: str):
+        super().__init__()
+        self._cluster = cluster
+        self._kind = kind
+        self._ns = ns
+        self._queue = queue.Queue()
+
+    def matches(self, kind: str, ns: str) -> bool:
+        return kind == self._kind and (not self._ns or ns == self._ns)
+
+    def push(self, event: dict):
+        self._queue.put(event)
+
+    def _open(self):
+        self._cluster._subscribe(self)
+
+    def close(self):
+        self._cluster._unsubscribe(self)
+        self._queue.put(self._closed)
+
+    def _stream(self) -> Iterator[dict]:
+        while True:
+            event = self._queue.get()
+            if event is self._closed:
+                return
+            yield event
+
+
+class FakeCluster(KubernetesTransport):
+    """
+    In-memory stand-in for a Kubernetes cluster, to test the framework itself (DSL, waiters, batching)
+    in milliseconds, without k3d.
+
+    Objects are stored as applied. Newly created RequestedBackupActions go through scripted status transitions,
+    as if backup-maker-controller was running (see script_action()). Failures of any operation can be injected
+    with fail()
+    """
+
+    _objects: Dict[Tuple[str, str, str], dict]
+    _namespaces: Dict[str, dict]  # name -> annotations
+    _scripts: List[Tuple[str, List[Transition]]]
+    _default_script: List[Transition]
+    _failures: List[Tuple[str, str, Exception]]
+    _watches: List[_FakeWatch]
+    _versions: Iterator[int]
+    _lock: threading.RLock
+    applied: List[Tuple[str, str, str]]
+    pod_logs: Dict[Tuple[str, str], List[str]]
+
+    def __init__(self, namespaces: List[str] = None, default_script: List[Transition] = None):
+        self._objects = {}
+        self._namespaces = {name: {} for name in ["default", "kube-system"] + (namespaces or [])}
+        self._scripts = []
+        self._default_script = succeeding() if default_script is None else default_script
+        self._failures = []
+        self._watches = []
+        self._versions = itertools.count(1)
+        self._lock = threading.RLock()
+        self.applied = []
+        self.pod_logs = {}
+
+    # ---
+    #  Scripting
+    # ---
+
+    def script_action(self, name_pattern: str, transitions: List[Transition]):
+        """
+        Status transitions of RequestedBackupActions matching the pattern (fnmatch), the latest script wins
+        """
+        with self._lock:
+            self._scripts.insert(0, (name_pattern, transitions))
+
+    def fail(self, operation: str, error: Exception = None, times: int = 1, name_pattern: str = "*"):
+        """
+        Next `times` calls of an operation ("apply", "get", "list", "delete", "watch", ...) on objects
+        matching the pattern raise the error
+        """
+        error = error or KubernetesApiError(500, "InternalError", f"injected failure of {operation}")
+        with self._lock:
+            self._failures += [(operation, name_pattern, error)] * times
+
+    def close_watches(self):
+        """
+        Ends all open watches, like the API server does after its timeout
+        """
+        with self._lock:
+            watches = list(self._watches)
+        for watch in watches:
+            watch.close()
+
+    def set_status(self, kind: str, name: str, ns: str, status: dict):
+        with self._lock:
+            obj = self._objects.get((_kind(kind), ns, name))
+            if obj is None:
+                return
+            obj["status"] = copy.deepcopy(status)
+            self._store(obj, ns, "MODIFIED")
+
+    def _check_failure(self, operation: str, name: str = ""):
+        with self._lock:
+            for index, (failing_operation, pattern, error) in enumerate(self._failures):
+                if failing_operation == operation and fnmatch.fnmatch(name, pattern):
+                    del self._failures[index]
+                    raise error
+
+    def _script_for(self, name: str) -> List[Transition]:
+        with self._lock:
+            return next((transitions for pattern, transitions in self._scripts if fnmatch.fnmatch(name, pattern)),
+                        self._default_script)
+
+    def _run_script(self, kind: str, name: str, ns: str, uid: str, transitions: List[Transition]):
+        started = time.monotonic()
+        for transition in sorted(transitions, key=lambda t: t.after):
+            time.sleep(max(0.0, started + transition.after - time.monotonic()))
+
+            with self._lock:
+                obj = self._objects.get((kind, ns, name))
+                if obj is None or obj["metadata"]["uid"] != uid:
+                    return  # deleted or re-created in the meantime
+                self.set_status(kind, name, ns, transition.status)
+
+    # ---
+    #  Storage
+    # ---
+
+    def _subscribe(self, watch: _FakeWatch):
+        with self._lock:
+            self._watches.append(watch)
+            for (kind, ns, _), obj in sorted(self._objects.items()):
+                if watch.matches(kind, ns):
+                    watch.push({"type": "ADDED", "object": copy.deepcopy(obj)})
+
+    def _unsubscribe(self, watch: _FakeWatch):
+        with self._lock:
+            if watch in self._watches:
+                self._watches.remove(watch)
+
+    def _store(self, obj: dict, ns: str, event_type: str):
+        """
+        Saves an object and notifies watches. Must be called with the lock held
+        """
+        metadata = obj["metadata"]
+        metadata["resourceVersion"] = str(next(self._versions))
+        self._objects[(_kind(obj["kind"]), ns, metadata["name"])] = obj
+
+        for watch in self._watches:
+            if watch.matches(_kind(obj["kind"]), ns):
+                watch.push({"type": event_type, "object": copy.deepcopy(obj)})
+
+    def _remove(self, key: Tuple[str, str, str]):
+        obj = self._objects.pop(key)
+        for watch in self._watches:
+            if watch.matches(key[0], key[1]):
+                watch.push({"type": "DELETED", "object": copy.deepcopy(obj)})
+
+    # ---
+    #  KubernetesTransport
+    # ---
+
+    def apply(self, documents: List[dict], ns: str):
+        for index, document in enumerate(documents):
+            document = copy.deepcopy(document)
+            metadata = document.setdefault("metadata", {})
+            target_ns = metadata.setdefault("namespace", ns)
+
+            if _kind(document["kind"]) == "namespace":
+                self._check_failure("apply", metadata["name"])
+                with self._lock:
+                    # like server-side apply, only the given annotations are changed
+                    self._namespaces.setdefault(metadata["name"], {}).update(metadata.get("annotations") or {})
+                    self.applied.append(("Namespace", "", metadata["name"]))
+                continue
+
+            try:
+                self._check_failure("apply", metadata.get("name", ""))
+                if target_ns not in self._namespaces:
+                    raise KubernetesApiError(404, "NotFound", f'namespaces "{target_ns}" not found')
+            except KubernetesApiError as err:
+                raise ApplyError(f"{document.get('kind')}/{metadata.get('name')}: {err}",
+                                 document=document, index=index) from err
+
+            key = (_kind(document["kind"]), target_ns, metadata["name"])
+            with self._lock:
+                live = self._objects.get(key)
+                if live is None:
+                    metadata["uid"] = str(uuid.uuid4())
+                    metadata["creationTimestamp"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+                else:
+                    metadata["uid"] = live["metadata"]["uid"]
+                    metadata["creationTimestamp"] = live["metadata"]["creationTimestamp"]
+                    if "status" in live:
+                        document.setdefault("status", live["status"])
+
+                self._store(document, target_ns, "ADDED" if live is None else "MODIFIED")
+                self.applied.append((document["kind"], target_ns, metadata["name"]))
+
+            if live is None and key[0] == "requestedbackupaction":
+                threading.Thread(target=self._run_script, daemon=True,
+                                 args=(key[0], key[2], key[1], metadata["uid"], self._script_for(key[2]))).start()
+
+    def get(self, kind: str, name: str, ns: str) -> Optional[dict]:
+        self._check_failure("get", name)
+        with self._lock:
+            if _kind(kind) == "namespace":
+                if name not in self._namespaces:
+                    return None
+                return {"apiVersion": "v1", "kind": "Namespace",
+                        "metadata": {"name": name, "annotations": dict(self._namespaces[name])}}
+
+            obj = self._objects.get((_kind(kind), ns, name))
+            return copy.deepcopy(obj) if obj else None
+
+    def list(self, kind: str, ns: str, label_selector: str = '') -> List[dict]:
+        self._check_failure("list")
+        with self._lock:
+            return [copy.deepcopy(obj) for (obj_kind, obj_ns, _), obj in sorted(self._objects.items())
+                    if obj_kind == _kind(kind) and (not ns or obj_ns == ns)
+                    and matches_selector(obj["metadata"].get("labels") or {}, label_selector)]
+
+    def delete(self, kind: str, name: str, ns: str):
+        self._check_failure("delete", name)
+        with self._lock:
+            if (_kind(kind), ns, name) in self._objects:
+                self._remove((_kind(kind), ns, name))
+
+    def watch(self, kind: str, ns: str) -> _FakeWatch:
+        self._check_failure("watch")
+        return _FakeWatch(self, _kind(kind), ns)
+
+    def create_namespace(self, name: str):
+        self._check_failure("create_namespace", name)
+        with self._lock:
+            self._namespaces.setdefault(name, {})
+
+    def delete_namespace(self, name: str, wait: bool = True):
+        self._check_failure("delete_namespace", name)
+        with self._lock:
+            for key in [key for key in self._objects if key[1] == name]:
+                self._remove(key)
+            self._namespaces.pop(name, None)
+
+    def namespaces(self) -> List[str]:
+        with self._lock:
+            return sorted(self._namespaces)
+
+    def logs(self, label_selector: str, ns: str) -> str:
+        return "".join("\n".join(self.pod_logs.get((ns, pod["metadata"]["name"]), [])) + "\n"
+                       for pod in self.list("pod", ns, label_selector))
+
+    def stream_logs(self, pod: str, ns: str, container: str = '') -> _FakeWatch:
+        stream = _FakeWatch(self, "log", ns)
+        for line in self.pod_logs.get((ns, pod), []):
+            stream.push(line)
+        stream.push(_FakeWatch._closed)
+        return stream
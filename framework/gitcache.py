@@ -0,0 +1,156 @@
+import contextlib
+import fcntl
+import hashlib
+import os
+import re
+import subprocess as sp
+from typing import List, Optional
+
+SHA_RE = re.compile(r"^[0-9a-f]{40}$")
+
+
+class GitMirrorCache(object):
+    """
+    Keeps a bare mirror per repository and a `git worktree` per resolved commit:
+
+        <root>/mirrors/<repo>-<url hash>.git
+        <root>/worktrees/<repo>-<url hash>/<commit>
+
+    Only the needed revision is fetched (shallow), and a commit that is already present costs no network round trip.
+    Many revisions of the same repository can be checked out at once, and each worktree is never modified
+    in place, so parallel workers (threads or processes) can share the cache - access is guarded by file locks.
+    """
+
+    _root: str
+    offline: bool
+
+    def __init__(self, root: str, offline: bool = False):
+        """
+        :param offline: Resolve branch names using already fetched refs, without asking the remote
+        """
+        self._root = root
+        self.offline = offline
+        os.makedirs(root + "/mirrors", exist_ok=True)
+        os.makedirs(root + "/worktrees", exist_ok=True)
+
+    @staticmethod
+    def _name(url: str) -> str:
+        repo_name = url.rstrip("/").split("/")[-1].replace(".git", "")
+        return repo_name + "-" + hashlib.sha256(url.encode('utf-8')).hexdigest()[:8]
+
+    def mirror_path(self, url: str) -> str:
+        return f"{self._root}/mirrors/{self._name(url)}.git"
+
+    def worktree_path(self, url: str, commit: str) -> str:
+        return f"{self._root}/worktrees/{self._name(url)}/{commit}"
+
+    @staticmethod
+    def _git(args: List[str], cwd: str) -> str:
+        try:
+            return sp.check_output(["git"] + args, cwd=cwd, stderr=sp.PIPE).decode('utf-8').strip()
+        except sp.CalledProcessError as err:
+            print(err.stderr.decode('utf-8'))
+            raise
+
+    def _has_commit(self, mirror: str, revision: str) -> bool:
+        return sp.call(["git", "cat-file", "-e", revision + "^{commit}"], cwd=mirror,
+                       stdout=sp.DEVNULL, stderr=sp.DEVNULL) == 0
+
+    def _local_ref(self, mirror: str, ref: str) -> Optional[str]:
+        try:
+            return sp.check_output(["git", "rev-parse", "--verify", "--quiet", ref + "^{commit}"], cwd=mirror,
+                                   stderr=sp.DEVNULL).decode('utf-8').strip()
+        except sp.CalledProcessError:
+            return None
+
+    @contextlib.contextmanager
+    def _locked(self, path: str):
+        with open(path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _ensure_mirror(self, url: str) -> str:
+        mirror = self.mirror_path(url)
+        if not os.path.isdir(mirror):
+            os.makedirs(mirror)
+            self._git(["init", "--quiet", "--bare"], cwd=mirror)
+            self._git(["remote", "add", "origin", url], cwd=mirror)
+        return mirror
+
+    def resolve(self, url: str, revision: str) -> str:
+        """
+        Resolves a branch, tag or commit into a commit SHA, fetching it into the mirror when not yet present
+        """
+        with self._locked(self.mirror_path(url)):
+            mirror = self._ensure_mirror(url)
+
+            # commits and tags are immutable - when present, then there is nothing to ask the remote for
+            if SHA_RE.match(revision) and self._has_commit(mirror, revision):
+                return revision
+            commit = self._local_ref(mirror, f"refs/tags/{revision}")
+            if commit:
+                return commit
+            if self.offline:
+                commit = self._local_ref(mirror, f"refs/bmt/heads/{revision}")
+                if commit:
+                    return commit
+
+            if SHA_RE.match(revision):
+                self._git(["fetch", "--quiet", "--depth=1", "origin", revision], cwd=mirror)
+                self._git(["update-ref", f"refs/bmt/commits/{revision}", revision], cwd=mirror)
+                return revision
+
+            remote_ref = self._remote_ref(mirror, revision)
+            local_ref = remote_ref.replace("refs/heads/", "refs/bmt/heads/", 1)
+            self._git(["fetch", "--quiet", "--depth=1", "--no-tags", "origin", f"+{remote_ref}:{local_ref}"],
+                      cwd=mirror)
+
+            return self._local_ref(mirror, local_ref)
+
+    def _remote_ref(self, mirror: str, revision: str) -> str:
+        """
+        Finds a full ref name of a branch or tag on the remote
+        """
+        refs = [line.split("\t")[1] for line in self._git(["ls-remote", "origin", revision], cwd=mirror).splitlines()]
+
+        for candidate in (f"refs/heads/{revision}", f"refs/tags/{revision}", revision):
+            if candidate in refs:
+                return candidate
+
+        raise ValueError(f"Cannot find revision '{revision}' in {mirror}")
+
+    def worktree(self, url: str, revision: str) -> str:
+        """
+        Returns a path to a working tree checked out at given revision
+        """
+        commit = self.resolve(url, revision)
+        path = self.worktree_path(url, commit)
+
+        if os.path.isfile(path + "/.git"):
+            return path
+
+        with self._locked(self.mirror_path(url)):
+            if not os.path.isfile(path + "/.git"):
+                mirror = self.mirror_path(url)
+                self._git(["worktree", "prune"], cwd=mirror)
+                self._git(["worktree", "add", "--quiet", "--detach", path, commit], cwd=mirror)
+
+        return path
+
+
+_default_git_cache: Optional[GitMirrorCache] = None
+
+
+def default_git_cache(root: str) -> GitMirrorCache:
+    """
+    Returns a process-wide cache. SKIP_GIT_PULL=true makes it resolve branches without asking the remote
+    """
+    global _default_git_cache
+
+    if _default_git_cache is None:
+        _default_git_cache = GitMirrorCache(root, offline=os.getenv("SKIP_GIT_PULL") == "true")
+
+    return _default_git_cache
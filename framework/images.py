@@ -0,0 +1,318 @@
+"""
+Keeps third-party images used by test scenarios close to the cluster, so pulls are not on the critical path of tests.
+
+Every scenario directory (e.g. test/data/postgres_backup_test) declares images it needs in `images.txt`,
+images of Helm charts deployed by its skaffold.yaml are resolved with `helm template`. Images are pulled once into
+the local Docker daemon, which outlives clusters, and imported into the k3d cluster with `k3d image import`
+in the background - ahead of the test that needs them.
+
+Images not declared anywhere (e.g. pulled by the controller) go through pull-through cache registries,
+one per upstream registry, which keep pulled layers in a Docker volume across cluster re-creations.
+
+    python -m framework.images test/data/postgres_backup_test   # lists images of a scenario
+"""
+
+import hashlib
+import json
+import os
+import subprocess as sp
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import yaml
+
+from .retry import RetryPolicy, retry
+from .timing import tracer
+
+MANIFEST_FILE = "images.txt"
+
+# upstream registry -> its URL for the pull-through cache
+MIRRORS = {
+    "docker.io": "https://registry-1.docker.io",
+    "ghcr.io": "https://ghcr.io",
+}
+
+PULL_RETRY = RetryPolicy(attempts=3, initial_delay=2, max_delay=10)
+
+
+def normalize_image(image: str) -> str:
+    """
+    Fully qualified name, as containerd reports it: "postgres" -> "docker.io/library/postgres:latest"
+    """
+    name, at, digest = image.partition("@")
+    first, slash, rest = name.partition("/")
+
+    if not slash:
+        name = "docker.io/library/" + name
+    elif "." not in first and ":" not in first and first != "localhost":
+        name = "docker.io/" + name
+
+    if not at and ":" not in name.rsplit("/", 1)[-1]:
+        name += ":latest"
+
+    return name + at + digest
+
+
+def read_manifest(path: str) -> List[str]:
+    """
+    One image per line, "#" starts a comment
+    """
+    if not os.path.isfile(path):
+        return []
+
+    with open(path, "r") as f:
+        lines = [line.split("#", 1)[0].strip() for line in f]
+
+    return [line for line in lines if line]
+
+
+def images_in_documents(documents: Iterable) -> List[str]:
+    """
+    Values of all "image" fields in parsed YAML documents (containers, init containers, CRD templates...)
+    """
+    found = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key == "image" and isinstance(value, str):
+                    found.append(value)
+                else:
+                    walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+
+    for document in documents:
+        walk(document)
+
+    return found
+
+
+def _helm_set_args(values: dict, prefix: str = "") -> List[str]:
+    args = []
+    for key, value in values.items():
+        if isinstance(value, dict):
+            args += _helm_set_args(value, f"{prefix}{key}.")
+        else:
+            args += ["--set", f"{prefix}{key}={json.dumps(value) if isinstance(value, bool) else value}"]
+
+    return args
+
+
+def helm_releases(skaffold_path: str) -> List[dict]:
+    with open(skaffold_path, "r") as f:
+        config = yaml.safe_load(f) or {}
+
+    return ((config.get("deploy") or {}).get("helm") or {}).get("releases") or []
+
+
+def chart_images(release: dict, cache_dir: str) -> List[str]:
+    """
+    Images a Helm release from skaffold.yaml would run. Chart versions are pinned,
+    so `helm template` is called only once for every release and its values
+    """
+    if "remoteChart" not in release:
+        return []  # local charts are built by Skaffold
+
+    key = hashlib.sha256(json.dumps(release, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    cache_path = f"{cache_dir}/chart-{key}.json"
+    if os.path.isfile(cache_path):
+        with open(cache_path, "r") as f:
+            return json.load(f)
+
+    args = ["helm", "template", release.get("name", "release"), release["remoteChart"]]
+    if release.get("repo"):
+        args += ["--repo", release["repo"]]
+    if release.get("version"):
+        args += ["--version", str(release["version"])]
+    args += _helm_set_args(release.get("setValues") or {})
+
+    with tracer.span("helm template", chart=release["remoteChart"]):
+        rendered = sp.check_output(args, stderr=sp.PIPE).decode('utf-8')
+    images = sorted(set(images_in_documents(yaml.safe_load_all(rendered))))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(cache_path + ".tmp", "w") as f:
+        json.dump(images, f)
+    os.replace(cache_path + ".tmp", cache_path)
+
+    return images
+
+
+def scenario_images(path: str, cache_dir: str) -> List[str]:
+    """
+    Declared images of a scenario directory, plus images of its Helm releases
+    """
+    images = read_manifest(f"{path}/{MANIFEST_FILE}")
+
+    if os.path.isfile(f"{path}/skaffold.yaml"):
+        for release in helm_releases(f"{path}/skaffold.yaml"):
+            images += chart_images(release, cache_dir)
+
+    return sorted({normalize_image(image) for image in images})
+
+
+def scenario_dirs(data_dir: str) -> List[str]:
+    return sorted(f"{data_dir}/{name}" for name in os.listdir(data_dir)
+                  if os.path.isfile(f"{data_dir}/{name}/{MANIFEST_FILE}")
+                  or os.path.isfile(f"{data_dir}/{name}/skaffold.yaml"))
+
+
+def cluster_images(cluster: str) -> Set[str]:
+    """
+    Images already present on the cluster's node
+    """
+    output = sp.check_output(["docker", "exec", f"k3d-{cluster}-server-0", "crictl", "images", "-o", "json"],
+                             stderr=sp.DEVNULL)
+
+    return {tag for image in json.loads(output).get("images", []) for tag in image.get("repoTags") or []}
+
+
+def _is_pulled(image: str) -> bool:
+    return sp.run(["docker", "image", "inspect", image], stdout=sp.DEVNULL, stderr=sp.DEVNULL).returncode == 0
+
+
+class ImagePreloader(object):
+    """
+    Pulls images of scenarios into the local Docker daemon and imports them into a cluster, in the background.
+    Each scenario is preloaded once per process and cluster; failures only print a warning -
+    the cluster then pulls the image on its own
+    """
+
+    _cache_dir: str
+    _executor: ThreadPoolExecutor
+    _futures: Dict[Tuple[str, str], Future]
+    _lock: threading.Lock
+
+    def __init__(self, cache_dir: str, max_workers: int = 4):
+        self._cache_dir = cache_dir
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-preloader")
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def prefetch(self, path: str, cluster: str) -> Future:
+        key = (os.path.realpath(path), cluster)
+
+        with self._lock:
+            if key not in self._futures:
+                self._futures[key] = self._executor.submit(self._preload, key[0], cluster)
+
+            return self._futures[key]
+
+    def wait(self, path: str, cluster: str) -> List[str]:
+        """
+        Blocks until images of the scenario are in the cluster. Returns images that were imported
+        """
+        with tracer.span("wait for images", scenario=os.path.basename(path)):
+            return self.prefetch(path, cluster).result()
+
+    def _preload(self, path: str, cluster: str) -> List[str]:
+        try:
+            images = scenario_images(path, self._cache_dir)
+            if not images:
+                return []
+
+            present = cluster_images(cluster)
+            missing = [image for image in images if image not in present]
+            if not missing:
+                return []
+
+            pulled = [image for image in missing if self._pull(image)]
+            if pulled:
+                with tracer.span("k3d image import", images=len(pulled)):
+                    sp.check_output(["k3d", "image", "import", "--cluster", cluster] + pulled, stderr=sp.STDOUT)
+                print(f"Preloaded {len(pulled)} image(s) of {os.path.basename(path)} into {cluster}: "
+                      + ", ".join(pulled))
+
+            return pulled
+        except (sp.CalledProcessError, OSError, ValueError, yaml.YAMLError) as err:
+            print(f"Warning: cannot preload images of {os.path.basename(path)}: {err!r}")
+            return []
+
+    @staticmethod
+    def _pull(image: str) -> bool:
+        if _is_pulled(image):
+            return True
+
+        try:
+            retry(f"docker pull {image}", lambda: sp.check_output(["docker", "pull", "-q", image], stderr=sp.STDOUT),
+                  PULL_RETRY)
+            return True
+        except (sp.CalledProcessError, OSError) as err:
+            print(f"Warning: cannot pull {image}: {err!r}")
+            return False
+
+
+def mirror_name(registry: str) -> str:
+    return "bmt-mirror-" + registry.replace(".", "-")
+
+
+def registries_config(mirrors: Iterable[str]) -> str:
+    """
+    registries.yaml of k3s, pointing upstream registries to their pull-through caches.
+    When a cache is down, containerd falls back to the upstream registry
+    """
+    return yaml.safe_dump({"mirrors": {
+        registry: {"endpoint": [f"http://k3d-{mirror_name(registry)}:5000"]} for registry in mirrors
+    }}, sort_keys=True)
+
+
+def registry_mirror_args(build_dir: str) -> str:
+    """
+    Creates pull-through cache registries (unless they exist) and returns arguments for `k3d cluster create`.
+    Empty when disabled with BMT_REGISTRY_MIRRORS=false, or when the registries cannot be created
+    """
+    if os.getenv("BMT_REGISTRY_MIRRORS") == "false":
+        return ""
+
+    try:
+        for registry, url in MIRRORS.items():
+            name = mirror_name(registry)
+            if sp.run(["docker", "inspect", f"k3d-{name}"], stdout=sp.DEVNULL, stderr=sp.DEVNULL).returncode != 0:
+                sp.check_output(["k3d", "registry", "create", name, "--proxy-remote-url", url,
+                                 "--volume", f"{name}:/var/lib/registry"], stderr=sp.STDOUT)
+
+        config_path = f"{os.path.realpath(build_dir)}/registries.yaml"
+        with open(config_path, "w") as f:
+            f.write(registries_config(MIRRORS))
+    except (sp.CalledProcessError, OSError) as err:
+        output = err.output.decode('utf-8', errors='replace') if isinstance(err, sp.CalledProcessError) else ""
+        print(f"Warning: cannot create pull-through cache registries, images are pulled directly: {err!r} {output}")
+        return ""
+
+    return " ".join(f"--registry-use k3d-{mirror_name(registry)}:5000" for registry in MIRRORS) \
+        + f" --registry-config {config_path}"
+
+
+_default_preloader: Optional[ImagePreloader] = None
+
+
+def default_image_preloader(cache_dir: str) -> Optional[ImagePreloader]:
+    """
+    Returns a process-wide preloader, or None when disabled with BMT_IMAGE_PRELOAD=false
+    """
+    global _default_preloader
+
+    if os.getenv("BMT_IMAGE_PRELOAD") == "false":
+        return None
+    if _default_preloader is None:
+        _default_preloader = ImagePreloader(cache_dir)
+
+    return _default_preloader
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .endtoendbase import BUILD_DIR
+
+    for path in (argv if argv is not None else sys.argv[1:]):
+        for image in scenario_images(path, BUILD_DIR + "/images"):
+            print(image)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
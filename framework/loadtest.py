@@ -0,0 +1,311 @@
+import calendar
+import dataclasses
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from .transport import KubernetesTransport
+from .waiters import RequestedBackupActionWaiter
+
+
+@dataclasses.dataclass(frozen=True)
+class LoadProfile:
+    """
+    N ScheduledBackups spread over collections, M RequestedBackupActions spread over the ScheduledBackups,
+    requested by `concurrency` parallel clients
+    """
+
+    schedules: int = 10
+    actions: int = 50
+    collections: int = 5
+    concurrency: int = 10
+    timeout: float = 3600
+
+
+def load_profile_from_env() -> LoadProfile:
+    """
+    LOADTEST_SCHEDULES, LOADTEST_ACTIONS, LOADTEST_COLLECTIONS, LOADTEST_CONCURRENCY, LOADTEST_TIMEOUT
+    """
+    defaults = LoadProfile()
+
+    return LoadProfile(
+        schedules=int(os.getenv("LOADTEST_SCHEDULES", defaults.schedules)),
+        actions=int(os.getenv("LOADTEST_ACTIONS", defaults.actions)),
+        collections=int(os.getenv("LOADTEST_COLLECTIONS", defaults.collections)),
+        concurrency=int(os.getenv("LOADTEST_CONCURRENCY", defaults.concurrency)),
+        timeout=float(os.getenv("LOADTEST_TIMEOUT", defaults.timeout)),
+    )
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """
+    Nearest-rank percentile
+    """
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def summarize(values: List[Optional[float]]) -> dict:
+    values = [value for value in values if value is not None]
+
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[float]:
+    """
+    Kubernetes timestamp (RFC 3339, UTC) to epoch
+    """
+    if not value:
+        return None
+    return float(calendar.timegm(time.strptime(value, "%Y-%m-%dT%H:%M:%SZ")))
+
+
+def _seconds(start: Optional[float], end: Optional[float]) -> Optional[float]:
+    return round(end - start, 3) if start is not None and end is not None else None
+
+
+@dataclasses.dataclass
+class ActionTiming:
+    """
+    Lifecycle of a single RequestedBackupAction, all times are epoch seconds.
+    Kubernetes timestamps have a 1 second resolution
+    """
+
+    name: str
+    collection: str
+    requested_at: float
+    created_at: Optional[float] = None
+    job_created_at: Optional[float] = None
+    job_started_at: Optional[float] = None
+    job_completed_at: Optional[float] = None
+    healthy_at: Optional[float] = None
+
+    @property
+    def latency(self) -> Optional[float]:
+        """
+        From the request until the action was observed HEALTHY
+        """
+        return _seconds(self.requested_at, self.healthy_at)
+
+    @property
+    def controller_queue(self) -> Optional[float]:
+        """
+        Reconciliation delay: action created -> Job created by backup-maker-controller
+        """
+        return _seconds(self.created_at, self.job_created_at)
+
+    @property
+    def pod_start(self) -> Optional[float]:
+        return _seconds(self.job_created_at, self.job_started_at)
+
+    @property
+    def job_run(self) -> Optional[float]:
+        """
+        Backup itself, including the upload to Backup Repository
+        """
+        return _seconds(self.job_started_at, self.job_completed_at)
+
+    @property
+    def status_report(self) -> Optional[float]:
+        """
+        Job completed -> controller reported the action as HEALTHY
+        """
+        return _seconds(self.job_completed_at, self.healthy_at)
+
+
+def collect_timings(transport: KubernetesTransport, ns: str, timings: Dict[str, ActionTiming]):
+    """
+    Fills cluster-side timestamps from RequestedBackupActions and Jobs they own (one list call per kind)
+    """
+    for action in transport.list("requestedbackupaction", ns):
+        timing = timings.get(action["metadata"]["name"])
+        if timing:
+            timing.created_at = parse_timestamp(action["metadata"].get("creationTimestamp"))
+
+    for job in transport.list("job", ns):
+        for owner in job["metadata"].get("ownerReferences", []):
+            timing = timings.get(owner.get("name"))
+            if not timing:
+                continue
+
+            status = job.get("status", {})
+            timing.job_created_at = parse_timestamp(job["metadata"].get("creationTimestamp"))
+            timing.job_started_at = parse_timestamp(status.get("startTime"))
+            timing.job_completed_at = parse_timestamp(status.get("completionTime"))
+
+
+def version_created_at(version: dict) -> Optional[float]:
+    """
+    Time when Backup Repository accepted a version, as reported by its API
+    """
+    for key in ("createdAt", "creationDate", "created_at"):
+        if version.get(key):
+            try:
+                return parse_timestamp(version[key][:19] + "Z")
+            except ValueError:
+                return None
+    return None
+
+
+def server_accept_delays(timings: List[ActionTiming], versions: Dict[str, List[dict]]) -> List[Optional[float]]:
+    """
+    Approximates how long Backup Repository needed to accept uploads: the server does not know which action
+    uploaded a version, so within a collection the n-th started Job is paired with the n-th created version
+    """
+    delays = []
+
+    for collection, collection_versions in versions.items():
+        started = sorted(timing.job_started_at for timing in timings
+                         if timing.collection == collection and timing.job_started_at is not None)
+        created = sorted(filter(None, (version_created_at(version) for version in collection_versions)))
+
+        delays += [_seconds(start, end) for start, end in zip(started, created)]
+
+    return delays
+
+
+@dataclasses.dataclass
+class LoadTestResult:
+    profile: LoadProfile
+    duration_seconds: float
+    timings: List[ActionTiming]
+    server_accept_seconds: List[Optional[float]]
+    stored_versions: Dict[str, int]
+
+    def to_dict(self) -> dict:
+        healthy = [timing for timing in self.timings if timing.healthy_at is not None]
+
+        return {
+            "profile": dataclasses.asdict(self.profile),
+            "duration_seconds": round(self.duration_seconds, 3),
+            "requested": len(self.timings),
+            "healthy": len(healthy),
+            "throughput_actions_per_second": round(len(healthy) / self.duration_seconds, 4)
+            if self.duration_seconds else None,
+            "latency_seconds": summarize([timing.latency for timing in self.timings]),
+            "controller_queue_seconds": summarize([timing.controller_queue for timing in self.timings]),
+            "pod_start_seconds": summarize([timing.pod_start for timing in self.timings]),
+            "job_run_seconds": summarize([timing.job_run for timing in self.timings]),
+            "status_report_seconds": summarize([timing.status_report for timing in self.timings]),
+            "server_accept_seconds": summarize(self.server_accept_seconds),
+            "stored_versions": self.stored_versions,
+            "not_healthy": sorted(timing.name for timing in self.timings if timing.healthy_at is None),
+        }
+
+
+class LoadGenerator(object):
+    """
+    Drives concurrent backups through backup-maker-controller and Backup Repository.
+
+    Every action is tracked from the request until it is observed HEALTHY (single watch for all of them),
+    then the latency is broken down into stages using timestamps of the action and of its Job
+    """
+
+    _parent: "ClientServerBase"
+    _profile: LoadProfile
+
+    def __init__(self, parent: "ClientServerBase", profile: LoadProfile):
+        self._parent = parent
+        self._profile = profile
+
+    @staticmethod
+    def collection_name(index: int) -> str:
+        return f"load-{index}"
+
+    @staticmethod
+    def schedule_name(index: int) -> str:
+        return f"load-schedule-{index}"
+
+    def prepare(self, access_token: str, template_vars: Callable[[str], str], template_name: str,
+                template_kind: str, email: str):
+        """
+        Creates collections and ScheduledBackups (round-robin over collections) in a single batch
+        """
+        with self._parent.batched_apply():
+            for index in range(self._profile.collections):
+                self._parent.server.i_create_a_collection(
+                    name=self.collection_name(index),
+                    description=f"Load test collection {index}",
+                    filename_template=f"{self.collection_name(index)}-${{version}}.tar.gz",
+                    max_backups_count=self._profile.actions + 1,
+                    max_one_version_size="1G",
+                    max_collection_size="100G",
+                    strategy_name="fifo",
+                )
+
+            for index in range(self._profile.schedules):
+                collection = self.collection_name(index % self._profile.collections)
+                self._parent.client.i_schedule_a_backup(
+                    name=self.schedule_name(index),
+                    operation="backup",
+                    cronjob_enabled=False,
+                    schedule_every="00 02 * * *",
+                    collection_id=collection,
+                    access_token=access_token,
+                    template_name=template_name,
+                    template_kind=template_kind,
+                    email=email,
+                    template_vars=template_vars(collection),
+                )
+
+    def run(self, list_versions: Callable[[str], List[dict]]) -> LoadTestResult:
+        client = self._parent.client
+        names = [f"load-action-{index}" for index in range(self._profile.actions)]
+        timings: Dict[str, ActionTiming] = {}
+        lock = threading.Lock()
+
+        waiter = RequestedBackupActionWaiter(self._parent, ns=client.ns, verbose=False)
+        waiting = ThreadPoolExecutor(max_workers=1)
+        wait_result = waiting.submit(waiter.wait, names, True, self._profile.timeout)
+
+        def request(index: int):
+            schedule = index % self._profile.schedules
+            requested_at = time.time()
+            client.i_request_backup_action(name=names[index], action="backup", ref=self.schedule_name(schedule))
+
+            with lock:
+                timings[names[index]] = ActionTiming(
+                    name=names[index],
+                    collection=self.collection_name(schedule % self._profile.collections),
+                    requested_at=requested_at,
+                )
+
+        started = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=self._profile.concurrency) as executor:
+                list(executor.map(request, range(self._profile.actions)))
+            print(f"Requested {self._profile.actions} actions in {time.monotonic() - started:.1f}s")
+
+            wait_result.result()
+        finally:
+            # when a request failed, the waiter would block the interpreter exit until the timeout
+            waiter.cancel()
+            waiting.shutdown(wait=False, cancel_futures=True)
+        duration = time.monotonic() - started
+
+        for name, reached_at in waiter.reached_at.items():
+            timings[name].healthy_at = reached_at
+        collect_timings(self._parent.transport, client.ns, timings)
+
+        versions = {self.collection_name(index): list_versions(self.collection_name(index))
+                    for index in range(self._profile.collections)}
+
+        return LoadTestResult(
+            profile=self._profile,
+            duration_seconds=duration,
+            timings=list(timings.values()),
+            server_accept_seconds=server_accept_delays(list(timings.values()), versions),
+            stored_versions={collection: len(items) for collection, items in versions.items()},
+        )
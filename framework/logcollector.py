@@ -0,0 +1,224 @@
+import collections
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from .transport import KubernetesTransport, _StreamingWatch
+
+
+def _forever() -> float:
+    """
+    Deadline for streams that are read until closed
+    """
+    return time.monotonic() + 365 * 24 * 3600
+
+
+def matches_selector(labels: Dict[str, str], selector: str) -> bool:
+    """
+    Equality-based label selector, e.g. "app=backup-maker-controller,tier=web"
+    """
+    for requirement in filter(None, (part.strip() for part in selector.split(","))):
+        key, _, value = requirement.partition("=")
+        if labels.get(key.strip()) != value.strip().lstrip("="):
+            return False
+    return True
+
+
+class _ContainerLog(object):
+    """
+    Log of a single container run: rotating file on disk + bounded tail in memory
+    """
+
+    ns: str
+    pod: str
+    container: str
+    labels: Dict[str, str]
+    path: str
+    tail: Deque[str]
+    _handler: logging.handlers.RotatingFileHandler
+
+    def __init__(self, ns: str, pod: str, container: str, restarts: int, labels: Dict[str, str], root: str,
+                 tail_lines: int, max_bytes: int, backup_count: int):
+        self.ns = ns
+        self.pod = pod
+        self.container = container
+        self.labels = labels
+        self.tail = collections.deque(maxlen=tail_lines)
+        self.path = f"{root}/{ns}/{pod}.{container}" + (f".{restarts}" if restarts else "") + ".log"
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # written through the handler directly - a named logger per container would stay registered forever
+        self._handler = logging.handlers.RotatingFileHandler(self.path, maxBytes=max_bytes, backupCount=backup_count)
+        self._handler.setFormatter(logging.Formatter("%(message)s"))
+
+    def write(self, line: str):
+        self.tail.append(line)
+        self._handler.handle(logging.makeLogRecord({"msg": line, "levelno": logging.INFO, "levelname": "INFO"}))
+
+    def close(self):
+        self._handler.close()
+
+
+class LogCollector(object):
+    """
+    Follows logs of all Pods in selected namespaces in the background - including short-living Job Pods,
+    that are often already gone when a test fails.
+
+    Each container gets its own rotating file with timestamped lines, and a bounded in-memory tail
+    that is printed inline when a test fails
+    """
+
+    _transport: Callable[[], KubernetesTransport]
+    _root: str
+    _tail_lines: int
+    _max_bytes: int
+    _backup_count: int
+    _logs: Dict[Tuple[str, str, str, int], _ContainerLog]
+    _streams: Dict[str, List[_StreamingWatch]]
+    _stopped: Dict[str, bool]
+    _lock: threading.Lock
+
+    def __init__(self, transport: Callable[[], KubernetesTransport], root: str, tail_lines: int = 200,
+                 max_bytes: int = 10 * 1024 * 1024, backup_count: int = 3):
+        self._transport = transport
+        self._root = root
+        self._tail_lines = tail_lines
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._logs = {}
+        self._streams = {}
+        self._stopped = {}
+        self._lock = threading.Lock()
+
+    def follow(self, ns: str):
+        """
+        Starts following all Pods of a namespace (no-op if already followed)
+        """
+        with self._lock:
+            if ns in self._stopped and not self._stopped[ns]:
+                return
+            self._stopped[ns] = False
+            self._streams[ns] = []
+
+        threading.Thread(target=self._watch_pods, args=(ns,), name=f"logs-{ns}", daemon=True).start()
+
+    def stop(self, ns: str = None):
+        """
+        Stops following a namespace (or all of them). Tails of its containers are dropped, files are kept
+        """
+        with self._lock:
+            namespaces = [ns] if ns else list(self._stopped)
+            streams = []
+            for name in namespaces:
+                self._stopped[name] = True
+                streams += self._streams.pop(name, [])
+                for key in [key for key in self._logs if key[0] == name]:
+                    del self._logs[key]
+
+        for stream in streams:
+            stream.close()
+
+    def tail(self, ns: str, label_selector: str = '', lines: int = 50) -> str:
+        """
+        Last lines of each container in a namespace, optionally only of Pods matching the selector
+        """
+        with self._lock:
+            logs = [log for key, log in sorted(self._logs.items()) if log.ns == ns
+                    and matches_selector(log.labels, label_selector)]
+
+        out = ""
+        for log in logs:
+            out += f" >>> {log.ns}/{log.pod} [{log.container}] ({log.path})\n"
+            out += "\n".join(list(log.tail)[-lines:]) + "\n"
+
+        return out
+
+    def _register(self, ns: str, stream: _StreamingWatch) -> bool:
+        with self._lock:
+            if self._stopped.get(ns, True):
+                return False
+            self._streams[ns].append(stream)
+            return True
+
+    def _unregister(self, ns: str, stream: _StreamingWatch):
+        with self._lock:
+            if stream in self._streams.get(ns, []):
+                self._streams[ns].remove(stream)
+
+    def _watch_pods(self, ns: str):
+        while not self._stopped.get(ns, True):
+            try:
+                watch = self._transport().watch("pod", ns)
+                if not self._register(ns, watch):
+                    return
+
+                with watch:
+                    for event in watch.events(_forever()):
+                        self._on_pod(ns, event.get("object") or {})
+                self._unregister(ns, watch)
+            except Exception as err:
+                print(f" >>> Cannot watch Pods in '{ns}' for logs: {err!r}")
+
+            # watch closed by the server - reconnect, unless stopped
+            time.sleep(1)
+
+    def _on_pod(self, ns: str, pod: dict):
+        metadata = pod.get("metadata", {})
+        statuses = (pod.get("status", {}).get("initContainerStatuses") or []) + \
+            (pod.get("status", {}).get("containerStatuses") or [])
+
+        for status in statuses:
+            state = status.get("state") or {}
+            if "running" not in state and "terminated" not in state:
+                continue  # logs are not available yet
+
+            key = (ns, metadata.get("name", ""), status["name"], status.get("restartCount", 0))
+            with self._lock:
+                if key in self._logs or self._stopped.get(ns, True):
+                    continue
+                log = self._logs[key] = _ContainerLog(ns, key[1], key[2], key[3], metadata.get("labels") or {},
+                                                      self._root, self._tail_lines, self._max_bytes,
+                                                      self._backup_count)
+
+            threading.Thread(target=self._follow_container, args=(log,), daemon=True,
+                             name=f"logs-{ns}-{key[1]}-{key[2]}").start()
+
+    def _follow_container(self, log: _ContainerLog):
+        try:
+            stream = self._transport().stream_logs(log.pod, log.ns, log.container)
+            if not self._register(log.ns, stream):
+                return
+
+            with stream:
+                for line in stream.events(_forever()):
+                    log.write(line)
+            self._unregister(log.ns, stream)
+        except Exception as err:
+            log.write(f"[bmt] cannot follow logs: {err!r}")
+        finally:
+            log.close()
+
+
+_default_collector: Optional[LogCollector] = None
+
+
+def default_log_collector(transport: Callable[[], KubernetesTransport], root: str) -> Optional[LogCollector]:
+    """
+    Returns a process-wide collector, or None when disabled with BMT_LOG_COLLECTOR=false
+    """
+    global _default_collector
+
+    if os.getenv("BMT_LOG_COLLECTOR") == "false":
+        return None
+    if _default_collector is None:
+        _default_collector = LogCollector(transport, root)
+
+    return _default_collector
+
+
+def stop_log_collector():
+    if _default_collector is not None:
+        _default_collector.stop()
@@ -0,0 +1,271 @@
+import copy
+import dataclasses
+import functools
+import hashlib
+import json
+import os
+import subprocess as sp
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+
+from .transport import KubernetesTransport, KubernetesApiError, ApplyError, parse_documents, read_manifests
+
+CONTENT_HASH_ANNOTATION = "bmt.riotkit.org/content-hash"
+
+# kinds that others depend on go first, e.g. a BackupUser refers to a Secret with its password
+KIND_ORDER = [
+    "Namespace",
+    "CustomResourceDefinition",
+    "ServiceAccount",
+    "ClusterRole",
+    "ClusterRoleBinding",
+    "Role",
+    "RoleBinding",
+    "Secret",
+    "ConfigMap",
+    "PersistentVolumeClaim",
+    "Service",
+    "ClusterBackupProcedureTemplate",
+    "BackupUser",
+    "BackupCollection",
+    "ScheduledBackup",
+    "RequestedBackupAction",
+]
+
+
+def kind_priority(document: dict) -> int:
+    kind = document.get("kind", "")
+    return KIND_ORDER.index(kind) if kind in KIND_ORDER else len(KIND_ORDER)
+
+
+class BatchApplyError(ApplyError):
+    """
+    A document collected in a batch was rejected. Points at the step that produced the document
+    """
+
+    step: str
+
+    def __init__(self, step: str, message: str, document: dict):
+        super().__init__(f"Step '{step}' produced a manifest that was rejected: {message}", document=document)
+        self.step = step
+
+
+@functools.lru_cache(maxsize=512)
+def _parse_cached(content: str) -> Tuple[dict, ...]:
+    return tuple(parse_documents(content))
+
+
+def rendered_documents(content: str) -> List[dict]:
+    """
+    Memoized parse_documents(): scenario steps render the same YAML over and over, parsing is the expensive part.
+    Returns copies, so the caller may modify them
+    """
+    return copy.deepcopy(list(_parse_cached(content)))
+
+
+@functools.lru_cache(maxsize=128)
+def _read_cached(path: str, signature: tuple) -> Tuple[dict, ...]:
+    return tuple(read_manifests(path))
+
+
+def cached_manifests(path: str) -> List[dict]:
+    """
+    Memoized read_manifests(), invalidated when any of the files is modified
+    """
+    files = [os.path.join(path, name) for name in sorted(os.listdir(path))] if os.path.isdir(path) else [path]
+    signature = tuple((file, os.stat(file).st_mtime_ns) for file in files)
+
+    return copy.deepcopy(list(_read_cached(path, signature)))
+
+
+def content_hash(document: dict) -> str:
+    """
+    Hash of the desired state of an object - same content gives the same hash, regardless of key order
+    """
+    document = copy.deepcopy(document)
+    annotations = document.get("metadata", {}).get("annotations") or {}
+    annotations.pop(CONTENT_HASH_ANNOTATION, None)
+
+    return hashlib.sha256(json.dumps(document, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class AppliedHashes(object):
+    """
+    Skips applying objects whose content did not change. Each applied object is annotated with its content hash;
+    an object is skipped when the hash is already known in this session, or when the live object has it.
+
+    Disable with BMT_APPLY_CACHE=false
+    """
+
+    _known: Dict[Tuple[str, str, str, str], str]
+    _lock: threading.Lock
+    skipped: int
+
+    def __init__(self):
+        self._known = {}
+        self._lock = threading.Lock()
+        self.skipped = 0
+
+    @staticmethod
+    def _key(document: dict, ns: str) -> Tuple[str, str, str, str]:
+        metadata = document.get("metadata", {})
+        return document.get("apiVersion", ""), document.get("kind", ""), metadata.get("namespace") or ns, \
+            metadata.get("name", "")
+
+    def prepare(self, transport: KubernetesTransport, document: dict, ns: str) -> Optional[dict]:
+        """
+        Returns the document annotated with its content hash, or None when the object is already up to date
+        """
+        name = document.get("metadata", {}).get("name")
+        if not name:
+            return document
+
+        digest = content_hash(document)
+        key = self._key(document, ns)
+
+        with self._lock:
+            known = self._known.get(key)
+        if known == digest:
+            self.skipped += 1
+            return None
+
+        # not seen in this session - maybe it was applied by a previous one
+        if known is None and self._live_hash(transport, document, key[2]) == digest:
+            self.mark_applied(document, ns, digest)
+            self.skipped += 1
+            return None
+
+        document = copy.deepcopy(document)
+        metadata = document.setdefault("metadata", {})
+        metadata["annotations"] = dict(metadata.get("annotations") or {}, **{CONTENT_HASH_ANNOTATION: digest})
+
+        return document
+
+    def mark_applied(self, document: dict, ns: str, digest: str = None):
+        digest = digest or (document.get("metadata", {}).get("annotations") or {}).get(CONTENT_HASH_ANNOTATION)
+        if digest:
+            with self._lock:
+                self._known[self._key(document, ns)] = digest
+
+    def forget_namespace(self, ns: str):
+        """
+        Objects in a deleted namespace are gone - they must not be skipped when applied again
+        """
+        with self._lock:
+            self._known = {key: digest for key, digest in self._known.items() if key[2] != ns}
+
+    @staticmethod
+    def _live_hash(transport: KubernetesTransport, document: dict, ns: str) -> Optional[str]:
+        try:
+            live = transport.get(document["kind"], document["metadata"]["name"], ns)
+        except (KubernetesApiError, sp.CalledProcessError):
+            return None  # e.g. the CRD is not installed yet
+
+        return ((live or {}).get("metadata", {}).get("annotations") or {}).get(CONTENT_HASH_ANNOTATION)
+
+
+_default_hashes: Optional[AppliedHashes] = None
+
+
+def default_applied_hashes() -> Optional[AppliedHashes]:
+    global _default_hashes
+
+    if os.getenv("BMT_APPLY_CACHE") == "false":
+        return None
+    if _default_hashes is None:
+        _default_hashes = AppliedHashes()
+
+    return _default_hashes
+
+
+def apply_changed(transport: KubernetesTransport, documents: List[dict], ns: str,
+                  hashes: Optional[AppliedHashes]):
+    """
+    Applies only the documents that changed (see AppliedHashes)
+    """
+    if hashes is not None:
+        documents = [document for document in (hashes.prepare(transport, document, ns) for document in documents)
+                     if document is not None]
+    if not documents:
+        return
+
+    transport.apply(documents, ns)
+
+    if hashes is not None:
+        for document in documents:
+            hashes.mark_applied(document, ns)
+
+
+@dataclasses.dataclass
+class _Entry:
+    document: dict
+    ns: str
+    step: str
+
+
+class ManifestBatch(object):
+    """
+    Collects manifests produced by multiple scenario steps, then submits them at once:
+    documents are ordered by dependencies (see KIND_ORDER) and applied in as few requests as possible
+    """
+
+    _entries: List[_Entry]
+
+    def __init__(self):
+        self._entries = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, documents: List[dict], ns: str, step: str):
+        for document in documents:
+            self._entries.append(_Entry(document=document, ns=ns, step=step))
+
+    def submit(self, transport: KubernetesTransport, hashes: Optional[AppliedHashes] = None):
+        entries = sorted(self._entries, key=lambda e: kind_priority(e.document))
+        self._entries = []
+
+        if hashes is not None:
+            entries = [_Entry(document=document, ns=entry.ns, step=entry.step) for entry, document in
+                       ((entry, hashes.prepare(transport, entry.document, entry.ns)) for entry in entries)
+                       if document is not None]
+
+        # neighbours targeting the same namespace are applied together, keeping the dependency order
+        groups: List[List[_Entry]] = []
+        for entry in entries:
+            if groups and groups[-1][0].ns == entry.ns:
+                groups[-1].append(entry)
+            else:
+                groups.append([entry])
+
+        for group in groups:
+            self._submit_group(transport, group)
+
+            if hashes is not None:
+                for entry in group:
+                    hashes.mark_applied(entry.document, entry.ns)
+
+    @staticmethod
+    def _submit_group(transport: KubernetesTransport, group: List[_Entry]):
+        ns = group[0].ns
+
+        try:
+            transport.apply([entry.document for entry in group], ns)
+            return
+        except ApplyError as err:
+            if err.index is not None:
+                failed = group[err.index]
+                print(yaml.safe_dump(failed.document))
+                raise BatchApplyError(failed.step, str(err), failed.document) from err
+
+        # transport could not tell which document failed (e.g. kubectl) - find it by applying one by one
+        for entry in group:
+            try:
+                transport.apply([entry.document], ns)
+            except ApplyError as err:
+                print(yaml.safe_dump(entry.document))
+                raise BatchApplyError(entry.step, str(err), entry.document) from err
+
+        print(f"Applying batch in namespace '{ns}' failed, but each document applied separately succeeded")
@@ -0,0 +1,274 @@
+"""
+Runs the test suite against multiple combinations of component versions (a compatibility matrix).
+
+Every combination (cell) is release.env with some versions replaced. Versions are resolved to commits first,
+so all cells using the same revision share one checkout and one image build (see BuildCache.building()).
+Cells run concurrently, each in its own k3d cluster (see framework.workers) - CRDs of different controller
+versions cannot live in one cluster.
+
+    python -m framework.matrix --axis SERVER_VERSION=main,v4.0.0,v3.9.0 --parallel 3 -- -s --tb=short
+    python -m framework.matrix --cell SERVER_VERSION=v4.0.0,CONTROLLER_VERSION=v1.0.0 -- test/postgres_backup_test.py
+"""
+
+import argparse
+import dataclasses
+import itertools
+import json
+import os
+import queue
+import re
+import subprocess as sp
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from .clientserverbase import CONTROLLER_REPOSITORY, SERVER_REPOSITORY
+from .endtoendbase import BUILD_DIR, EndToEndTestBase, default_git_cache
+
+# version variable -> repository it is resolved in (other variables are passed as they are)
+REPOSITORIES = {
+    "SERVER_VERSION": SERVER_REPOSITORY,
+    "CONTROLLER_VERSION": CONTROLLER_REPOSITORY,
+}
+
+
+@dataclasses.dataclass
+class Cell:
+    name: str
+    release: Dict[str, str]
+    commits: Dict[str, str] = dataclasses.field(default_factory=dict)
+    worker: Optional[int] = None
+    exit_code: Optional[int] = None
+    wall_seconds: float = 0
+    tests: int = 0
+    failures: int = 0
+    errors: int = 0
+    skipped: int = 0
+    test_seconds: float = 0
+    phases: Dict[str, float] = dataclasses.field(default_factory=dict)
+
+    @property
+    def status(self) -> str:
+        if self.exit_code is None:
+            return "not run"
+        if self.exit_code == 0:
+            return "passed"
+        if not self.tests:
+            return f"ERROR (exit {self.exit_code})"
+        return f"FAILED ({self.failures + self.errors}/{self.tests})"
+
+    def pinned_release(self) -> Dict[str, str]:
+        """
+        Release with versions replaced by resolved commits, so every test of the cell uses the same code
+        """
+        return dict(self.release, **self.commits)
+
+
+def parse_assignments(value: str) -> Dict[str, str]:
+    """
+    "SERVER_VERSION=v4.0.0,CONTROLLER_VERSION=main" -> dict
+    """
+    pairs = [part.split("=", 1) for part in value.split(",") if part.strip()]
+    if any(len(pair) != 2 for pair in pairs):
+        raise ValueError(f"Expected NAME=VALUE[,NAME=VALUE...], got '{value}'")
+
+    return {name.strip(): version.strip() for name, version in pairs}
+
+
+def cell_name(release: Dict[str, str], base: Dict[str, str]) -> str:
+    changed = {name: version for name, version in release.items() if base.get(name) != version}
+    if not changed:
+        return "release"
+
+    return "_".join(re.sub(r"[^a-zA-Z0-9.]+", "-", f"{name.replace('_VERSION', '').lower()}-{version}")
+                    for name, version in sorted(changed.items()))
+
+
+def expand_matrix(base: Dict[str, str], axes: Dict[str, List[str]], cells: List[Dict[str, str]]) -> List[Cell]:
+    """
+    Cross product of all axes, plus explicitly listed cells - each applied on top of the base release.
+    Without axes and cells the matrix has the base release only
+    """
+    releases = []
+    if axes:
+        names = sorted(axes)
+        releases += [dict(base, **dict(zip(names, versions)))
+                     for versions in itertools.product(*(axes[name] for name in names))]
+    releases += [dict(base, **cell) for cell in cells]
+    if not releases:
+        releases = [dict(base)]
+
+    unique = []
+    for release in releases:
+        if release not in unique:
+            unique.append(release)
+
+    return [Cell(name=cell_name(release, base), release=release) for release in unique]
+
+
+def resolve_commits(cells: List[Cell], resolve: Callable[[str, str], str]) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Resolves versions of all cells with `resolve(url, version) -> commit`, each distinct version once.
+    Returns the build plan: repository -> {commit: versions resolved to it}
+    """
+    resolved: Dict[tuple, str] = {}
+    plan: Dict[str, Dict[str, List[str]]] = {}
+
+    for cell in cells:
+        for name, url in REPOSITORIES.items():
+            version = cell.release.get(name)
+            if not version:
+                continue
+            if (url, version) not in resolved:
+                resolved[(url, version)] = resolve(url, version)
+
+            commit = resolved[(url, version)]
+            cell.commits[name] = commit
+            versions = plan.setdefault(url, {}).setdefault(commit, [])
+            if version not in versions:
+                versions.append(version)
+
+    return plan
+
+
+def junit_summary(path: str) -> dict:
+    """
+    Counts, total time and time of each top-level phase (from `timing: ...` properties, see test/conftest.py)
+    """
+    root = ElementTree.parse(path).getroot()
+    suites = [root] if root.tag == "testsuite" else root.findall("testsuite")
+    summary = {"tests": 0, "failures": 0, "errors": 0, "skipped": 0, "test_seconds": 0.0, "phases": {}}
+
+    for suite in suites:
+        for key in ("tests", "failures", "errors", "skipped"):
+            summary[key] += int(suite.get(key, 0))
+        summary["test_seconds"] += float(suite.get("time", 0))
+
+        for prop in suite.iter("property"):
+            name = prop.get("name", "")
+            if name.startswith("timing: ") and " > " not in name:
+                phase = name[len("timing: "):]
+                summary["phases"][phase] = round(summary["phases"].get(phase, 0) + float(prop.get("value", 0)), 3)
+
+    return summary
+
+
+def format_table(cells: List[Cell], columns: List[str]) -> str:
+    """
+    Compatibility table in Markdown
+    """
+    header = columns + ["result", "tests", "wall [s]", "tests [s]"]
+    rows = [[cell.release.get(column, "") for column in columns]
+            + [cell.status, str(cell.tests), f"{cell.wall_seconds:.0f}", f"{cell.test_seconds:.0f}"]
+            for cell in cells]
+    widths = [max(len(row[index]) for row in [header] + rows) for index in range(len(header))]
+
+    lines = ["| " + " | ".join(value.ljust(width) for value, width in zip(row, widths)) + " |"
+             for row in [header] + rows]
+    lines.insert(1, "|" + "|".join("-" * (width + 2) for width in widths) + "|")
+
+    return "\n".join(lines)
+
+
+def _write_release(path: str, release: Dict[str, str]):
+    with open(path, "w") as f:
+        for name, value in release.items():
+            f.write(f"{name}={value}\n")
+
+
+def _run_cell(cell: Cell, worker: int, pytest_args: List[str], out_dir: str):
+    release_file = f"{out_dir}/{cell.name}.env"
+    junit_file = f"{out_dir}/{cell.name}.junit.xml"
+    _write_release(release_file, cell.pinned_release())
+
+    env = dict(os.environ, BMT_WORKER=str(worker), BMT_RELEASE_FILE=release_file,
+               BMT_TRACE_FILE=f"{out_dir}/{cell.name}.trace.json",
+               # a daemon keeps the environment of a single release - cells must not attach to it
+               BMT_DAEMON="false")
+    cell.worker = worker
+
+    started = time.monotonic()
+    with open(f"{out_dir}/{cell.name}.log", "wb") as log:
+        proc = sp.Popen([sys.executable, "-m", "pytest", f"--junitxml={junit_file}"] + pytest_args,
+                        env=env, stdout=sp.PIPE, stderr=sp.STDOUT)
+        for line in proc.stdout:
+            log.write(line)
+            sys.stdout.write(f"[{cell.name}] " + line.decode('utf-8', errors='replace'))
+            sys.stdout.flush()
+
+        cell.exit_code = proc.wait()
+    cell.wall_seconds = time.monotonic() - started
+
+    if os.path.isfile(junit_file):
+        for key, value in junit_summary(junit_file).items():
+            setattr(cell, key, value)
+
+
+def run_matrix(cells: List[Cell], parallel: int, pytest_args: List[str], out_dir: str):
+    """
+    Runs cells at most `parallel` at a time. A cell takes a free worker slot, and with it that worker's cluster
+    """
+    slots = queue.Queue()
+    for worker in range(parallel):
+        slots.put(worker)
+
+    def run_in_slot(cell: Cell):
+        worker = slots.get()
+        try:
+            _run_cell(cell, worker, pytest_args, out_dir)
+        finally:
+            slots.put(worker)
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        list(executor.map(run_in_slot, cells))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m framework.matrix", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--axis", action="append", default=[],
+                        help="NAME=version1,version2,... - all versions of a component to combine")
+    parser.add_argument("--cell", action="append", default=[],
+                        help="NAME=version,NAME=version - a single combination")
+    parser.add_argument("--parallel", type=int, default=int(os.getenv("WORKERS", "2")))
+    parser.add_argument("pytest_args", nargs="*", help="Passed to pytest of every cell (after --)")
+    args = parser.parse_args(argv)
+
+    EndToEndTestBase._setup_env()
+    base = dict(EndToEndTestBase.release)
+    axes = {}
+    for axis in args.axis:
+        name, _, versions = axis.partition("=")
+        axes[name.strip()] = [version.strip() for version in versions.split(",") if version.strip()]
+    cells = expand_matrix(base, axes, [parse_assignments(cell) for cell in args.cell])
+
+    git_cache = default_git_cache(BUILD_DIR + "/git")
+    plan = resolve_commits(cells, git_cache.resolve)
+    print(f"{len(cells)} combinations, builds needed:")
+    for url, commits in plan.items():
+        for commit, versions in commits.items():
+            print(f"  {url.split('/')[-1]} {commit[:12]} ({', '.join(versions)})")
+
+    out_dir = f"{BUILD_DIR}/matrix/{time.strftime('%Y%m%d-%H%M%S')}"
+    os.makedirs(out_dir, exist_ok=True)
+
+    # the default cluster creates the registry shared by all clusters - it has to exist before cells start
+    EndToEndTestBase._setup_cluster()
+
+    run_matrix(cells, max(1, min(args.parallel, len(cells))), args.pytest_args, out_dir)
+
+    table = format_table(cells, sorted(set(itertools.chain(*(cell.release for cell in cells)))))
+    print(table)
+    with open(f"{out_dir}/report.md", "w") as f:
+        f.write(table + "\n")
+    with open(f"{out_dir}/report.json", "w") as f:
+        json.dump([dict(dataclasses.asdict(cell), status=cell.status) for cell in cells], f, indent=4)
+    print(f"Reports written to {out_dir}")
+
+    return max(cell.exit_code or 0 for cell in cells)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
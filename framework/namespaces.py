@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from .transport import KubernetesTransport
+
+
+def unique_namespace_name(prefix: str) -> str:
+    """
+    Namespace name unique per test, so a next test does not wait until the previous namespace is terminated
+    """
+    suffix = uuid.uuid4().hex[:8]
+    return f"{prefix[:63 - len(suffix) - 1]}-{suffix}"
+
+
+class NamespaceReaper(object):
+    """
+    Deletes namespaces in the background. Namespace deletion waits for finalizers
+    (e.g. PVCs of a Helm release), which often takes longer than the test itself.
+
+    drain() waits until all scheduled namespaces are gone and returns the ones still terminating.
+    """
+
+    _transport: Callable[[], KubernetesTransport]
+    _poll_interval: float
+    _requested: List[str]
+    _terminating: Dict[str, float]
+    _cond: threading.Condition
+    _thread: Optional[threading.Thread]
+
+    def __init__(self, transport: Callable[[], KubernetesTransport], poll_interval: float = 2):
+        self._transport = transport
+        self._poll_interval = poll_interval
+        self._requested = []
+        self._terminating = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, name: str):
+        with self._cond:
+            self._requested.append(name)
+            self._terminating[name] = time.monotonic()
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="namespace-reaper", daemon=True)
+                self._thread.start()
+
+            self._cond.notify_all()
+
+    def pending(self) -> List[str]:
+        with self._cond:
+            return sorted(self._terminating)
+
+    def drain(self, timeout: float = 300) -> List[str]:
+        """
+        Blocks until all scheduled namespaces are deleted, up to a timeout.
+        Returns names of namespaces that are still terminating
+        """
+        deadline = time.monotonic() + timeout
+
+        with self._cond:
+            while self._terminating and time.monotonic() < deadline:
+                self._cond.wait(min(self._poll_interval, max(deadline - time.monotonic(), 0)))
+
+            return sorted(self._terminating)
+
+    def report_stuck(self, names: List[str]):
+        """
+        Prints why namespaces are stuck in Terminating (e.g. finalizers that could not complete)
+        """
+        for name in names:
+            try:
+                namespace = self._transport().get("namespace", name, ns="") or {}
+            except Exception as err:
+                print(f" >>> Namespace '{name}' is still terminating (cannot get details: {err!r})")
+                continue
+
+            print(f" >>> Namespace '{name}' is still {namespace.get('status', {}).get('phase', 'Terminating')}")
+            for condition in namespace.get("status", {}).get("conditions", []):
+                if condition.get("status") == "True":
+                    print(f"       {condition.get('type')}: {condition.get('message')}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._terminating:
+                    self._cond.wait()
+                requested, self._requested = self._requested, []
+                terminating = [name for name in self._terminating if name not in requested]
+
+            transport = self._transport()
+            gone = []
+
+            for name in requested:
+                try:
+                    transport.delete_namespace(name, wait=False)
+                except Exception as err:
+                    print(f" >>> Cannot delete namespace '{name}': {err!r}")
+                    gone.append(name)
+
+            for name in terminating:
+                try:
+                    if transport.get("namespace", name, ns="") is None:
+                        gone.append(name)
+                except Exception as err:
+                    print(f" >>> Cannot check namespace '{name}': {err!r}")
+
+            with self._cond:
+                for name in gone:
+                    self._terminating.pop(name, None)
+                self._cond.notify_all()
+
+                if not self._requested:
+                    self._cond.wait(self._poll_interval)
+
+
+_default_reaper: Optional[NamespaceReaper] = None
+
+
+def default_namespace_reaper(transport: Callable[[], KubernetesTransport]) -> NamespaceReaper:
+    global _default_reaper
+
+    if _default_reaper is None:
+        _default_reaper = NamespaceReaper(transport)
+
+    return _default_reaper
+
+
+def drain_namespace_reaper():
+    """
+    Called at the end of the test session. BMT_NAMESPACE_DRAIN_TIMEOUT=0 skips waiting
+    """
+    if _default_reaper is None or not _default_reaper.pending():
+        return
+
+    timeout = float(os.getenv("BMT_NAMESPACE_DRAIN_TIMEOUT", "300"))
+    print(f"Waiting up to {timeout:.0f}s for namespaces to terminate: {', '.join(_default_reaper.pending())}")
+    stuck = _default_reaper.drain(timeout)
+
+    if stuck:
+        _default_reaper.report_stuck(stuck)
@@ -0,0 +1,224 @@
+import dataclasses
+import socket
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .retry import wait_until
+from .transport import KubernetesTransport
+
+Probe = Callable[[int], bool]
+
+
+def free_port() -> int:
+    """
+    Asks the OS for a free local port
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _is_free(port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        try:
+            sock.bind(("127.0.0.1", port))
+            return True
+        except OSError:
+            return False
+
+
+def tcp_probe(local_port: int) -> bool:
+    try:
+        with socket.create_connection(("127.0.0.1", local_port), timeout=2):
+            return True
+    except OSError:
+        return False
+
+
+def http_probe(path: str = "/") -> Probe:
+    """
+    Any HTTP response means the whole tunnel works, not only the local listener
+    """
+    import requests
+
+    def probe(local_port: int) -> bool:
+        try:
+            return requests.get(f"http://127.0.0.1:{local_port}{path}", timeout=2).status_code < 500
+        except requests.RequestException:
+            return False
+
+    probe.spec = f"http:{path}"
+    return probe
+
+
+def postgres_probe(local_port: int) -> bool:
+    """
+    Sends SSLRequest - PostgreSQL answers with a single byte 'S' or 'N' without authentication
+    """
+    try:
+        with socket.create_connection(("127.0.0.1", local_port), timeout=2) as sock:
+            sock.sendall(struct.pack("!ii", 8, 80877103))
+            return sock.recv(1) in (b"S", b"N")
+    except OSError:
+        return False
+
+
+tcp_probe.spec = "tcp"
+postgres_probe.spec = "postgres"
+
+
+def probe_spec(probe: Probe) -> str:
+    """
+    Serializable name of a probe, to ask another process (see framework.daemon) for a forward
+    """
+    return getattr(probe, "spec", "tcp")
+
+
+def probe_from_spec(spec: str) -> Probe:
+    if spec.startswith("http:"):
+        return http_probe(spec[len("http:"):])
+    return {"tcp": tcp_probe, "postgres": postgres_probe}[spec]
+
+
+@dataclasses.dataclass
+class _Forward:
+    ns: str
+    pod_label: str
+    remote_port: int
+    local_port: int
+    pod_name: str
+
+
+class PortForwardPool(object):
+    """
+    Port-forwards keyed by (namespace, label selector, remote port), reused across tests.
+
+    Local ports are allocated dynamically. A forward is returned only after the probe confirms it works,
+    and is re-established (on the same local port, if possible) when the target Pod was replaced or stopped responding.
+
+    Forwards can be stopped only per Pod, so forwards to other ports of the same Pod keep it running
+    until the last of them is released.
+    """
+
+    _transport: Callable[[], KubernetesTransport]
+    _forwards: Dict[Tuple[str, str, int], _Forward]
+    _lock: threading.Lock
+    _ready_timeout: float
+
+    def __init__(self, transport: Callable[[], KubernetesTransport], ready_timeout: float = 60):
+        self._transport = transport
+        self._forwards = {}
+        self._lock = threading.Lock()
+        self._ready_timeout = ready_timeout
+
+    def get(self, ns: str, pod_label: str, remote_port: int, probe: Probe = tcp_probe,
+            local_port: int = 0) -> int:
+        """
+        Returns a local port forwarded to a running Pod matching the label
+        """
+        key = (ns, pod_label, remote_port)
+
+        with self._lock:
+            deadline = time.monotonic() + self._ready_timeout
+            pod_name = self._wait_for_pod(ns, pod_label, deadline)
+            current = self._forwards.get(key)
+
+            if current and current.pod_name == pod_name and probe(current.local_port):
+                return current.local_port
+
+            if current:
+                print(f"Re-establishing port-forward to {ns}/{pod_label}:{remote_port} (pod: {pod_name})")
+                self._release(key)
+
+            if not local_port:
+                # keep the old port, so already configured clients (URLs, connection pools) are still valid
+                local_port = current.local_port if current and _is_free(current.local_port) else free_port()
+
+            forward = _Forward(ns=ns, pod_label=pod_label, remote_port=remote_port,
+                               local_port=local_port, pod_name=pod_name)
+            self._start(forward, probe, deadline)
+            self._forwards[key] = forward
+
+            return local_port
+
+    def forwards(self) -> List[dict]:
+        with self._lock:
+            return [dataclasses.asdict(forward) for _, forward in sorted(self._forwards.items())]
+
+    def stop_namespace(self, ns: str):
+        """
+        Stops forwards into a namespace that is being deleted
+        """
+        with self._lock:
+            for key in [key for key in self._forwards if key[0] == ns]:
+                self._release(key)
+
+    def stop_all(self):
+        with self._lock:
+            for key in list(self._forwards):
+                self._release(key)
+
+    def _in_use(self, ns: str, pod_name: str) -> bool:
+        return any(forward.ns == ns and forward.pod_name == pod_name for forward in self._forwards.values())
+
+    def _release(self, key: Tuple[str, str, int]):
+        """
+        Drops a forward from the pool, the Pod's forwards are stopped when no other pooled forward uses the Pod
+        """
+        forward = self._forwards.pop(key)
+        if not self._in_use(forward.ns, forward.pod_name):
+            self._stop(forward)
+
+    def _wait_for_pod(self, ns: str, pod_label: str, deadline: float) -> str:
+        """
+        Finds a running Pod. During a rollout the old Pod can be still listed, so the newest one is preferred
+        """
+        pods = []
+
+        def found() -> bool:
+            pods[:] = [pod for pod in self._transport().list("pod", ns, pod_label)
+                       if pod.get("status", {}).get("phase") == "Running"
+                       and not pod["metadata"].get("deletionTimestamp")]
+            return bool(pods)
+
+        if not wait_until(found, deadline - time.monotonic(), initial_delay=0.25):
+            raise TimeoutError(f"Cannot make a port-forward, running Pod not found for label {pod_label} in {ns}")
+
+        pods.sort(key=lambda pod: pod["metadata"].get("creationTimestamp", ""), reverse=True)
+        return pods[0]["metadata"]["name"]
+
+    def _start(self, forward: _Forward, probe: Probe, deadline: float):
+        import _portforward as portforward
+        import portforward as portforwardpub
+
+        portforward.forward(forward.ns, forward.pod_name, forward.local_port, forward.remote_port,
+                            portforwardpub._config_path(None), portforwardpub.LogLevel.ERROR.value, "")
+
+        if not wait_until(lambda: probe(forward.local_port), deadline - time.monotonic()):
+            if not self._in_use(forward.ns, forward.pod_name):
+                self._stop(forward)
+            raise TimeoutError(f"Port-forward to {forward.ns}/{forward.pod_name}:{forward.remote_port} "
+                               f"at localhost:{forward.local_port} is not responding")
+
+    @staticmethod
+    def _stop(forward: _Forward):
+        import _portforward as portforward
+
+        try:
+            portforward.stop(forward.ns, forward.pod_name)
+        except Exception:
+            pass
+
+
+_default_pool: Optional[PortForwardPool] = None
+
+
+def default_port_forward_pool(transport: Callable[[], KubernetesTransport]) -> PortForwardPool:
+    global _default_pool
+
+    if _default_pool is None:
+        _default_pool = PortForwardPool(transport)
+
+    return _default_pool
@@ -1,6 +1,121 @@
+import contextlib
 import dataclasses
+import io
+import itertools
+import uuid
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
-import psycopg2
+if TYPE_CHECKING:
+    from psycopg2.pool import ThreadedConnectionPool
+
+
+def _copy_value(value) -> str:
+    """
+    Encodes a value for COPY ... FROM STDIN in the default text format
+    """
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "\\\\x" + bytes(value).hex()
+
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+class _CopyReader(io.TextIOBase):
+    """
+    File-like object producing COPY text format from a generator of rows, without holding all rows in memory
+    """
+
+    _rows: Iterator[Sequence]
+    _leftover: str
+    rows_count: int
+
+    def __init__(self, rows: Iterable[Sequence]):
+        self._rows = iter(rows)
+        self._leftover = ""
+        self.rows_count = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> str:
+        # rows are joined once per call - growing a string row by row copies the whole chunk each time
+        parts = [self._leftover]
+        length = len(self._leftover)
+
+        while size < 0 or length < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            line = "\t".join(_copy_value(value) for value in row) + "\n"
+            parts.append(line)
+            length += len(line)
+            self.rows_count += 1
+
+        chunk = "".join(parts)
+        if size < 0 or length <= size:
+            self._leftover = ""
+            return chunk
+
+        # only the part of the last row that did not fit is kept for the next call
+        self._leftover = chunk[size:]
+        return chunk[:size]
+
+
+# order-independent hash of a table: sum of the first 64 bits of md5 of each row's text representation,
+# summed as numeric, so it never overflows. Same rows in any physical order give the same sum
+_ROW_HASH_SQL = "coalesce(sum(('x' || substr(md5(t::text), 1, 16))::bit(64)::bigint::numeric), 0)"
+
+
+@dataclasses.dataclass
+class ChunkFingerprint:
+    """
+    Rows with primary key in range [lower, upper)
+    """
+
+    lower: int
+    upper: int
+    rows: int
+    hash: int
+
+
+@dataclasses.dataclass
+class TableFingerprint:
+    """
+    Row count and an order-independent hash of a table, computed inside Postgres - optionally per primary key range
+    """
+
+    table: str
+    rows: int
+    hash: int
+    chunk_rows: Optional[int] = None
+    chunks: List[ChunkFingerprint] = dataclasses.field(default_factory=list)
+
+    def matches(self, other: "TableFingerprint") -> bool:
+        return (self.rows, self.hash) == (other.rows, other.hash)
+
+    def differing_ranges(self, other: "TableFingerprint") -> List[Tuple[int, int]]:
+        """
+        Primary key ranges [lower, upper) that differ between two chunked fingerprints, adjacent ranges are merged
+        """
+        ours: Dict[int, ChunkFingerprint] = {chunk.lower: chunk for chunk in self.chunks}
+        theirs: Dict[int, ChunkFingerprint] = {chunk.lower: chunk for chunk in other.chunks}
+        ranges: List[Tuple[int, int]] = []
+
+        for lower in sorted(set(ours) | set(theirs)):
+            chunk, other_chunk = ours.get(lower), theirs.get(lower)
+            if chunk and other_chunk and (chunk.rows, chunk.hash) == (other_chunk.rows, other_chunk.hash):
+                continue
+
+            upper = (chunk or other_chunk).upper
+            if ranges and ranges[-1][1] == lower:
+                ranges[-1] = (ranges[-1][0], upper)
+            else:
+                ranges.append((lower, upper))
+
+        return ranges
 
 
 @dataclasses.dataclass
@@ -10,19 +125,266 @@ class PostgresTestingHelper(object):
     host: str
     password: str
     port: int
+    max_connections: int = 4
+    # creating and dropping databases (see reset()) needs a role with CREATEDB, connected to another database
+    admin_user: Optional[str] = None
+    admin_password: Optional[str] = None
+    maintenance_db: str = "postgres"
+    _pool: Optional["ThreadedConnectionPool"] = dataclasses.field(default=None, init=False, repr=False, compare=False)
+
+    def __enter__(self) -> "PostgresTestingHelper":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _get_pool(self) -> "ThreadedConnectionPool":
+        from psycopg2.pool import ThreadedConnectionPool  # imported on first use, it is slow to import
+
+        if self._pool is None or self._pool.closed:
+            self._pool = ThreadedConnectionPool(
+                0, self.max_connections,
+                dbname=self.db_name, user=self.user, host=self.host, password=self.password, port=self.port,
+            )
+        return self._pool
+
+    def close(self):
+        """
+        Closes all pooled connections
+        """
+        if self._pool is not None and not self._pool.closed:
+            self._pool.closeall()
+        self._pool = None
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Borrows a connection from the pool. The transaction is committed at the end of the block,
+        or rolled back on error
+        """
+        import psycopg2
+
+        pool = self._get_pool()
+        conn = pool.getconn()
+        broken = False
+
+        try:
+            yield conn
+            conn.commit()
+        except psycopg2.InterfaceError:
+            broken = True
+            raise
+        except:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn, close=broken or bool(conn.closed))
+
+    def query(self, query: str, params: Sequence = None):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute(query, params)
+
+    def select(self, query: str, params: Sequence = None) -> List[tuple]:
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute(query, params)
+            return cur.fetchall()
+
+    def stream(self, query: str, params: Sequence = None, batch_size: int = 10000) -> Iterator[tuple]:
+        """
+        Iterates over a large result set using a server-side (named) cursor,
+        fetching `batch_size` rows at a time instead of the whole result
+        """
+        with self.connection() as conn, conn.cursor(name=f"bmt_{uuid.uuid4().hex}") as cur:
+            cur.itersize = batch_size
+            cur.execute(query, params)
+
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+
+    def copy_rows(self, table: str, rows: Iterable[Sequence], columns: Sequence[str] = None,
+                  buffer_size: int = 1024 * 1024) -> int:
+        """
+        Bulk loads rows produced by a generator using COPY ... FROM STDIN. Returns number of loaded rows
+        """
+        reader = _CopyReader(rows)
+        columns_sql = "(" + ", ".join(columns) + ")" if columns else ""
+
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.copy_expert(f"COPY {table} {columns_sql} FROM STDIN", reader, size=buffer_size)
+
+        return reader.rows_count
+
+    def copy_batches(self, table: str, rows: Iterable[Sequence], batch_rows: int,
+                     columns: Sequence[str] = None) -> int:
+        """
+        Like copy_rows(), but commits every `batch_rows` rows, so a huge load does not end up in one transaction
+        """
+        rows = iter(rows)
+        total = 0
+
+        while True:
+            loaded = self.copy_rows(table, itertools.islice(rows, batch_rows), columns)
+            total += loaded
+            if loaded < batch_rows:
+                return total
+
+    def primary_key(self, table: str) -> Optional[str]:
+        """
+        Name of the primary key column, if the table has a single-column integer primary key
+        """
+        rows = self.select("""
+            SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+              FROM pg_index i
+              JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+             WHERE i.indrelid = %s::regclass AND i.indisprimary
+        """, (table,))
+
+        if len(rows) != 1 or rows[0][1] not in ("smallint", "integer", "bigint"):
+            return None
+        return rows[0][0]
+
+    def table_fingerprint(self, table: str, chunk_rows: int = None) -> TableFingerprint:
+        """
+        Row count and order-independent hash of all rows, computed by Postgres - only a few bytes are transferred.
+
+        With `chunk_rows` the hash is also computed per primary key range of that width (one scan),
+        so a later mismatch can be narrowed down to the ranges that differ
+        """
+        pk = self.primary_key(table) if chunk_rows else None
+        if not pk:
+            rows, hash_sum = self.select(f"SELECT count(*), {_ROW_HASH_SQL} FROM {table} AS t")[0]
+            return TableFingerprint(table=table, rows=rows, hash=int(hash_sum))
+
+        chunks = [
+            ChunkFingerprint(lower=bucket * chunk_rows, upper=(bucket + 1) * chunk_rows, rows=rows, hash=int(hash_sum))
+            for bucket, rows, hash_sum in self.select(
+                f"SELECT floor(t.{pk}::numeric / %s)::bigint AS bucket, count(*), {_ROW_HASH_SQL} "
+                f"FROM {table} AS t GROUP BY bucket ORDER BY bucket", (chunk_rows,))
+        ]
+
+        return TableFingerprint(table=table, rows=sum(chunk.rows for chunk in chunks),
+                                hash=sum(chunk.hash for chunk in chunks), chunk_rows=chunk_rows, chunks=chunks)
+
+    def fingerprint(self, tables: Sequence[str] = None, chunk_rows: int = None) -> Dict[str, TableFingerprint]:
+        """
+        Fingerprints of given tables, or of all tables in the "public" schema
+        """
+        if tables is None:
+            tables = [row[0] for row in self.select(
+                "SELECT 'public.' || tablename FROM pg_tables WHERE schemaname = 'public' ORDER BY tablename")]
+
+        return {table: self.table_fingerprint(table, chunk_rows) for table in tables}
+
+    def verify_fingerprint(self, expected: Dict[str, TableFingerprint]) -> List[str]:
+        """
+        Compares current state with previously taken fingerprints. Returns a description of each difference
+        (empty when the data is identical).
+
+        Whole tables are compared first; only when a table differs, it is fingerprinted again per primary key
+        range, to report which ranges differ
+        """
+        differences = []
+
+        for table, before in expected.items():
+            if not self.select("SELECT to_regclass(%s)", (table,))[0][0]:
+                differences.append(f"{table}: table is missing")
+                continue
+
+            after = self.table_fingerprint(table)
+            if after.matches(before):
+                continue
+
+            message = f"{table}: {before.rows} rows expected, {after.rows} found, hash {before.hash} != {after.hash}"
+            if before.chunk_rows:
+                ranges = before.differing_ranges(self.table_fingerprint(table, before.chunk_rows))
+                message += ", differing primary key ranges: " + ", ".join(f"[{lo}, {up})" for lo, up in ranges)
+
+            differences.append(message)
+
+        return differences
+
+    # ---
+    #  Template databases
+    # ---
+
+    @contextlib.contextmanager
+    def _admin_cursor(self):
+        """
+        Autocommit connection to the maintenance database - CREATE/DROP DATABASE cannot run in a transaction,
+        nor while connected to the database itself
+        """
+        import psycopg2
+
+        conn = psycopg2.connect(dbname=self.maintenance_db, user=self.admin_user or self.user, host=self.host,
+                                password=self.admin_password or self.password, port=self.port)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                yield cur
+        finally:
+            conn.close()
+
+    def database_exists(self, name: str) -> bool:
+        with self._admin_cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (name,))
+            return cur.fetchone() is not None
+
+    def reset(self, template: str = "template0"):
+        """
+        Re-creates the database as a copy of a template database - a file-level copy, much faster than
+        re-creating and filling tables. Connections to the database are terminated
+        """
+        from psycopg2 import sql
+
+        self.close()
+        with self._admin_cursor() as cur:
+            cur.execute(sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(sql.Identifier(self.db_name)))
+            cur.execute(sql.SQL("CREATE DATABASE {} TEMPLATE {} OWNER {}").format(
+                sql.Identifier(self.db_name), sql.Identifier(template), sql.Identifier(self.user)))
+
+    def snapshot(self, template: str):
+        """
+        Saves the current content of the database as a template database. The template does not accept
+        connections, so nothing can block copying it
+        """
+        from psycopg2 import sql
+
+        self.close()
+        with self._admin_cursor() as cur:
+            # a template is copied only when nobody is connected to it
+            cur.execute("SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+                        "WHERE datname = %s AND pid <> pg_backend_pid()", (self.db_name,))
+            cur.execute(sql.SQL("CREATE DATABASE {} TEMPLATE {}").format(
+                sql.Identifier(template), sql.Identifier(self.db_name)))
+            cur.execute(sql.SQL("ALTER DATABASE {} WITH IS_TEMPLATE true ALLOW_CONNECTIONS false").format(
+                sql.Identifier(template)))
 
-    def query(self, query: str):
-        cur = self.connect()
-        cur.execute(query)
+    def drop_template(self, template: str):
+        from psycopg2 import sql
 
-    def select(self, query: str):
-        cur = self.connect()
-        cur.execute(query)
+        with self._admin_cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (template,))
+            if cur.fetchone():
+                cur.execute(sql.SQL("ALTER DATABASE {} WITH IS_TEMPLATE false").format(sql.Identifier(template)))
+                cur.execute(sql.SQL("DROP DATABASE {}").format(sql.Identifier(template)))
 
-        return cur.fetchall()
+    def reset_from_template(self, template: str, seed: Callable[[], None]) -> bool:
+        """
+        Resets the database to the dataset of `seed`. The dataset is built only the first time - into an empty
+        database, which is then snapshotted as `template`; later calls (also in later sessions, as long as
+        the Postgres instance lives) only copy the template. Returns True when `seed` was called.
 
-    def connect(self):
-        conn = psycopg2.connect(
-            f"dbname='{self.db_name}' user='{self.user}' host='{self.host}' password='{self.password}' port='{self.port}'")
+        The template name has to change together with what `seed` creates
+        """
+        if self.database_exists(template):
+            self.reset(template)
+            return False
 
-        return conn.cursor()
+        self.reset()
+        seed()
+        self.snapshot(template)
+        return True
@@ -0,0 +1,188 @@
+import dataclasses
+import functools
+import itertools
+import random
+import re
+import subprocess as sp
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, TypeVar
+
+from .timing import tracer
+from .transport import ApplyError, KubernetesApiError
+
+T = TypeVar("T")
+
+# HTTP statuses of the API server worth retrying: throttling, conflicts of concurrent updates, server errors
+TRANSIENT_HTTP_STATUSES = (409, 429, 500, 502, 503, 504)
+
+
+def is_transient(err: BaseException) -> bool:
+    """
+    Default classification: failures of the environment (network, API server, commands like `skaffold`
+    pushing to the registry) are transient, errors in the test or in manifests are fatal
+    """
+    import requests
+
+    if isinstance(err, ApplyError):
+        # kubectl exits with an error also when the manifest is invalid - a rejection must not be retried
+        if isinstance(err.__cause__, sp.CalledProcessError):
+            return False
+        return isinstance(err.__cause__, BaseException) and is_transient(err.__cause__)
+    if isinstance(err, KubernetesApiError):
+        return err.status in TRANSIENT_HTTP_STATUSES
+    if isinstance(err, requests.HTTPError):
+        return err.response is not None and err.response.status_code in TRANSIENT_HTTP_STATUSES
+
+    return isinstance(err, (sp.CalledProcessError, sp.TimeoutExpired, TimeoutError, ConnectionError,
+                            requests.ConnectionError, requests.Timeout))
+
+
+# output of a failed command (skaffold, helm, docker) caused by the registry or the network, not by the build itself
+NETWORK_FAILURE_PATTERN = re.compile(
+    r"connection refused|connection reset|broken pipe|i/o timeout|tls handshake timeout|no such host"
+    r"|context deadline exceeded|timeout awaiting response headers|unexpected eof|toomanyrequests"
+    r"|50[234] (bad gateway|service unavailable|gateway timeout)|error pushing|failed to push|unable to connect",
+    re.IGNORECASE)
+
+
+def is_network_failure(err: BaseException) -> bool:
+    """
+    Classification for commands that fail both on bad input (compile errors, invalid charts) and on the network:
+    a failed command is retried only when its output tells it was the network or the registry
+    """
+    if isinstance(err, sp.CalledProcessError):
+        output = err.output or b""
+        if isinstance(output, bytes):
+            output = output.decode('utf-8', errors='replace')
+        return NETWORK_FAILURE_PATTERN.search(output) is not None
+
+    return is_transient(err)
+
+
+@dataclasses.dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Exponential backoff with jitter, limited by number of attempts and by an overall deadline (in seconds)
+    """
+
+    attempts: int = 5
+    initial_delay: float = 1
+    max_delay: float = 30
+    multiplier: float = 2
+    jitter: float = 0.2
+    deadline: Optional[float] = None
+    classify: Callable[[BaseException], bool] = is_transient
+
+    def delays(self) -> Iterator[float]:
+        """
+        Delays before 2nd, 3rd, ... attempt. Each is randomized by +/- `jitter`, so parallel clients
+        do not retry in lockstep
+        """
+        delay = self.initial_delay
+        for _ in range(self.attempts - 1):
+            yield max(0.0, delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+            delay = min(delay * self.multiplier, self.max_delay)
+
+
+@dataclasses.dataclass
+class Attempt:
+    operation: str
+    number: int
+    seconds: float
+    error: Optional[str]
+
+
+class RetryStats(object):
+    """
+    Every attempt of every retried operation in this process, to see what is flaky and how much it costs
+    """
+
+    _attempts: List[Attempt]
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._attempts = []
+        self._lock = threading.Lock()
+
+    def record(self, attempt: Attempt):
+        with self._lock:
+            self._attempts.append(attempt)
+
+    def attempts(self, operation: str = None) -> List[Attempt]:
+        with self._lock:
+            return [attempt for attempt in self._attempts if operation is None or attempt.operation == operation]
+
+    def summary(self) -> Dict[str, dict]:
+        """
+        Only operations that failed at least once
+        """
+        summary = {}
+        for attempt in self.attempts():
+            entry = summary.setdefault(attempt.operation, {"attempts": 0, "failures": 0, "seconds": 0.0})
+            entry["attempts"] += 1
+            entry["failures"] += 1 if attempt.error else 0
+            entry["seconds"] = round(entry["seconds"] + attempt.seconds, 3)
+
+        return {operation: entry for operation, entry in summary.items() if entry["failures"]}
+
+
+retry_stats = RetryStats()
+
+
+def retry(operation: str, func: Callable[[], T], policy: RetryPolicy = RetryPolicy()) -> T:
+    """
+    Calls `func` until it succeeds. Fatal errors (see RetryPolicy.classify) and the error of the last attempt
+    are raised as they are
+    """
+    started = time.monotonic()
+    delays = policy.delays()
+
+    for number in itertools.count(1):
+        attempt_started = time.monotonic()
+        try:
+            with tracer.span(operation if number == 1 else f"{operation} (attempt {number})"):
+                result = func()
+            retry_stats.record(Attempt(operation, number, time.monotonic() - attempt_started, None))
+            return result
+        except Exception as err:
+            retry_stats.record(Attempt(operation, number, time.monotonic() - attempt_started, repr(err)))
+
+            delay = next(delays, None)
+            if not policy.classify(err) or delay is None:
+                raise
+            if policy.deadline is not None and time.monotonic() + delay - started > policy.deadline:
+                raise
+
+            print(f" >>> {operation} failed (attempt {number}/{policy.attempts}): {err!r}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def wait_until(condition: Callable[[], bool], timeout: float, initial_delay: float = 0.05,
+               max_delay: float = 1) -> bool:
+    """
+    Polls a condition with exponential backoff until it is true, or until the timeout passes
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+
+    while not condition():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+    return True
+
+
+def retrying(operation: str = None, policy: RetryPolicy = RetryPolicy()) -> Callable:
+    """
+    Decorator version of retry()
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return retry(operation or func.__qualname__, lambda: func(*args, **kwargs), policy)
+        return wrapper
+    return decorator
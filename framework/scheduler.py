@@ -0,0 +1,198 @@
+"""
+Runs the test suite in parallel workers, each one against its own k3d cluster (see framework.workers).
+
+Tests are assigned to workers by their durations recorded in previous runs (.build/durations.json),
+using the Longest Processing Time first rule: the longest test goes to the least loaded worker.
+
+    python -m framework.scheduler --workers 4 -- -s --tb=short
+"""
+
+import argparse
+import contextlib
+import fcntl
+import heapq
+import json
+import os
+import statistics
+import subprocess as sp
+import sys
+import tempfile
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+DEFAULT_DURATION = 60.0
+# unit tests of the framework take milliseconds, their durations are not recorded (see test/conftest.py)
+UNIT_TEST_DURATION = 0.1
+
+# test/conftest.py writes node ids of end-to-end tests into this file, when collecting for the schedule
+E2E_TESTS_FILE_ENV = "BMT_E2E_TESTS_FILE"
+
+
+@contextlib.contextmanager
+def _locked(path: str):
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def load_durations(path: str) -> Dict[str, float]:
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def record_durations(path: str, durations: Dict[str, float], smoothing: float = 0.5):
+    """
+    Merges durations of finished tests into the history. Workers write at the same time, so the file is locked.
+    Each value is smoothed with the previous one, so a single slow run does not reshuffle the whole schedule
+    """
+    if not durations:
+        return
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _locked(path):
+        history = load_durations(path)
+        for test, seconds in durations.items():
+            previous = history.get(test)
+            history[test] = round(seconds if previous is None else smoothing * seconds + (1 - smoothing) * previous, 3)
+
+        with open(path + ".tmp", "w") as f:
+            json.dump(history, f, indent=4, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+
+def estimate(tests: List[str], durations: Dict[str, float], e2e: Optional[Set[str]] = None) -> Dict[str, float]:
+    """
+    Expected duration of each test. End-to-end tests without history are assumed to take as long as a typical
+    known one, unit tests (not in `e2e`, when given) take almost nothing
+    """
+    known = [durations[test] for test in tests if test in durations]
+    default = statistics.median(known) if known else DEFAULT_DURATION
+
+    return {test: durations.get(test, default if e2e is None or test in e2e else UNIT_TEST_DURATION)
+            for test in tests}
+
+
+def assign(tests: List[str], durations: Dict[str, float], workers: int,
+           e2e: Optional[Set[str]] = None) -> List[List[str]]:
+    """
+    Longest Processing Time first, by estimated durations (see estimate())
+    """
+    estimates = estimate(tests, durations, e2e)
+    estimated = sorted(tests, key=lambda test: (-estimates[test], test))
+
+    loads = [(0.0, index) for index in range(workers)]
+    buckets: List[List[str]] = [[] for _ in range(workers)]
+
+    for test in estimated:
+        load, index = heapq.heappop(loads)
+        buckets[index].append(test)
+        heapq.heappush(loads, (load + estimates[test], index))
+
+    return buckets
+
+
+# options of pytest changing which tests run - the schedule has to be made for the same tests
+_SELECTION_OPTIONS = ("-k", "-m", "--deselect", "--ignore", "--ignore-glob")
+
+
+def selection_args(pytest_args: List[str]) -> List[str]:
+    """
+    Picks test selection options (with their values) from arguments passed to the workers
+    """
+    selected = []
+    args = iter(pytest_args)
+
+    for arg in args:
+        name = arg.split("=", 1)[0]
+        if name in _SELECTION_OPTIONS:
+            selected.append(arg)
+            if "=" not in arg:
+                selected.append(next(args, ""))
+        elif arg[:2] in ("-k", "-m") and len(arg) > 2 and not arg.startswith("--"):
+            selected.append(arg)  # -kexpr
+
+    return selected
+
+
+def collect_tests(pytest_args: List[str]) -> Tuple[List[str], Optional[Set[str]]]:
+    """
+    Node ids of selected tests, and of those which are end-to-end tests (None when conftest did not report them)
+    """
+    with tempfile.TemporaryDirectory(prefix="bmt-collect-") as tmp:
+        e2e_path = tmp + "/e2e.json"
+        output = sp.check_output([sys.executable, "-m", "pytest", "--collect-only", "-q"] + pytest_args,
+                                 env=dict(os.environ, **{E2E_TESTS_FILE_ENV: e2e_path})).decode('utf-8')
+        tests = [line.strip() for line in output.splitlines() if "::" in line]
+
+        if not os.path.isfile(e2e_path):
+            return tests, None
+        with open(e2e_path, "r") as f:
+            return tests, set(json.load(f))
+
+
+def _forward_output(prefix: str, proc: sp.Popen):
+    for line in proc.stdout:
+        sys.stdout.write(prefix + line.decode('utf-8', errors='replace'))
+        sys.stdout.flush()
+
+
+def run_parallel(workers: int, pytest_args: List[str], durations_path: str, select: List[str] = None) -> int:
+    """
+    Starts one pytest process per worker with its share of tests. Returns the worst exit code
+    """
+    from .endtoendbase import EndToEndTestBase
+
+    tests, e2e = collect_tests((select or []) + selection_args(pytest_args))
+    if not tests:
+        print("No tests collected")
+        return 5
+
+    durations = load_durations(durations_path)
+    estimates = estimate(tests, durations, e2e)
+    buckets = [bucket for bucket in assign(tests, durations, workers, e2e) if bucket]
+
+    for index, bucket in enumerate(buckets):
+        print(f"[w{index}] {len(bucket)} tests, estimated {sum(estimates[test] for test in bucket):.0f}s")
+
+    # the default cluster creates the registry shared by all workers - it has to exist before they start
+    EndToEndTestBase._setup_env()
+    EndToEndTestBase._setup_cluster()
+
+    processes = []
+    for index, bucket in enumerate(buckets):
+        env = dict(os.environ, BMT_WORKER=str(index))
+        proc = sp.Popen([sys.executable, "-m", "pytest", f"--junitxml=report.junit-w{index}.xml"] + pytest_args
+                        + bucket, env=env, stdout=sp.PIPE, stderr=sp.STDOUT)
+        thread = threading.Thread(target=_forward_output, args=(f"[w{index}] ", proc), daemon=True)
+        thread.start()
+        processes.append((proc, thread))
+
+    codes = []
+    for proc, thread in processes:
+        codes.append(proc.wait())
+        thread.join()
+
+    print(f"Exit codes of workers: {codes}")
+    return max(codes)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .endtoendbase import BUILD_DIR
+
+    parser = argparse.ArgumentParser(prog="python -m framework.scheduler")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", "2")))
+    parser.add_argument("--select", action="append", default=[],
+                        help="Paths or node ids to collect tests from (default: all)")
+    parser.add_argument("pytest_args", nargs="*", help="Passed to every pytest worker (after --)")
+    args = parser.parse_args(argv)
+
+    return run_parallel(args.workers, args.pytest_args, BUILD_DIR + "/durations.json", args.select)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
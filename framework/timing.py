@@ -0,0 +1,126 @@
+import contextlib
+import dataclasses
+import functools
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+@dataclasses.dataclass
+class Span:
+    name: str
+    path: str
+    test: str
+    started_at: float
+    duration: float
+    thread_id: int
+    attrs: dict
+
+
+class Tracer(object):
+    """
+    Records nested, named spans of time per test. Spans opened in other threads (e.g. parallel deployment)
+    are attributed to the test that is currently running.
+
+    Export formats:
+      - per-test totals of each phase, used as JUnit <properties> (see test/conftest.py)
+      - Chrome trace-event JSON (open in chrome://tracing or https://ui.perfetto.dev)
+    """
+
+    _spans: List[Span]
+    _lock: threading.Lock
+    _local: threading.local
+    _current_test: str
+
+    def __init__(self):
+        self._spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._current_test = ""
+
+    def _stack(self) -> List[str]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs):
+        """
+        Records time spent inside. Yields the Span, its duration is known once the block exits
+        """
+        stack = self._stack()
+        stack.append(name)
+        span = Span(name=name, path=" > ".join(stack), test=self._current_test, started_at=time.time(),
+                    duration=0.0, thread_id=threading.get_ident(), attrs=attrs)
+        start = time.perf_counter()
+
+        try:
+            yield span
+        finally:
+            span.duration = time.perf_counter() - start
+            stack.pop()
+
+            with self._lock:
+                self._spans.append(span)
+
+    @contextlib.contextmanager
+    def test(self, test_id: str):
+        """
+        Marks all spans recorded inside (in any thread) as belonging to given test
+        """
+        self._current_test = test_id
+        try:
+            with self.span(test_id):
+                yield
+        finally:
+            self._current_test = ""
+
+    def test_totals(self, test_id: str) -> Dict[str, float]:
+        """
+        Total time of each phase (by nested path) recorded for a test
+        """
+        totals = {}
+        prefix = test_id + " > "
+
+        with self._lock:
+            for span in self._spans:
+                if span.test == test_id and span.path != test_id:
+                    path = span.path[len(prefix):] if span.path.startswith(prefix) else span.path
+                    totals[path] = totals.get(path, 0) + span.duration
+
+        return totals
+
+    def export_chrome_trace(self, path: str):
+        with self._lock:
+            events = [{
+                "name": span.name,
+                "cat": span.test or "session",
+                "ph": "X",
+                "ts": int(span.started_at * 1000000),
+                "dur": int(span.duration * 1000000),
+                "pid": os.getpid(),
+                "tid": span.thread_id,
+                "args": {key: str(value) for key, value in span.attrs.items()},
+            } for span in self._spans]
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+tracer = Tracer()
+
+
+def timed(name: Optional[str] = None):
+    """
+    Decorator recording each call of a function as a span
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,589 @@
+import atexit
+import base64
+import json
+import os
+import queue
+import subprocess as sp
+import tempfile
+import threading
+import time
+from json import JSONDecoder
+from typing import TYPE_CHECKING, Dict, List, Optional, Iterator, Tuple
+
+import yaml
+
+if TYPE_CHECKING:
+    import requests
+
+FIELD_MANAGER = "bmt"
+
+# (connect, read) seconds of a request to the API server - streams (watches, followed logs) have no read timeout
+REQUEST_TIMEOUT = (10, 120)
+
+
+class KubernetesApiError(Exception):
+    """
+    Kubernetes API server responded with an error
+    """
+
+    status: int
+    reason: str
+
+    def __init__(self, status: int, reason: str, message: str):
+        super().__init__(f"{status} {reason}: {message}")
+        self.status = status
+        self.reason = reason
+
+
+class ApplyError(Exception):
+    """
+    One of applied documents was rejected
+    """
+
+    document: Optional[dict]
+    index: Optional[int]
+
+    def __init__(self, message: str, document: Optional[dict] = None, index: Optional[int] = None):
+        super().__init__(message)
+        self.document = document
+        self.index = index
+
+
+def parse_documents(content: str) -> List[dict]:
+    """
+    Parses a multi-document YAML (or JSON) into a list of objects, skipping empty documents
+    """
+    return [doc for doc in yaml.safe_load_all(content) if doc]
+
+
+def read_manifests(path: str) -> List[dict]:
+    """
+    Reads a manifest file, or all manifests from a directory (not recursively, like `kubectl apply -f dir`)
+    """
+    if os.path.isdir(path):
+        files = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                 if name.endswith((".yaml", ".yml", ".json"))]
+    else:
+        files = [path]
+
+    documents = []
+    for file in files:
+        with open(file, "r") as f:
+            documents += parse_documents(f.read())
+
+    return documents
+
+
+class _StreamingWatch(object):
+    """
+    Streams watch events ({"type": ..., "object": {...}}) read by a background thread, so the consumer
+    can stop waiting at any deadline without being blocked on a read.
+    Use as a context manager to make sure the underlying stream is closed.
+    """
+
+    _events: queue.Queue
+    _eof = object()
+
+    def __init__(self):
+        self._events = queue.Queue()
+
+    def __enter__(self):
+        self._open()
+        threading.Thread(target=self._read, daemon=True).start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _open(self):
+        raise NotImplementedError()
+
+    def _stream(self) -> Iterator[dict]:
+        raise NotImplementedError()
+
+    def close(self):
+        raise NotImplementedError()
+
+    def _read(self):
+        try:
+            for event in self._stream():
+                self._events.put(event)
+        except Exception:
+            pass
+        finally:
+            self._events.put(self._eof)
+
+    def events(self, deadline: float) -> Iterator[dict]:
+        """
+        Yields events until the watch ends or time.monotonic() reaches the deadline
+        """
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event = self._events.get(timeout=remaining)
+            except queue.Empty:
+                return
+            if event is self._eof:
+                return
+            yield event
+
+
+class KubectlWatch(_StreamingWatch):
+    """
+    Watch backed by a long-running `kubectl get --watch --output-watch-events -o json` process
+    """
+
+    _cmd: List[str]
+    _proc: Optional[sp.Popen]
+
+    def __init__(self, cmd: List[str]):
+        super().__init__()
+        self._cmd = cmd
+        self._proc = None
+
+    def _open(self):
+        self._proc = sp.Popen(self._cmd, stdout=sp.PIPE, stderr=sp.DEVNULL)
+
+    def close(self):
+        if self._proc and self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+
+    def _stream(self) -> Iterator[dict]:
+        decoder = JSONDecoder()
+        buffer = ""
+
+        for line in self._proc.stdout:
+            buffer += line.decode('utf-8')
+
+            # kubectl prints pretty-formatted JSON documents one after another
+            while buffer.strip():
+                buffer = buffer.lstrip()
+                try:
+                    event, end = decoder.raw_decode(buffer)
+                except ValueError:
+                    break
+                buffer = buffer[end:]
+                yield event
+
+
+class ApiWatch(_StreamingWatch):
+    """
+    Watch backed by a streamed HTTP response from the API server (one JSON event per line)
+    """
+
+    _transport: "ApiTransport"
+    _path: str
+    _params: dict
+    _response = None
+
+    def __init__(self, transport: "ApiTransport", path: str, params: dict):
+        super().__init__()
+        self._transport = transport
+        self._path = path
+        self._params = params
+
+    def _open(self):
+        self._response = self._transport.request("GET", self._path, params=self._params, stream=True)
+
+    def close(self):
+        if self._response is not None:
+            self._response.close()
+
+    def _stream(self) -> Iterator[dict]:
+        for line in self._response.iter_lines():
+            if line:
+                yield json.loads(line)
+
+
+class KubectlLogStream(KubectlWatch):
+    """
+    Follows logs of a container with `kubectl logs --follow`. Yields lines instead of events
+    """
+
+    def _stream(self) -> Iterator[str]:
+        for line in self._proc.stdout:
+            yield line.decode('utf-8', errors='replace').rstrip("\n")
+
+
+class ApiLogStream(ApiWatch):
+    """
+    Follows logs of a container through a streamed HTTP response. Yields lines instead of events
+    """
+
+    def _stream(self) -> Iterator[str]:
+        for line in self._response.iter_lines():
+            yield line.decode('utf-8', errors='replace')
+
+
+class KubernetesTransport(object):
+    """
+    Way of talking to the Kubernetes cluster
+    """
+
+    def apply(self, documents: List[dict], ns: str):
+        raise NotImplementedError()
+
+    def get(self, kind: str, name: str, ns: str) -> Optional[dict]:
+        raise NotImplementedError()
+
+    def list(self, kind: str, ns: str, label_selector: str = '') -> List[dict]:
+        raise NotImplementedError()
+
+    def delete(self, kind: str, name: str, ns: str):
+        raise NotImplementedError()
+
+    def watch(self, kind: str, ns: str) -> _StreamingWatch:
+        raise NotImplementedError()
+
+    def create_namespace(self, name: str):
+        raise NotImplementedError()
+
+    def delete_namespace(self, name: str, wait: bool = True):
+        raise NotImplementedError()
+
+    def logs(self, label_selector: str, ns: str) -> str:
+        raise NotImplementedError()
+
+    def stream_logs(self, pod: str, ns: str, container: str = '') -> _StreamingWatch:
+        """
+        Follows logs of a Pod's container, each line prefixed with a timestamp
+        """
+        raise NotImplementedError()
+
+
+class KubectlTransport(KubernetesTransport):
+    """
+    Fallback transport: forks a `kubectl` process for every operation
+    """
+
+    @staticmethod
+    def _kubectl(args: List[str], input: bytes = None) -> str:
+        try:
+            return sp.check_output(["kubectl"] + args, input=input, stderr=sp.PIPE).decode('utf-8')
+        except sp.CalledProcessError as err:
+            print(err.stderr.decode('utf-8'))
+            raise
+
+    def apply(self, documents: List[dict], ns: str):
+        try:
+            self._kubectl(["apply", "-f", "-", "-n", ns], input=yaml.safe_dump_all(documents).encode('utf-8'))
+        except sp.CalledProcessError as err:
+            raise ApplyError(err.stderr.decode('utf-8').strip()) from err
+
+    def get(self, kind: str, name: str, ns: str) -> Optional[dict]:
+        out = self._kubectl(["get", kind, name, "-n", ns, "-o", "json", "--ignore-not-found"])
+        return json.loads(out) if out.strip() else None
+
+    def list(self, kind: str, ns: str, label_selector: str = '') -> List[dict]:
+        args = ["get", kind, "-n", ns, "-o", "json"]
+        if label_selector:
+            args += ["-l", label_selector]
+        return json.loads(self._kubectl(args))["items"]
+
+    def delete(self, kind: str, name: str, ns: str):
+        self._kubectl(["delete", kind, name, "-n", ns, "--ignore-not-found"])
+
+    def watch(self, kind: str, ns: str) -> KubectlWatch:
+        return KubectlWatch(["kubectl", "get", kind, "-n", ns, "--watch", "--output-watch-events", "-o", "json"])
+
+    def create_namespace(self, name: str):
+        sp.call(["kubectl", "create", "ns", name], stderr=sp.DEVNULL, stdout=sp.DEVNULL)
+
+    def delete_namespace(self, name: str, wait: bool = True):
+        self._kubectl(["delete", "ns", name, f"--wait={str(wait).lower()}"])
+
+    def logs(self, label_selector: str, ns: str) -> str:
+        return self._kubectl(["logs", "-l", label_selector, "-n", ns])
+
+    def stream_logs(self, pod: str, ns: str, container: str = '') -> KubectlLogStream:
+        return KubectlLogStream(["kubectl", "logs", "--follow", "--timestamps", pod, "-n", ns] +
+                                (["-c", container] if container else []))
+
+
+class _KubeConfig(object):
+    """
+    Minimal kubeconfig reader - resolves the current context into server address and credentials
+    """
+
+    server: str
+    verify: object
+    cert: Optional[Tuple[str, str]]
+    token: Optional[str]
+
+    def __init__(self, paths: List[str]):
+        clusters, users, contexts = {}, {}, {}
+        current_context = ""
+
+        for path in paths:
+            if not os.path.isfile(path):
+                continue
+            with open(path, "r") as f:
+                config = yaml.safe_load(f) or {}
+
+            for entries, items in ((clusters, "clusters"), (users, "users"), (contexts, "contexts")):
+                for item in config.get(items) or []:
+                    entries.setdefault(item["name"], item)
+            current_context = current_context or config.get("current-context", "")
+
+        if current_context not in contexts:
+            raise ValueError(f"Cannot find current context '{current_context}' in kubeconfig {paths}")
+
+        context = contexts[current_context]["context"]
+        cluster = clusters[context["cluster"]]["cluster"]
+        user = users.get(context.get("user"), {}).get("user", {})
+
+        if "exec" in user or "auth-provider" in user:
+            raise ValueError("Kubeconfig authentication plugins are not supported by the API transport")
+
+        self.server = cluster["server"].rstrip("/")
+        self.token = user.get("token")
+        self.cert = None
+        self.verify = True
+
+        if cluster.get("insecure-skip-tls-verify"):
+            self.verify = False
+        elif "certificate-authority-data" in cluster:
+            self.verify = self._write_temp(cluster["certificate-authority-data"])
+        elif "certificate-authority" in cluster:
+            self.verify = cluster["certificate-authority"]
+
+        if "client-certificate-data" in user:
+            self.cert = (self._write_temp(user["client-certificate-data"]), self._write_temp(user["client-key-data"]))
+        elif "client-certificate" in user:
+            self.cert = (user["client-certificate"], user["client-key"])
+
+    @staticmethod
+    def _write_temp(b64_content: str) -> str:
+        """
+        `requests` can read certificates only from files
+        """
+        fd, path = tempfile.mkstemp(prefix="bmt-kube-", suffix=".pem")
+        with os.fdopen(fd, "wb") as f:
+            f.write(base64.b64decode(b64_content))
+        atexit.register(lambda: os.path.exists(path) and os.unlink(path))
+        return path
+
+    @staticmethod
+    def default_paths() -> List[str]:
+        if os.getenv("KUBECONFIG"):
+            return os.getenv("KUBECONFIG").split(os.pathsep)
+        return [os.path.expanduser("~/.kube/config")]
+
+
+class ApiTransport(KubernetesTransport):
+    """
+    Talks to the API server directly over a pooled, keep-alive HTTP session.
+    Kubeconfig is parsed and API discovery is performed only once, objects are applied using Server-Side Apply.
+    """
+
+    _config: _KubeConfig
+    _session: "requests.Session"
+    _resources: Dict[str, Dict[str, Tuple[str, str, bool]]]
+    _kinds: Dict[str, Tuple[str, str, bool]]
+    _lock: threading.Lock
+
+    def __init__(self, config: _KubeConfig, pool_size: int = 16):
+        self._config = config
+        import requests  # imported on first use, it is slow to import
+        from requests.adapters import HTTPAdapter
+
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=pool_size))
+        self._session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=pool_size))
+        self._session.verify = config.verify
+        self._session.cert = config.cert
+        if config.token:
+            self._session.headers["Authorization"] = f"Bearer {config.token}"
+        self._resources = {}
+        self._kinds = {}
+        self._lock = threading.Lock()
+
+    def request(self, method: str, path: str, **kwargs):
+        kwargs.setdefault("timeout", (REQUEST_TIMEOUT[0], None) if kwargs.get("stream") else REQUEST_TIMEOUT)
+        response = self._session.request(method, self._config.server + path, **kwargs)
+
+        if response.status_code >= 400:
+            try:
+                body = response.json()
+                raise KubernetesApiError(response.status_code, body.get("reason", ""), body.get("message", ""))
+            except ValueError:
+                raise KubernetesApiError(response.status_code, response.reason, response.text)
+
+        return response
+
+    # ---
+    #  API discovery
+    # ---
+
+    def _discover_group_version(self, api_version: str):
+        """
+        Maps kinds of a group version into (path prefix, resource name, namespaced)
+        """
+        prefix = "/api/v1" if api_version == "v1" else f"/apis/{api_version}"
+        mapping = {}
+
+        for resource in self.request("GET", prefix).json().get("resources", []):
+            if "/" in resource["name"]:
+                continue  # subresources
+
+            entry = (prefix, resource["name"], resource["namespaced"])
+            mapping[resource["kind"]] = entry
+
+            for alias in [resource["kind"], resource["name"], resource.get("singularName", "")] \
+                    + resource.get("shortNames", []):
+                if alias:
+                    self._kinds.setdefault(alias.lower(), entry)
+
+        self._resources[api_version] = mapping
+
+    def _discover_all(self):
+        self._discover_group_version("v1")
+
+        for group in self.request("GET", "/apis").json().get("groups", []):
+            try:
+                self._discover_group_version(group["preferredVersion"]["groupVersion"])
+            except KubernetesApiError:
+                pass  # e.g. an aggregated API that is not available at the moment
+
+    def _resolve(self, kind: str, api_version: str = '') -> Tuple[str, str, bool]:
+        """
+        Finds a REST resource for a kind. Discovery is refreshed only on a miss, e.g. after new CRDs were applied
+        """
+        with self._lock:
+            for refresh in (False, True):
+                if api_version:
+                    if refresh or api_version not in self._resources:
+                        self._discover_group_version(api_version)
+                    if kind in self._resources[api_version]:
+                        return self._resources[api_version][kind]
+                else:
+                    if refresh or not self._kinds:
+                        self._discover_all()
+                    if kind.lower() in self._kinds:
+                        return self._kinds[kind.lower()]
+
+        raise KubernetesApiError(404, "NotFound", f"The server doesn't have a resource type '{kind}'")
+
+    def _path(self, kind: str, ns: str, name: str = '', api_version: str = '') -> str:
+        prefix, resource, namespaced = self._resolve(kind, api_version)
+        path = prefix + (f"/namespaces/{ns}" if namespaced else "") + f"/{resource}"
+
+        return path + f"/{name}" if name else path
+
+    # ---
+    #  Operations
+    # ---
+
+    def apply(self, documents: List[dict], ns: str):
+        for index, document in enumerate(documents):
+            metadata = document.setdefault("metadata", {})
+            try:
+                _, _, namespaced = self._resolve(document["kind"], document["apiVersion"])
+                if namespaced:
+                    metadata.setdefault("namespace", ns)
+
+                self.request("PATCH", self._path(document["kind"], metadata.get("namespace", ns), metadata["name"],
+                                                 document["apiVersion"]),
+                             params={"fieldManager": FIELD_MANAGER, "force": "true"},
+                             headers={"Content-Type": "application/apply-patch+yaml"},
+                             data=json.dumps(document))
+            except KubernetesApiError as err:
+                raise ApplyError(f"{document.get('kind')}/{metadata.get('name')}: {err}",
+                                 document=document, index=index) from err
+
+    def get(self, kind: str, name: str, ns: str) -> Optional[dict]:
+        try:
+            return self.request("GET", self._path(kind, ns, name)).json()
+        except KubernetesApiError as err:
+            if err.status == 404:
+                return None
+            raise
+
+    def list(self, kind: str, ns: str, label_selector: str = '') -> List[dict]:
+        params = {"labelSelector": label_selector} if label_selector else {}
+        return self.request("GET", self._path(kind, ns), params=params).json()["items"]
+
+    def delete(self, kind: str, name: str, ns: str):
+        try:
+            self.request("DELETE", self._path(kind, ns, name))
+        except KubernetesApiError as err:
+            if err.status != 404:
+                raise
+
+    def watch(self, kind: str, ns: str) -> ApiWatch:
+        # without a resourceVersion the server starts with synthetic ADDED events for all existing objects
+        return ApiWatch(self, self._path(kind, ns), params={"watch": "true", "allowWatchBookmarks": "false"})
+
+    def create_namespace(self, name: str):
+        try:
+            self.request("POST", "/api/v1/namespaces", json={
+                "apiVersion": "v1", "kind": "Namespace", "metadata": {"name": name},
+            })
+        except KubernetesApiError as err:
+            if err.status != 409:
+                raise
+
+    def delete_namespace(self, name: str, wait: bool = True, timeout: float = 600):
+        self.delete("namespace", name, ns="")
+        deadline = time.monotonic() + timeout
+
+        while wait and self.get("namespace", name, ns="") is not None:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Namespace '{name}' is still terminating after {timeout}s")
+            time.sleep(1)
+
+    def logs(self, label_selector: str, ns: str) -> str:
+        out = ""
+        for pod in self.list("pod", ns, label_selector):
+            path = self._path("pod", ns, pod["metadata"]["name"]) + "/log"
+            out += self.request("GET", path, params={"tailLines": "10"}).text
+
+        return out
+
+    def stream_logs(self, pod: str, ns: str, container: str = '') -> ApiLogStream:
+        params = {"follow": "true", "timestamps": "true"}
+        if container:
+            params["container"] = container
+        return ApiLogStream(self, self._path("pod", ns, pod) + "/log", params=params)
+
+
+_default_transport: Optional[KubernetesTransport] = None
+_default_transport_lock = threading.Lock()
+
+
+def default_transport() -> KubernetesTransport:
+    """
+    Returns a process-wide transport, so the HTTP connection pool is shared between all tests.
+    Select with BMT_KUBE_TRANSPORT=api|kubectl (default: api, falls back to kubectl if kubeconfig is not supported)
+    """
+    global _default_transport
+
+    if _default_transport is not None:
+        return _default_transport
+
+    # parallel deployments ask for it from multiple threads, there must be only one connection pool
+    with _default_transport_lock:
+        if _default_transport is None:
+            if os.getenv("BMT_KUBE_TRANSPORT", "api") == "kubectl":
+                _default_transport = KubectlTransport()
+            else:
+                try:
+                    _default_transport = ApiTransport(_KubeConfig(_KubeConfig.default_paths()))
+                except (ValueError, KeyError, OSError) as err:
+                    print(f"Cannot use API transport, falling back to kubectl: {err}")
+                    _default_transport = KubectlTransport()
+
+        return _default_transport
+
+
+def set_default_transport(transport: Optional[KubernetesTransport]) -> Optional[KubernetesTransport]:
+    """
+    Replaces the process-wide transport (e.g. with framework.fakecluster.FakeCluster). Returns the previous one
+    """
+    global _default_transport
+
+    previous, _default_transport = _default_transport, transport
+    return previous
@@ -0,0 +1,101 @@
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from .retry import RetryPolicy
+
+# backoff between re-opened watches; reset once a watch delivers events, the overall limit is the wait timeout
+RECONNECT_RETRY = RetryPolicy(attempts=20, initial_delay=1, max_delay=15)
+
+
+def is_backup_action_finished(obj: dict) -> bool:
+    """
+    RequestedBackupAction is finished, when it is HEALTHY and none of its children (Jobs, Pods) is still running
+    """
+    status = obj.get("status") or {}
+    healthy = status.get("healthy") is True
+    any_resource_running = any(resource.get("running") for resource in status.get("childrenResourcesHealth") or [])
+
+    return healthy and not any_resource_running
+
+
+class RequestedBackupActionWaiter(object):
+    """
+    Waits for RequestedBackupAction objects to reach a status using a single streaming watch
+    per namespace, instead of polling each object with a separate `kubectl get`.
+
+    `reached_at` keeps the time (epoch) when each action was first seen with the expected status
+    """
+
+    _parent: "EndToEndTestBase"
+    _ns: str
+    _reconnect: RetryPolicy
+    _verbose: bool
+    _cancelled: threading.Event
+    _watch: Optional["_StreamingWatch"]
+    reached_at: Dict[str, float]
+
+    def __init__(self, parent: "EndToEndTestBase", ns: str, reconnect: RetryPolicy = RECONNECT_RETRY,
+                 verbose: bool = True):
+        self._parent = parent
+        self._ns = ns
+        self._reconnect = reconnect
+        self._verbose = verbose
+        self._cancelled = threading.Event()
+        self._watch = None
+        self.reached_at = {}
+
+    def cancel(self):
+        """
+        Stops wait() running in another thread - it returns the statuses known so far
+        """
+        self._cancelled.set()
+        watch = self._watch
+        if watch is not None:
+            watch.close()
+
+    def wait(self, names: Iterable[str], expected: bool = True, timeout: float = 300) -> Dict[str, bool]:
+        """
+        Waits until every action from `names` has the expected status, or until the timeout passes.
+        Returns last known status of each action - on timeout at least one of them is different from expected
+        """
+        deadline = time.monotonic() + timeout
+        results = {name: False for name in names}
+        pending = set(results.keys())
+        delays = self._reconnect.delays()
+
+        while pending and time.monotonic() < deadline and not self._cancelled.is_set():
+            with self._parent.watch("requestedbackupaction", ns=self._ns) as watch:
+                self._watch = watch
+                if self._cancelled.is_set():
+                    break
+
+                for event in watch.events(deadline):
+                    delays = self._reconnect.delays()
+                    obj = event.get("object") or {}
+                    name = obj.get("metadata", {}).get("name")
+                    if name not in results:
+                        continue
+
+                    if self._verbose:
+                        print(f"backup_has_status[{name}] = {obj.get('status')}")
+                    results[name] = is_backup_action_finished(obj)
+
+                    if results[name] == expected:
+                        self.reached_at.setdefault(name, time.time())
+                        pending.discard(name)
+                    else:
+                        pending.add(name)
+
+                    if not pending:
+                        return results
+            self._watch = None
+
+            # watch was closed by the server (or kubectl died) before the deadline - open it again
+            delay = next(delays, None)
+            if pending and delay is not None and time.monotonic() + delay < deadline:
+                self._cancelled.wait(delay)
+            else:
+                break
+
+        return results
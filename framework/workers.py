@@ -0,0 +1,28 @@
+import os
+
+
+def worker_id() -> str:
+    """
+    Identifier of a parallel worker (see framework.scheduler), empty when running serially
+    """
+    return os.getenv("BMT_WORKER", "")
+
+
+def cluster_name() -> str:
+    """
+    Every worker runs in its own k3d cluster. The first worker reuses the default cluster
+    """
+    worker = worker_id()
+    return "bmt" if worker in ("", "0") else f"bmt-w{worker}"
+
+
+def per_worker(path: str) -> str:
+    """
+    Makes a path (log directory, report) unique for the current worker
+    """
+    worker = worker_id()
+    if not worker:
+        return path
+
+    base, ext = os.path.splitext(path)
+    return f"{base}-w{worker}{ext}"
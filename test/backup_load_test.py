@@ -0,0 +1,65 @@
+import os
+import time
+import unittest
+from framework import ClientServerBase, BUILD_DIR
+from framework.benchmark import write_report
+from framework.loadtest import LoadGenerator, load_profile_from_env
+
+
+@unittest.skipUnless(os.getenv("LOADTEST") == "true", "Load tests are enabled with LOADTEST=true")
+class BackupLoadTest(ClientServerBase):
+    """
+    Many ScheduledBackups and concurrent RequestedBackupActions against one PostgreSQL instance.
+    Reports throughput, latency percentiles and where the time is spent (controller, Job, server).
+    Select the load with LOADTEST_SCHEDULES, LOADTEST_ACTIONS, LOADTEST_COLLECTIONS, LOADTEST_CONCURRENCY
+    """
+
+    def test_concurrent_backups(self):
+        profile = load_profile_from_env()
+
+        with self.in_dir("test/data/postgres_backup_test"), \
+                self.subject_namespace(), \
+                self.show_logs_on_failure():
+            pg_ns = self.postgres_subject()
+
+            self.server.i_create_a_user(
+                name="international-workers-association",
+                email="example@iwa-ait.org",
+                password="cnt1936",
+            )
+            access_token = self.server.i_login(
+                username="international-workers-association",
+                password="cnt1936"
+            )
+
+            generator = LoadGenerator(self, profile)
+            generator.prepare(
+                access_token=access_token,
+                template_name="pg15",
+                template_kind="internal",
+                email="example@iwa-ait.org",
+                # language=yaml
+                template_vars=lambda collection: f"""
+                    Params:
+                        hostname: test-postgresql.{pg_ns}.svc.cluster.local
+                        port: 5432
+                        db: backuprepository
+                        user: riotkit
+                        password: "warisbad"
+
+                    Repository:
+                        url: "http://server-backup-repository-server.backups.svc.cluster.local:8080"
+                        encryptionKeyPath: "/mnt/secrets/gpg-key"
+                        passphrase: ""
+                        recipient: "example@iwa-ait.org"
+                        collectionId: "{collection}"
+                """,
+            )
+            result = generator.run(list_versions=lambda collection: self.server.i_list_versions(collection,
+                                                                                                access_token))
+
+        write_report(os.getenv("LOADTEST_OUTPUT") or
+                     f"{BUILD_DIR}/loadtests/backups-{time.strftime('%Y%m%d-%H%M%S')}.json",
+                     self.release, [result])
+
+        self.assertEqual([], result.to_dict()["not_healthy"])
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from framework.backuprepository import BackupRepositoryClient, BackupRepositoryError, generate_payload, \
+    payload_sha256
+
+
+class _FakeRepository(BaseHTTPRequestHandler):
+    """
+    Stores uploaded bodies in memory, answers like Backup Repository
+    """
+
+    protocol_version = "HTTP/1.1"
+    versions = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status: int, body: dict):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _read_chunked(self) -> bytes:
+        body = b""
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            if size == 0:
+                self.rfile.readline()
+                return body
+            body += self.rfile.read(size)
+            self.rfile.readline()
+
+    def do_POST(self):
+        if self.path == "/api/stable/auth/login":
+            length = int(self.headers["Content-Length"])
+            credentials = json.loads(self.rfile.read(length))
+            if credentials["password"] != "cnt1936":
+                return self._json(401, {"error": "invalid credentials"})
+            return self._json(200, {"data": {"token": "jwt"}})
+
+        assert self.headers["Authorization"] == "Bearer jwt"
+        assert self.headers["Transfer-Encoding"] == "chunked", "Upload is expected to be streamed"
+        self.versions.setdefault(self.path.split("/")[-2], []).append(self._read_chunked())
+        self._json(200, {"status": True})
+
+    def do_GET(self):
+        collection = self.path.split("/")[5]
+        if self.path.endswith("/versions"):
+            return self._json(200, {"data": {"versions": [{"id": str(i)} for i in range(len(self.versions[collection]))]}})
+
+        content = self.versions[collection][-1]
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class BackupRepositoryClientTest(unittest.TestCase):
+    def setUp(self) -> None:
+        _FakeRepository.versions = {}
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeRepository)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = BackupRepositoryClient(f"http://127.0.0.1:{self.server.server_address[1]}")
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_streamed_upload_and_hashed_download(self):
+        self.client.login("international-workers-association", "cnt1936")
+        self.client.upload("iwa-ait", generate_payload(3 * 1024 * 1024 + 5, chunk_size=1024 * 1024))
+
+        result = self.client.download("iwa-ait", chunk_size=64 * 1024)
+
+        self.assertEqual(3 * 1024 * 1024 + 5, result.size)
+        self.assertEqual(payload_sha256(3 * 1024 * 1024 + 5), result.sha256)
+        self.assertEqual(hashlib.sha256(_FakeRepository.versions["iwa-ait"][0]).hexdigest(), result.sha256)
+        self.assertEqual([{"id": "0"}], self.client.list_versions("iwa-ait"))
+
+    def test_error_response_is_raised_with_status(self):
+        with self.assertRaises(BackupRepositoryError) as ctx:
+            self.client.login("international-workers-association", "wrong")
+
+        self.assertEqual(401, ctx.exception.status)
@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+import subprocess as sp
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from framework.buildcache import BuildCache, default_build_cache
+
+
+class BuildCacheTest(unittest.TestCase):
+    """
+    Checks keys against a local git repository and the index against a temporary directory
+    """
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.mkdtemp(prefix="bmt-buildcache-")
+        self.work = self.tmp + "/work"
+
+        sp.check_call(["git", "init", "--quiet", self.work])
+        self._write("skaffold.yaml", "apiVersion: skaffold/v4beta1\n")
+        self._write("main.go", "package main\n")
+        sp.check_call(["git", "add", "."], cwd=self.work)
+        sp.check_call(["git", "-c", "user.name=test", "-c", "user.email=test@example.org", "commit",
+                       "--quiet", "-m", "initial"], cwd=self.work)
+
+        self.cache = BuildCache(self.tmp + "/cache", max_entries=2, max_age=3600)
+        present = mock.patch.object(BuildCache, "_images_present", return_value=True)
+        self.images_present = present.start()
+        self.addCleanup(present.stop)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp)
+
+    def _write(self, name: str, content: str):
+        with open(f"{self.work}/{name}", "w") as f:
+            f.write(content)
+
+    def _build(self, key: str):
+        with open(self.cache.artifacts_path(key), "w") as f:
+            json.dump({"builds": [{"imageName": "app", "tag": f"bmt-registry:5000/app:{self.cache.tag_for(key)}"}]}, f)
+        self.cache.store(key)
+
+    def test_key_changes_with_uncommitted_and_untracked_files(self):
+        clean = BuildCache.key_for(self.work)
+        self.assertEqual(clean, BuildCache.key_for(self.work), "Key is stable for the same content")
+
+        self._write("main.go", "package main\n// changed\n")
+        dirty = BuildCache.key_for(self.work)
+        self.assertNotEqual(clean, dirty)
+
+        self._write("util.go", "package main\n")
+        untracked = BuildCache.key_for(self.work)
+        self.assertNotEqual(dirty, untracked)
+
+        self._write("util.go", "package util\n")
+        self.assertNotEqual(untracked, BuildCache.key_for(self.work), "Content of untracked files is a part of key")
+
+    def test_unversioned_directory_has_no_key(self):
+        os.makedirs(self.tmp + "/plain")
+
+        self.assertIsNone(BuildCache.key_for(self.tmp + "/plain"))
+
+    def test_stored_build_is_found_while_its_images_are_present(self):
+        key = BuildCache.key_for(self.work)
+        self.assertIsNone(self.cache.lookup(key))
+
+        self._build(key)
+        entry = self.cache.lookup(key)
+
+        self.assertEqual([f"bmt-registry:5000/app:{self.cache.tag_for(key)}"], entry.images)
+        self.assertEqual({"hits": 1, "misses": 1, "entries": 1}, self.cache.stats())
+
+        self.images_present.return_value = False
+        self.assertIsNone(self.cache.lookup(key), "Images lost with the registry have to be built again")
+        self.assertEqual(0, self.cache.stats()["entries"])
+
+    def test_least_recently_used_entries_are_evicted(self):
+        for key in ["a", "b"]:
+            self._build(key)
+            time.sleep(0.01)
+        self.cache.lookup("a")
+        self._build("c")
+
+        self.assertIsNotNone(self.cache.lookup("a"))
+        self.assertIsNone(self.cache.lookup("b"))
+        self.assertFalse(os.path.isfile(self.cache.artifacts_path("b")), "Artifacts of evicted entries are removed")
+        self.assertIsNotNone(self.cache.lookup("c"))
+
+    def test_old_entries_are_evicted(self):
+        self._build("a")
+
+        with mock.patch("framework.buildcache.time.time", return_value=time.time() + 7200):
+            self.assertIsNone(self.cache.lookup("a"))
+
+    def test_cache_can_be_disabled(self):
+        with mock.patch.dict(os.environ, {"BMT_BUILD_CACHE": "false"}):
+            self.assertIsNone(default_build_cache(self.tmp + "/cache"))
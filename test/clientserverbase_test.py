@@ -0,0 +1,112 @@
+import contextlib
+import threading
+import unittest
+from unittest import mock
+
+from framework.clientserverbase import ClientServerBase, DeploymentError
+from framework.deployment import DeploymentRegistry
+from framework.endtoendbase import EndToEndTestBase
+from framework.fakecluster import FakeCluster
+from framework.retry import RetryPolicy
+from framework.transport import KubernetesApiError, set_default_transport
+
+
+@contextlib.contextmanager
+def _checkout(url: str, version: str, chdir: bool = True):
+    yield "/checkout/" + url.split("/")[-1]
+
+
+class _Deployment(ClientServerBase):
+    """
+    Deploys server and controller with stubbed Skaffold and CRDs, against FakeCluster
+    """
+
+    release = {"SERVER_VERSION": "main", "CONTROLLER_VERSION": "main", "BACKUP_MAKER_VERSION": "v1"}
+
+    def __init__(self, registry: DeploymentRegistry):
+        super().__init__()
+        self.registry = registry
+        self.skaffold = mock.Mock()
+        self.crds = mock.Mock()
+        self.running = threading.Barrier(2, timeout=5)
+
+    @property
+    def deployments(self) -> DeploymentRegistry:
+        return self.registry
+
+    def skaffold_deploy(self, skip_when: bool = None, path: str = '', ns: str = ''):
+        self.skaffold(ns)
+
+    def apply_manifests(self, path: str, ns: str = '', step: str = ''):
+        self.crds(ns)
+
+
+class ParallelDeploymentTest(unittest.TestCase):
+    def setUp(self):
+        self.cluster = FakeCluster()
+        self._previous_transport = set_default_transport(self.cluster)
+        self.deployment = _Deployment(DeploymentRegistry(lambda: self.cluster))
+        EndToEndTestBase.setUp(self.deployment)
+
+        for patcher in [mock.patch("framework.clientserverbase.cloned_repository_at_revision", _checkout),
+                        mock.patch("framework.clientserverbase.deployment_fingerprint", return_value="fingerprint"),
+                        mock.patch("framework.clientserverbase.crd_names", return_value=["backups.riotkit.org"]),
+                        mock.patch("framework.clientserverbase.DEPLOY_STEP_RETRY",
+                                   RetryPolicy(attempts=3, initial_delay=0.01))]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        set_default_transport(self._previous_transport)
+
+    def test_server_and_controller_are_deployed_at_the_same_time(self):
+        # each deployment waits until the other one is running as well
+        self.deployment.skaffold.side_effect = lambda ns: self.deployment.running.wait()
+
+        self.deployment._deploy_client_and_server(delete=False)
+
+        self.assertEqual(["backup-maker-controller", "backup-repository"], self.deployment.deployments.verified())
+        self.assertLessEqual({"backup-maker-controller", "backups"}, set(self.cluster.namespaces()))
+
+    def test_only_the_failed_step_is_retried(self):
+        self.deployment.crds.side_effect = [KubernetesApiError(503, "ServiceUnavailable", "etcd leader changed"),
+                                            None]
+
+        self.deployment._deploy_client_and_server(delete=False)
+
+        self.assertEqual(2, self.deployment.crds.call_count)
+        self.assertEqual(["backup-maker-controller", "backups"],
+                         sorted(call.args[0] for call in self.deployment.skaffold.call_args_list),
+                         "Skaffold runs once for each component")
+
+    def test_succeeded_component_is_not_deployed_again(self):
+        def skaffold(ns: str):
+            if ns == "backup-maker-controller":
+                raise ValueError("invalid chart")
+
+        self.deployment.skaffold.side_effect = skaffold
+
+        with self.assertRaises(DeploymentError) as context:
+            self.deployment._deploy_client_and_server(delete=False)
+
+        self.assertEqual(["backup-maker-controller"], list(context.exception.errors))
+        self.assertEqual(["backup-repository"], self.deployment.deployments.verified())
+
+        self.deployment.skaffold.side_effect = None
+        self.deployment.skaffold.reset_mock()
+        self.deployment._deploy_client_and_server(delete=False)
+
+        self.deployment.skaffold.assert_called_once_with("backup-maker-controller")
+
+    def test_failures_of_both_components_are_reported(self):
+        self.deployment.skaffold.side_effect = ValueError("invalid chart")
+        self.deployment.crds.side_effect = ValueError("invalid CRD")
+
+        with self.assertRaises(DeploymentError) as context:
+            self.deployment._deploy_client_and_server(delete=False)
+
+        self.assertEqual({"backup-repository": "invalid chart", "backup-maker-controller": "invalid CRD"},
+                         {name: str(error) for name, error in context.exception.errors.items()})
+        self.assertIn("backup-repository: ValueError('invalid chart')", str(context.exception))
+        self.assertIn("backup-maker-controller: ValueError('invalid CRD')", str(context.exception))
+        self.assertEqual([], self.deployment.deployments.verified())
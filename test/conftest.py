@@ -0,0 +1,58 @@
+import json
+import os
+import pytest
+from framework import BUILD_DIR, EndToEndTestBase
+from framework.logcollector import stop_log_collector
+from framework.namespaces import drain_namespace_reaper
+from framework.retry import retry_stats
+from framework.scheduler import E2E_TESTS_FILE_ENV, record_durations
+from framework.timing import tracer
+from framework.workers import per_worker
+
+# setup + call + teardown of each test, used to schedule parallel runs (see framework.scheduler)
+_durations = {}
+_e2e_tests = set()
+
+
+def pytest_collection_modifyitems(session, config, items):
+    e2e_tests = [item.nodeid for item in items
+                 if isinstance(getattr(item, "cls", None), type) and issubclass(item.cls, EndToEndTestBase)]
+    _e2e_tests.update(e2e_tests)
+
+    # collecting for the parallel schedule - unit tests are not estimated as end-to-end tests
+    if os.getenv(E2E_TESTS_FILE_ENV):
+        with open(os.getenv(E2E_TESTS_FILE_ENV), "w") as f:
+            json.dump(e2e_tests, f)
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item, nextitem):
+    with tracer.test(item.nodeid):
+        yield
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_teardown(item, nextitem):
+    yield
+
+    # exported by --junitxml as <properties> of the test case
+    for path, seconds in sorted(tracer.test_totals(item.nodeid).items()):
+        item.user_properties.append((f"timing: {path}", f"{seconds:.3f}"))
+
+
+def pytest_runtest_logreport(report):
+    # only end-to-end tests are scheduled by their durations, unit tests of the framework take milliseconds
+    if not report.skipped and report.nodeid in _e2e_tests:
+        _durations[report.nodeid] = _durations.get(report.nodeid, 0) + report.duration
+
+
+def pytest_sessionfinish(session, exitstatus):
+    stop_log_collector()
+    drain_namespace_reaper()
+    if _durations:
+        record_durations(BUILD_DIR + "/durations.json", _durations)
+
+    for operation, stats in retry_stats.summary().items():
+        print(f"Retried: {operation}: {stats['failures']} of {stats['attempts']} attempts failed, "
+              f"{stats['seconds']}s in total")
+    tracer.export_chrome_trace(os.getenv("BMT_TRACE_FILE") or per_worker(BUILD_DIR + "/trace.json"))
@@ -0,0 +1,93 @@
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from framework.cli import WarmEnvironment
+from framework.daemon import Daemon, DaemonClient, DaemonError, attached_daemon
+
+
+class DaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="bmt-daemon-")
+        self.path = self.tmp + "/bmt.sock"
+        self.calls = []
+        self.daemon = Daemon(self.path, {
+            "forward": lambda ns, port=80: self.calls.append((ns, port)) or 10000 + port,
+            "broken": lambda: 1 / 0,
+        })
+        self.thread = threading.Thread(target=self.daemon.serve, daemon=True)
+        self.thread.start()
+
+        self.client = DaemonClient(self.path)
+        for _ in range(100):
+            if self.client.is_running():
+                break
+            threading.Event().wait(0.01)
+
+    def tearDown(self):
+        if self.client.is_running():
+            self.client.call("shutdown")
+        self.thread.join(timeout=5)
+        shutil.rmtree(self.tmp)
+
+    def test_calls_handler_with_arguments(self):
+        self.assertEqual(10080, self.client.call("forward", ns="backups"))
+        self.assertEqual(18080, self.client.call("forward", ns="backups", port=8080))
+        self.assertEqual([("backups", 80), ("backups", 8080)], self.calls)
+
+    def test_errors_are_returned_to_the_client(self):
+        with self.assertRaisesRegex(DaemonError, "ZeroDivisionError"):
+            self.client.call("broken")
+
+        with self.assertRaisesRegex(DaemonError, "Unknown command"):
+            self.client.call("deploy")
+
+    def test_concurrent_clients(self):
+        results = []
+        threads = [threading.Thread(target=lambda port=port: results.append(self.client.call("forward", ns="x",
+                                                                                              port=port)))
+                   for port in range(20)]
+        [thread.start() for thread in threads]
+        [thread.join() for thread in threads]
+
+        self.assertEqual(list(range(10000, 10020)), sorted(results))
+
+    def test_second_daemon_on_same_socket_is_refused(self):
+        with self.assertRaises(DaemonError):
+            Daemon(self.path, {}).serve()
+
+    def test_shutdown_removes_the_socket(self):
+        self.assertEqual("bye", self.client.call("shutdown"))
+        self.thread.join(timeout=5)
+
+        self.assertFalse(self.client.is_running())
+        self.assertIsNone(attached_daemon(self.tmp + "/no-daemon-here"))
+
+
+class WarmEnvironmentTest(unittest.TestCase):
+    def setUp(self):
+        self.environment = WarmEnvironment.__new__(WarmEnvironment)
+        self.environment._base = mock.Mock()
+        self.environment._base.deployments.verified.return_value = ["backup-maker-controller", "backup-repository"]
+        self.environment._deploy_lock = threading.Lock()
+
+    def test_attached_tests_do_not_check_fingerprints_again(self):
+        with mock.patch("framework.cli.EndToEndTestBase._load_release") as load_release:
+            self.assertEqual(["backup-maker-controller", "backup-repository"], self.environment.ensure_deployed())
+
+        load_release.assert_not_called()
+        self.environment._base.deployments.forget_verified.assert_not_called()
+        self.environment._base._deploy_client_and_server.assert_called_once_with(delete=False)
+
+    def test_explicit_deploy_compares_fingerprints_again(self):
+        with mock.patch("framework.cli.EndToEndTestBase._load_release") as load_release:
+            self.environment.deploy()
+            self.assertEqual(2, self.environment._base.deployments.forget_verified.call_count)
+            self.environment._base.deployments.invalidate.assert_not_called()
+
+            self.environment.deploy(force=True)
+            self.assertEqual(2, self.environment._base.deployments.invalidate.call_count)
+
+        self.assertEqual(2, load_release.call_count)
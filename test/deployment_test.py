@@ -0,0 +1,71 @@
+import os
+import unittest
+from unittest import mock
+
+from framework.deployment import DeploymentRegistry, running_images
+from framework.fakecluster import FakeCluster
+
+
+def _pod(name: str, image_id: str, terminating: bool = False) -> dict:
+    metadata = {"name": name, "labels": {"app": "server"}}
+    if terminating:
+        metadata["deletionTimestamp"] = "2026-01-01T00:00:00Z"
+
+    return {"apiVersion": "v1", "kind": "Pod", "metadata": metadata,
+            "status": {"containerStatuses": [{"name": "server", "imageID": image_id}]}}
+
+
+class DeploymentRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.cluster = FakeCluster(namespaces=["backups"])
+        self.registry = DeploymentRegistry(lambda: self.cluster)
+        self.cluster.apply([_pod("server-1", "sha256:new")], "backups")
+
+    def test_recorded_deployment_is_current_until_its_fingerprint_changes(self):
+        self.assertFalse(self.registry.is_current("backup-repository", "backups", "abc"))
+
+        self.registry.record("backups", "abc")
+
+        self.assertTrue(self.registry.is_current("backup-repository", "backups", "abc"))
+        self.assertFalse(self.registry.is_current("backup-repository", "backups", "def"))
+        self.assertFalse(self.registry.is_current("backup-repository", "backups", None))
+
+    def test_deployment_with_different_running_images_is_not_current(self):
+        self.registry.record("backups", "abc")
+        self.cluster.apply([_pod("server-1", "sha256:replaced")], "backups")
+
+        self.assertFalse(self.registry.is_current("backup-repository", "backups", "abc"))
+
+    def test_terminating_pods_are_not_recorded(self):
+        self.cluster.apply([_pod("server-0", "sha256:old", terminating=True)], "backups")
+
+        self.assertEqual(["sha256:new"], running_images(self.cluster, "backups"))
+
+    def test_missing_crd_forces_redeployment(self):
+        self.registry.record("backups", "abc", crds=["scheduledbackups.riotkit.org"])
+
+        self.assertFalse(self.registry.is_current("backup-repository", "backups", "abc"))
+
+    def test_invalidated_deployment_is_not_current(self):
+        self.registry.record("backups", "abc")
+        self.registry.mark_verified("backup-repository", "backups")
+
+        self.registry.invalidate("backup-repository", "backups")
+
+        self.assertFalse(self.registry.is_verified("backup-repository"))
+        self.assertFalse(self.registry.is_current("backup-repository", "backups", "abc"))
+
+    def test_redeploy_requested_by_environment(self):
+        self.registry.record("backups", "abc")
+
+        with mock.patch.dict(os.environ, {"BMT_REDEPLOY": "backup-maker-controller"}):
+            self.assertTrue(self.registry.is_current("backup-repository", "backups", "abc"))
+            self.assertFalse(self.registry.is_current("backup-maker-controller", "backups", "abc"))
+
+    def test_deleted_namespace_forgets_its_components(self):
+        self.registry.mark_verified("backup-repository", "backups")
+        self.registry.mark_verified("backup-maker-controller", "backup-maker-controller")
+
+        self.registry.forget_namespace("backups")
+
+        self.assertEqual(["backup-maker-controller"], self.registry.verified())
@@ -0,0 +1,21 @@
+import subprocess as sp
+import time
+import unittest
+
+from framework.endtoendbase import run
+
+
+class RunTest(unittest.TestCase):
+    def test_output_tail_is_attached_to_the_error(self):
+        with self.assertRaises(sp.CalledProcessError) as ctx:
+            run("echo failing; exit 3", shell=True)
+
+        self.assertEqual(3, ctx.exception.returncode)
+        self.assertIn(b"failing", ctx.exception.output)
+
+    def test_timeout_kills_children_of_a_shell(self):
+        started = time.monotonic()
+        with self.assertRaises(sp.TimeoutExpired):
+            run("(sleep 6; echo done)", shell=True, timeout=0.5)
+
+        self.assertLess(time.monotonic() - started, 3)
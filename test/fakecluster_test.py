@@ -0,0 +1,154 @@
+import threading
+import time
+import unittest
+
+from framework.clientserverbase import _Client, _Server
+from framework.endtoendbase import EndToEndTestBase
+from framework.fakecluster import FakeCluster, Transition, action_status, failing, succeeding
+from framework.manifests import BatchApplyError, default_applied_hashes
+from framework.namespaces import unique_namespace_name
+from framework.retry import RetryPolicy
+from framework.transport import set_default_transport
+from framework.waiters import RequestedBackupActionWaiter
+
+
+class FakeClusterTest(unittest.TestCase):
+    """
+    Scenario DSL and waiters running against the in-memory cluster - no Kubernetes needed
+    """
+
+    def setUp(self):
+        self.cluster = FakeCluster(namespaces=["backups"])
+        self._previous_transport = set_default_transport(self.cluster)
+
+        self.parent = EndToEndTestBase()
+        self.parent.setUp()
+        self.ns = unique_namespace_name("subject")
+        self.cluster.create_namespace(self.ns)
+        self.client = _Client(ns=self.ns, _parent=self.parent)
+
+    def tearDown(self):
+        set_default_transport(self._previous_transport)
+
+        # the next test gets an empty cluster
+        if default_applied_hashes() is not None:
+            for ns in self.cluster.namespaces():
+                default_applied_hashes().forget_namespace(ns)
+
+    def _schedule_a_backup(self):
+        self.client.i_schedule_a_backup(
+            name="app1", operation="backup", email="example@iwa-ait.org", cronjob_enabled=True,
+            schedule_every="00 02 * * *", collection_id="iwa-ait", access_token="token", template_name="pg15",
+            template_vars="Params: {}", template_kind="internal",
+        )
+
+    def test_scheduled_backup_is_applied_with_its_secret_first(self):
+        self._schedule_a_backup()
+
+        self.assertEqual([("Secret", self.ns, "backup-keys"), ("ScheduledBackup", self.ns, "app1")],
+                         self.cluster.applied)
+        self.assertEqual("iwa-ait", self.cluster.get("scheduledbackup", "app1", self.ns)["spec"]["collectionId"])
+
+    def test_unchanged_objects_are_not_applied_again(self):
+        self._schedule_a_backup()
+        self._schedule_a_backup()
+
+        self.assertEqual(2, len(self.cluster.applied))
+
+    def test_server_steps_are_applied_in_one_batch(self):
+        server = _Server(self.parent, "http://127.0.0.1:0", ns="backups")
+
+        with self.parent.batched_apply():
+            server.i_create_a_collection(name="iwa-ait", description="IWA-AIT website files",
+                                         filename_template="iwa-ait-${version}.tar.gz", max_backups_count=5,
+                                         max_one_version_size="1M", max_collection_size="10M", strategy_name="fifo")
+            self.assertEqual([], self.cluster.applied)
+
+        self.assertEqual(["Secret", "BackupCollection"], [kind for kind, _, _ in self.cluster.applied])
+
+    def test_backup_becomes_healthy(self):
+        self.cluster.script_action("iwa-ait-v1-backup", succeeding(job_seconds=0.05))
+        self._schedule_a_backup()
+
+        started = time.monotonic()
+        self.client.i_request_backup_action(name="iwa-ait-v1-backup", action="backup", ref="app1")
+
+        self.assertTrue(self.client.backup_has_status(name="iwa-ait-v1-backup", expected=True, timeout=5))
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+    def test_healthy_action_with_running_job_is_not_finished(self):
+        self.cluster.script_action("*", [Transition(0, action_status(healthy=True, running=True)),
+                                         Transition(0.2, action_status(healthy=True))])
+        self.client.i_request_backup_action(name="iwa-ait-v1-backup", action="backup", ref="app1")
+
+        self.assertFalse(self.client.backup_has_status(name="iwa-ait-v1-backup", expected=True, timeout=0.1))
+        self.assertTrue(self.client.backup_has_status(name="iwa-ait-v1-backup", expected=True, timeout=5))
+
+    def test_failed_action_times_out(self):
+        self.cluster.script_action("*-restore", failing())
+        self.client.i_request_backup_action(name="iwa-ait-v1-restore", action="restore", ref="app1")
+
+        self.assertFalse(self.client.backup_has_status(name="iwa-ait-v1-restore", expected=True, timeout=0.2))
+
+    def test_waiter_reconnects_when_watch_is_closed(self):
+        self.cluster.script_action("*", succeeding(job_seconds=0.3))
+        self.client.i_request_backup_action(name="iwa-ait-v1-backup", action="backup", ref="app1")
+        threading.Timer(0.1, self.cluster.close_watches).start()
+
+        waiter = RequestedBackupActionWaiter(self.parent, ns=self.ns, reconnect=RetryPolicy(initial_delay=0.01),
+                                             verbose=False)
+        self.assertEqual({"iwa-ait-v1-backup": True}, waiter.wait(["iwa-ait-v1-backup"], timeout=5))
+
+    def test_waiter_gives_up_when_reconnects_are_exhausted(self):
+        self.cluster.script_action("*", succeeding(job_seconds=0.3))
+        self.client.i_request_backup_action(name="iwa-ait-v1-backup", action="backup", ref="app1")
+        threading.Timer(0.1, self.cluster.close_watches).start()
+
+        waiter = RequestedBackupActionWaiter(self.parent, ns=self.ns, reconnect=RetryPolicy(attempts=1), verbose=False)
+        started = time.monotonic()
+        self.assertEqual({"iwa-ait-v1-backup": False}, waiter.wait(["iwa-ait-v1-backup"], timeout=5))
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_cancelled_waiter_returns_immediately(self):
+        waiter = RequestedBackupActionWaiter(self.parent, ns=self.ns, reconnect=RetryPolicy(initial_delay=0.01),
+                                             verbose=False)
+        threading.Timer(0.1, waiter.cancel).start()
+
+        started = time.monotonic()
+        self.assertEqual({"never-requested": False}, waiter.wait(["never-requested"], timeout=30))
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_multiple_actions_are_awaited_with_a_single_watch(self):
+        names = [f"action-{index}" for index in range(20)]
+        for name in names:
+            self.client.i_request_backup_action(name=name, action="backup", ref="app1")
+
+        self.assertEqual({name: True for name in names}, self.client.backups_have_status(names, expected=True,
+                                                                                           timeout=5))
+
+    def test_injected_apply_failure_names_the_step(self):
+        self.cluster.fail("apply", name_pattern="app1")
+
+        with self.assertRaises(BatchApplyError) as ctx:
+            self._schedule_a_backup()
+
+        self.assertIn("i_schedule_a_backup(app1)", str(ctx.exception))
+
+    def test_failing_step_is_named_without_inspecting_callers(self):
+        self.cluster.fail("apply", name_pattern="backup-1")
+        self.cluster.fail("apply", name_pattern="plain")
+
+        with self.assertRaises(BatchApplyError) as ctx, self.parent.batched_apply():
+            self.client.i_request_backup_action(name="backup-1", action="backup", ref="app1")
+        self.assertIn("i_request_backup_action(backup-1)", str(ctx.exception))
+
+        with self.assertRaises(BatchApplyError) as ctx, self.parent.batched_apply():
+            self.parent.apply_yaml("{apiVersion: v1, kind: ConfigMap, metadata: {name: plain}}", ns=self.ns)
+        self.assertIn("apply_yaml(ConfigMap/plain)", str(ctx.exception))
+
+    def test_deleting_namespace_deletes_its_objects(self):
+        self._schedule_a_backup()
+        self.cluster.delete_namespace(self.ns)
+
+        self.assertEqual([], self.cluster.list("scheduledbackup", self.ns))
+        self.assertNotIn(self.ns, self.cluster.namespaces())
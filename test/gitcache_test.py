@@ -0,0 +1,86 @@
+import os
+import shutil
+import subprocess as sp
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from framework.gitcache import GitMirrorCache
+
+
+class GitMirrorCacheTest(unittest.TestCase):
+    """
+    Checks the mirror + worktree cache against a local bare repository
+    """
+
+    def setUp(self) -> None:
+        self.tmp = tempfile.mkdtemp(prefix="bmt-gitcache-")
+        self.remote = self.tmp + "/remote.git"
+        self.url = "file://" + self.remote
+
+        sp.check_call(["git", "init", "--quiet", "--bare", self.remote])
+        sp.check_call(["git", "clone", "--quiet", self.remote, self.tmp + "/work"], stderr=sp.DEVNULL)
+        sp.check_call(["git", "checkout", "--quiet", "-b", "main"], cwd=self.tmp + "/work")
+        self.commits = [self._commit(str(i)) for i in range(3)]
+        sp.check_call(["git", "tag", "v1", self.commits[1]], cwd=self.tmp + "/work")
+        sp.check_call(["git", "push", "--quiet", "origin", "main", "v1"], cwd=self.tmp + "/work")
+
+        self.cache = GitMirrorCache(self.tmp + "/cache")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp)
+
+    def _commit(self, content: str) -> str:
+        with open(self.tmp + "/work/file.txt", "w") as f:
+            f.write(content)
+        sp.check_call(["git", "add", "file.txt"], cwd=self.tmp + "/work")
+        sp.check_call(["git", "-c", "user.name=test", "-c", "user.email=test@example.org", "commit",
+                       "--quiet", "-m", content], cwd=self.tmp + "/work")
+        return sp.check_output(["git", "rev-parse", "HEAD"], cwd=self.tmp + "/work").decode('utf-8').strip()
+
+    def _read(self, path: str) -> str:
+        with open(path + "/file.txt", "r") as f:
+            return f.read()
+
+    def test_branch_tag_and_commit_are_checked_out_side_by_side(self):
+        main = self.cache.worktree(self.url, "main")
+        tag = self.cache.worktree(self.url, "v1")
+        commit = self.cache.worktree(self.url, self.commits[0])
+
+        self.assertEqual("2", self._read(main))
+        self.assertEqual("1", self._read(tag))
+        self.assertEqual("0", self._read(commit))
+        self.assertEqual(3, len({main, tag, commit}))
+
+    def test_already_fetched_commit_and_tag_do_not_need_the_remote(self):
+        self.cache.worktree(self.url, "v1")
+        self.cache.worktree(self.url, self.commits[2])
+        shutil.rmtree(self.remote)
+
+        self.assertEqual(self.commits[1], self.cache.resolve(self.url, "v1"))
+        self.assertEqual(self.commits[2], self.cache.resolve(self.url, self.commits[2]))
+
+    def test_offline_mode_resolves_branch_from_fetched_refs(self):
+        self.cache.worktree(self.url, "main")
+        shutil.rmtree(self.remote)
+
+        self.cache.offline = True
+        self.assertEqual(self.commits[2], self.cache.resolve(self.url, "main"))
+
+    def test_new_commit_on_branch_gets_own_worktree(self):
+        old = self.cache.worktree(self.url, "main")
+        self._commit("3")
+        sp.check_call(["git", "push", "--quiet", "origin", "main"], cwd=self.tmp + "/work")
+
+        new = self.cache.worktree(self.url, "main")
+
+        self.assertNotEqual(old, new)
+        self.assertEqual("2", self._read(old))
+        self.assertEqual("3", self._read(new))
+
+    def test_parallel_callers_share_the_cache(self):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            paths = list(executor.map(lambda rev: self.cache.worktree(self.url, rev), ["main", "v1"] * 4))
+
+        self.assertEqual(2, len(set(paths)))
+        self.assertTrue(all(os.path.isfile(path + "/file.txt") for path in paths))
@@ -0,0 +1,121 @@
+import os
+import shutil
+import subprocess as sp
+import tempfile
+import unittest
+from unittest import mock
+
+import yaml
+
+from framework.endtoendbase import TESTS_DIR
+from framework.images import ImagePreloader, chart_images, images_in_documents, normalize_image, read_manifest, \
+    registries_config, registry_mirror_args, scenario_dirs, scenario_images
+
+RENDERED_CHART = """
+---
+apiVersion: apps/v1
+kind: StatefulSet
+spec:
+    template:
+        spec:
+            initContainers:
+                - name: init
+                  image: docker.io/bitnami/bitnami-shell:11
+            containers:
+                - name: postgresql
+                  image: docker.io/bitnami/postgresql:15.1.0
+"""
+
+RELEASE = {"name": "test", "repo": "https://charts.bitnami.com/bitnami", "version": "12.1.2",
+           "remoteChart": "postgresql", "setValues": {"auth": {"username": "riotkit"}, "tls": {"enabled": True}}}
+
+
+class ImagesTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.dir)
+
+    def test_names_are_normalized_like_containerd_reports_them(self):
+        self.assertEqual("docker.io/library/postgres:latest", normalize_image("postgres"))
+        self.assertEqual("docker.io/bitnami/postgresql:15", normalize_image("bitnami/postgresql:15"))
+        self.assertEqual("ghcr.io/riotkit-org/pgbr:0.2.0-pg15", normalize_image("ghcr.io/riotkit-org/pgbr:0.2.0-pg15"))
+        self.assertEqual("localhost:5000/app:latest", normalize_image("localhost:5000/app"))
+        self.assertEqual("docker.io/library/alpine@sha256:abc", normalize_image("alpine@sha256:abc"))
+
+    def test_manifest_skips_comments_and_blank_lines(self):
+        with open(self.dir + "/images.txt", "w") as f:
+            f.write("# header\n\nghcr.io/a/b:1  # used by Jobs\n  alpine:3\n")
+
+        self.assertEqual(["ghcr.io/a/b:1", "alpine:3"], read_manifest(self.dir + "/images.txt"))
+        self.assertEqual([], read_manifest(self.dir + "/missing.txt"))
+
+    def test_chart_is_rendered_once(self):
+        with mock.patch("framework.images.sp.check_output", return_value=RENDERED_CHART.encode()) as helm:
+            first = chart_images(RELEASE, self.dir)
+            second = chart_images(RELEASE, self.dir)
+
+        self.assertEqual(["docker.io/bitnami/bitnami-shell:11", "docker.io/bitnami/postgresql:15.1.0"], first)
+        self.assertEqual(first, second)
+        self.assertEqual(1, helm.call_count)
+        args = helm.call_args[0][0]
+        self.assertEqual(["helm", "template", "test", "postgresql", "--repo", "https://charts.bitnami.com/bitnami",
+                          "--version", "12.1.2", "--set", "auth.username=riotkit", "--set", "tls.enabled=true"], args)
+
+    def test_scenario_combines_manifest_and_charts(self):
+        with open(self.dir + "/images.txt", "w") as f:
+            f.write("ghcr.io/riotkit-org/pgbr:0.2.0-pg15\nbitnami/postgresql:15.1.0\n")
+        with open(self.dir + "/skaffold.yaml", "w") as f:
+            yaml.safe_dump({"deploy": {"helm": {"releases": [RELEASE]}}}, f)
+
+        with mock.patch("framework.images.sp.check_output", return_value=RENDERED_CHART.encode()):
+            images = scenario_images(self.dir, self.dir + "/cache")
+
+        self.assertEqual(["docker.io/bitnami/bitnami-shell:11", "docker.io/bitnami/postgresql:15.1.0",
+                          "ghcr.io/riotkit-org/pgbr:0.2.0-pg15"], images)
+
+    def test_only_missing_images_are_imported(self):
+        with open(self.dir + "/images.txt", "w") as f:
+            f.write("ghcr.io/a/present:1\nghcr.io/a/missing:1\nghcr.io/a/unavailable:1\n")
+
+        with mock.patch("framework.images.cluster_images", return_value={"ghcr.io/a/present:1"}), \
+                mock.patch.object(ImagePreloader, "_pull", side_effect=lambda image: "unavailable" not in image), \
+                mock.patch("framework.images.sp.check_output") as k3d:
+            preloader = ImagePreloader(self.dir + "/cache")
+            self.assertEqual(["ghcr.io/a/missing:1"], preloader.wait(self.dir, "bmt"))
+            self.assertEqual(["ghcr.io/a/missing:1"], preloader.wait(self.dir, "bmt"))
+
+        k3d.assert_called_once()
+        self.assertEqual(["k3d", "image", "import", "--cluster", "bmt", "ghcr.io/a/missing:1"], k3d.call_args[0][0])
+
+    def test_preloading_failure_does_not_fail_the_test(self):
+        with open(self.dir + "/images.txt", "w") as f:
+            f.write("ghcr.io/a/b:1\n")
+
+        with mock.patch("framework.images.cluster_images", side_effect=OSError("docker is not running")):
+            self.assertEqual([], ImagePreloader(self.dir).wait(self.dir, "bmt"))
+
+    def test_mirrors_config(self):
+        config = yaml.safe_load(registries_config(["docker.io", "ghcr.io"]))
+
+        self.assertEqual(["http://k3d-bmt-mirror-docker-io:5000"], config["mirrors"]["docker.io"]["endpoint"])
+        self.assertEqual(["http://k3d-bmt-mirror-ghcr-io:5000"], config["mirrors"]["ghcr.io"]["endpoint"])
+
+    def test_cluster_is_created_without_mirrors_when_they_cannot_be_created(self):
+        failure = sp.CalledProcessError(1, ["k3d", "registry", "create"], output=b"docker: not running")
+
+        with mock.patch("framework.images.sp.run", return_value=sp.CompletedProcess([], 1)), \
+                mock.patch("framework.images.sp.check_output", side_effect=failure):
+            self.assertEqual("", registry_mirror_args(self.dir))
+
+    def test_images_of_scenario_manifests_are_declared(self):
+        for path in scenario_dirs(TESTS_DIR + "/data"):
+            declared = {normalize_image(image) for image in read_manifest(path + "/images.txt")}
+
+            for name in sorted(os.listdir(path)):
+                if name.endswith(".yaml") and name != "skaffold.yaml":
+                    with open(f"{path}/{name}") as f:
+                        used = {normalize_image(image) for image in images_in_documents(yaml.safe_load_all(f))}
+
+                    self.assertEqual(set(), used - declared, f"{path}/{name} uses images missing in images.txt")
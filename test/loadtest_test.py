@@ -0,0 +1,41 @@
+import unittest
+
+from framework.loadtest import ActionTiming, percentile, server_accept_delays, summarize
+
+
+class LoadTestStatisticsTest(unittest.TestCase):
+    def test_percentile_is_nearest_rank(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(50, percentile(values, 50))
+        self.assertEqual(95, percentile(values, 95))
+        self.assertEqual(99, percentile(values, 99))
+        self.assertEqual(7, percentile([7], 99))
+        self.assertIsNone(percentile([], 50))
+
+    def test_summarize_skips_unknown_values(self):
+        summary = summarize([1.0, None, 3.0, 2.0])
+
+        self.assertEqual(3, summary["count"])
+        self.assertEqual(2.0, summary["p50"])
+        self.assertEqual(3.0, summary["max"])
+
+    def test_stages_are_computed_from_timestamps(self):
+        timing = ActionTiming(name="a", collection="c", requested_at=100.5, created_at=101, job_created_at=104,
+                              job_started_at=106, job_completed_at=116, healthy_at=118.5)
+
+        self.assertEqual(18.0, timing.latency)
+        self.assertEqual(3, timing.controller_queue)
+        self.assertEqual(2, timing.pod_start)
+        self.assertEqual(10, timing.job_run)
+        self.assertEqual(2.5, timing.status_report)
+
+    def test_server_accept_pairs_jobs_with_versions_in_order(self):
+        timings = [
+            ActionTiming(name="a", collection="c", requested_at=0, job_started_at=10),
+            ActionTiming(name="b", collection="c", requested_at=0, job_started_at=20),
+            ActionTiming(name="x", collection="other", requested_at=0, job_started_at=5),
+        ]
+        versions = {"c": [{"createdAt": "1970-01-01T00:00:25.123Z"}, {"createdAt": "1970-01-01T00:00:14Z"}]}
+
+        self.assertEqual([4, 5], server_accept_delays(timings, versions))
@@ -0,0 +1,96 @@
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from framework.logcollector import LogCollector, matches_selector
+from framework.transport import _StreamingWatch
+
+
+class _ScriptedStream(_StreamingWatch):
+    def __init__(self, items: list):
+        super().__init__()
+        self._items = items
+
+    def _open(self):
+        pass
+
+    def _stream(self):
+        yield from self._items
+
+    def close(self):
+        pass
+
+
+def _pod(name: str, labels: dict, state: str) -> dict:
+    return {
+        "type": "MODIFIED",
+        "object": {
+            "metadata": {"name": name, "labels": labels},
+            "status": {"containerStatuses": [{"name": "main", "restartCount": 0, "state": {state: {}}}]},
+        },
+    }
+
+
+class _FakeCluster(object):
+    def watch(self, kind: str, ns: str):
+        return _ScriptedStream([
+            _pod("server-0", {"app": "server"}, "running"),
+            _pod("backup-job-x", {"job-name": "backup"}, "terminated"),
+            _pod("pending-0", {"app": "server"}, "waiting"),
+        ])
+
+    def stream_logs(self, pod: str, ns: str, container: str = ''):
+        return _ScriptedStream([f"2024-01-01T00:00:0{i}Z {pod} line {i}" for i in range(5)])
+
+
+class LogCollectorTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.mkdtemp(prefix="bmt-logs-")
+        self.collector = LogCollector(lambda: _FakeCluster(), self.tmp, tail_lines=3)
+
+    def tearDown(self) -> None:
+        self.collector.stop()
+        shutil.rmtree(self.tmp)
+
+    def _wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_follows_all_started_containers_into_files_with_bounded_tail(self):
+        self.collector.follow("subject")
+        self._wait_for(lambda: self.collector.tail("subject").count("line 4") == 2)
+
+        tail = self.collector.tail("subject")
+        self.assertIn("backup-job-x line 4", tail)
+        self.assertNotIn("line 1", tail, "Only last 3 lines are kept in memory")
+        self.assertNotIn("pending-0", tail)
+
+        with open(os.path.join(self.tmp, "subject", "backup-job-x.main.log")) as f:
+            self.assertEqual(5, len(f.read().splitlines()), "Whole log is written to the file")
+
+    def test_tail_filters_by_label_selector(self):
+        self.collector.follow("subject")
+        self._wait_for(lambda: self.collector.tail("subject").count("line 4") == 2)
+
+        tail = self.collector.tail("subject", "app=server")
+        self.assertIn("server-0", tail)
+        self.assertNotIn("backup-job-x", tail)
+
+    def test_stopped_namespace_is_forgotten_without_leaking_loggers(self):
+        self.collector.follow("subject")
+        self._wait_for(lambda: self.collector.tail("subject").count("line 4") == 2)
+        self.collector.stop("subject")
+
+        self.assertEqual("", self.collector.tail("subject"))
+        self.assertEqual([], [name for name in logging.Logger.manager.loggerDict if name.startswith("bmt.pods")])
+        with open(os.path.join(self.tmp, "subject", "server-0.main.log")) as f:
+            self.assertEqual(5, len(f.read().splitlines()), "Files are kept after stopping")
+
+    def test_matches_selector(self):
+        self.assertTrue(matches_selector({"app": "a", "tier": "web"}, "app=a,tier==web"))
+        self.assertTrue(matches_selector({"app": "a"}, ""))
+        self.assertFalse(matches_selector({"app": "a"}, "app=b"))
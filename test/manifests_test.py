@@ -0,0 +1,66 @@
+import unittest
+
+from framework.manifests import CONTENT_HASH_ANNOTATION, AppliedHashes, ManifestBatch, apply_changed, \
+    content_hash, rendered_documents
+
+
+class _RecordingTransport(object):
+    def __init__(self, live: dict = None):
+        self.applied = []
+        self.live = live or {}
+
+    def apply(self, documents, ns):
+        self.applied.append([document["metadata"]["name"] for document in documents])
+
+    def get(self, kind, name, ns):
+        return self.live.get((kind, name, ns))
+
+
+def _secret(name: str, value: str) -> dict:
+    return {"apiVersion": "v1", "kind": "Secret", "metadata": {"name": name}, "stringData": {"value": value}}
+
+
+class AppliedHashesTest(unittest.TestCase):
+    def test_unchanged_objects_are_applied_once(self):
+        transport, hashes = _RecordingTransport(), AppliedHashes()
+
+        apply_changed(transport, [_secret("a", "1"), _secret("b", "1")], "backups", hashes)
+        apply_changed(transport, [_secret("a", "1"), _secret("b", "2")], "backups", hashes)
+        apply_changed(transport, [_secret("a", "1")], "other-ns", hashes)
+
+        self.assertEqual([["a", "b"], ["b"], ["a"]], transport.applied)
+        self.assertEqual(1, hashes.skipped)
+
+    def test_object_applied_by_previous_session_is_skipped(self):
+        secret = _secret("a", "1")
+        live = dict(secret, metadata={"name": "a", "annotations": {CONTENT_HASH_ANNOTATION: content_hash(secret)}})
+        transport = _RecordingTransport(live={("Secret", "a", "backups"): live})
+
+        apply_changed(transport, [secret], "backups", AppliedHashes())
+
+        self.assertEqual([], transport.applied)
+
+    def test_forgotten_namespace_is_applied_again(self):
+        transport, hashes = _RecordingTransport(), AppliedHashes()
+
+        apply_changed(transport, [_secret("a", "1")], "subject-1", hashes)
+        hashes.forget_namespace("subject-1")
+        apply_changed(transport, [_secret("a", "1")], "subject-1", hashes)
+
+        self.assertEqual([["a"], ["a"]], transport.applied)
+
+    def test_batch_submits_only_changed_documents(self):
+        transport, hashes = _RecordingTransport(), AppliedHashes()
+        apply_changed(transport, [_secret("a", "1")], "backups", hashes)
+
+        batch = ManifestBatch()
+        batch.add([_secret("a", "1"), _secret("b", "1")], "backups", step="test")
+        batch.submit(transport, hashes)
+
+        self.assertEqual([["a"], ["b"]], transport.applied)
+
+    def test_rendered_documents_are_independent_copies(self):
+        first = rendered_documents("kind: Secret\nmetadata:\n  name: a\n")
+        first[0]["metadata"]["name"] = "changed"
+
+        self.assertEqual("a", rendered_documents("kind: Secret\nmetadata:\n  name: a\n")[0]["metadata"]["name"])
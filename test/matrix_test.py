@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from framework.matrix import Cell, expand_matrix, format_table, junit_summary, parse_assignments, resolve_commits
+
+BASE = {"CONTROLLER_VERSION": "main", "BACKUP_MAKER_VERSION": "main", "SERVER_VERSION": "main"}
+
+
+class MatrixTest(unittest.TestCase):
+    def test_axes_are_combined_on_top_of_the_release(self):
+        cells = expand_matrix(BASE, {"SERVER_VERSION": ["main", "v4.0.0"], "CONTROLLER_VERSION": ["main", "v1.0.0"]},
+                              [parse_assignments("SERVER_VERSION=v3.9.0")])
+
+        self.assertEqual(["release", "server-v4.0.0", "controller-v1.0.0", "controller-v1.0.0_server-v4.0.0",
+                          "server-v3.9.0"], [cell.name for cell in cells])
+        self.assertEqual(dict(BASE, SERVER_VERSION="v3.9.0"), cells[-1].release)
+
+    def test_duplicate_combinations_run_once(self):
+        cells = expand_matrix(BASE, {"SERVER_VERSION": ["main", "v4.0.0"]}, [{"SERVER_VERSION": "v4.0.0"}])
+
+        self.assertEqual(["release", "server-v4.0.0"], [cell.name for cell in cells])
+
+    def test_invalid_assignment(self):
+        with self.assertRaises(ValueError):
+            parse_assignments("SERVER_VERSION")
+
+    def test_each_version_is_resolved_once_and_same_commits_are_built_once(self):
+        calls = []
+        commits = {"main": "a" * 40, "v4.0.0": "b" * 40, "release-4.0": "b" * 40}
+
+        def resolve(url: str, version: str) -> str:
+            calls.append((url.split("/")[-1], version))
+            return commits[version]
+
+        cells = expand_matrix(BASE, {"SERVER_VERSION": ["main", "v4.0.0", "release-4.0"]}, [])
+        plan = resolve_commits(cells, resolve)
+
+        self.assertEqual([("backup-repository", "main"), ("backup-maker-controller", "main"),
+                          ("backup-repository", "v4.0.0"), ("backup-repository", "release-4.0")], calls)
+        self.assertEqual({"a" * 40: ["main"], "b" * 40: ["v4.0.0", "release-4.0"]},
+                         plan["https://github.com/riotkit-org/backup-repository"])
+        self.assertEqual(dict(BASE, SERVER_VERSION="b" * 40, CONTROLLER_VERSION="a" * 40),
+                         cells[1].pinned_release())
+
+    def test_junit_summary_and_table(self):
+        tmp = tempfile.mkdtemp(prefix="bmt-matrix-")
+        try:
+            path = os.path.join(tmp, "report.junit.xml")
+            with open(path, "w") as f:
+                f.write("""<?xml version="1.0" encoding="utf-8"?>
+                <testsuites><testsuite name="pytest" errors="0" failures="1" skipped="0" tests="2" time="120.5">
+                    <testcase classname="a" name="one" time="100"><properties>
+                        <property name="timing: setUp" value="60.5"/>
+                        <property name="timing: setUp > _deploy_server" value="50"/>
+                    </properties></testcase>
+                    <testcase classname="a" name="two" time="20.5"><properties>
+                        <property name="timing: setUp" value="1.5"/>
+                    </properties><failure message="boom"/></testcase>
+                </testsuite></testsuites>""")
+
+            summary = junit_summary(path)
+        finally:
+            shutil.rmtree(tmp)
+
+        self.assertEqual({"tests": 2, "failures": 1, "errors": 0, "skipped": 0, "test_seconds": 120.5,
+                          "phases": {"setUp": 62.0}}, summary)
+
+        cell = Cell(name="server-v4.0.0", release=dict(BASE, SERVER_VERSION="v4.0.0"), exit_code=1,
+                    wall_seconds=130, tests=2, failures=1, test_seconds=120.5)
+        self.assertEqual("| SERVER_VERSION | result       | tests | wall [s] | tests [s] |\n"
+                         "|----------------|--------------|-------|----------|-----------|\n"
+                         "| v4.0.0         | FAILED (1/2) | 2     | 130      | 120       |",
+                         format_table([cell], ["SERVER_VERSION"]))
@@ -0,0 +1,50 @@
+import unittest
+
+from framework.namespaces import NamespaceReaper, unique_namespace_name
+
+
+class _TerminatingNamespaces(object):
+    """
+    Namespaces disappear on first check after deletion, except the ones with a stuck finalizer
+    """
+
+    def __init__(self, stuck=()):
+        self.stuck = set(stuck)
+        self.deleted = set()
+
+    def delete_namespace(self, name: str, wait: bool = True):
+        assert not wait, "Reaper must not block on deletion"
+        self.deleted.add(name)
+
+    def get(self, kind: str, name: str, ns: str):
+        if name in self.stuck or name not in self.deleted:
+            return {"metadata": {"name": name}, "status": {"phase": "Terminating"}}
+        return None
+
+
+class NamespaceReaperTest(unittest.TestCase):
+    def test_drain_waits_until_namespaces_are_gone(self):
+        cluster = _TerminatingNamespaces()
+        reaper = NamespaceReaper(lambda: cluster, poll_interval=0.01)
+
+        reaper.schedule("subject-1")
+        reaper.schedule("subject-2")
+
+        self.assertEqual([], reaper.drain(timeout=5))
+        self.assertEqual({"subject-1", "subject-2"}, cluster.deleted)
+
+    def test_drain_returns_namespaces_stuck_in_terminating(self):
+        cluster = _TerminatingNamespaces(stuck=["subject-stuck"])
+        reaper = NamespaceReaper(lambda: cluster, poll_interval=0.01)
+
+        reaper.schedule("subject-ok")
+        reaper.schedule("subject-stuck")
+
+        self.assertEqual(["subject-stuck"], reaper.drain(timeout=0.2))
+
+    def test_unique_names_are_valid_namespace_names(self):
+        names = {unique_namespace_name("subject") for _ in range(100)}
+
+        self.assertEqual(100, len(names))
+        self.assertTrue(all(name.startswith("subject-") for name in names))
+        self.assertLessEqual(len(unique_namespace_name("a" * 100)), 63)
@@ -0,0 +1,94 @@
+import sys
+import types
+import unittest
+from unittest import mock
+
+from framework.fakecluster import FakeCluster
+from framework.portforwards import PortForwardPool
+
+
+def _pod(name: str, phase: str = "Running") -> dict:
+    return {"apiVersion": "v1", "kind": "Pod",
+            "metadata": {"name": name, "labels": {"app": "server"}}, "status": {"phase": phase}}
+
+
+class PortForwardPoolTest(unittest.TestCase):
+    """
+    Runs the pool against FakeCluster, with the native port-forward extension replaced by a recorder
+    """
+
+    def setUp(self):
+        self.cluster = FakeCluster(namespaces=["backups"])
+        self.cluster.apply([_pod("server-1")], "backups")
+        self.pool = PortForwardPool(lambda: self.cluster, ready_timeout=2)
+        self.healthy = True
+        self.calls = []
+
+        native = types.SimpleNamespace(
+            forward=lambda ns, pod, local_port, remote_port, *args: self.calls.append(("forward", pod, remote_port)),
+            stop=lambda ns, pod: self.calls.append(("stop", pod)),
+        )
+        public = types.SimpleNamespace(_config_path=lambda path: "/kubeconfig",
+                                       LogLevel=types.SimpleNamespace(ERROR=types.SimpleNamespace(value=3)))
+        modules = mock.patch.dict(sys.modules, {"_portforward": native, "portforward": public})
+        modules.start()
+        self.addCleanup(modules.stop)
+
+    def _probe(self, local_port: int) -> bool:
+        return self.healthy
+
+    def test_working_forward_is_reused(self):
+        port = self.pool.get("backups", "app=server", 8080, probe=self._probe)
+
+        self.assertEqual(port, self.pool.get("backups", "app=server", 8080, probe=self._probe))
+        self.assertEqual([("forward", "server-1", 8080)], self.calls)
+
+    def test_forward_follows_a_replaced_pod(self):
+        port = self.pool.get("backups", "app=server", 8080, probe=self._probe)
+        self.cluster.delete("pod", "server-1", "backups")
+        self.cluster.apply([_pod("server-2")], "backups")
+
+        self.assertEqual(port, self.pool.get("backups", "app=server", 8080, probe=self._probe),
+                         "Local port is kept, clients do not have to be reconfigured")
+        self.assertEqual([("forward", "server-1", 8080), ("stop", "server-1"), ("forward", "server-2", 8080)],
+                         self.calls)
+
+    def test_forwards_to_other_ports_of_same_pod_do_not_stop_each_other(self):
+        self.pool.get("backups", "app=server", 8080, probe=self._probe)
+        self.pool.get("backups", "app=server", 5432, probe=self._probe)
+
+        # stops responding, the re-established forward works again
+        answers = iter([False, True])
+        self.pool.get("backups", "app=server", 8080, probe=lambda port: next(answers))
+
+        self.assertNotIn(("stop", "server-1"), self.calls, "Forward to 5432 is still in use")
+
+        self.pool.stop_namespace("backups")
+        self.assertEqual([("stop", "server-1")], [call for call in self.calls if call[0] == "stop"])
+        self.assertEqual([], self.pool.forwards())
+
+    def test_probe_is_retried_until_the_forward_responds(self):
+        answers = iter([False, False, True])
+
+        self.pool.get("backups", "app=server", 8080, probe=lambda port: next(answers))
+
+        self.assertIsNone(next(answers, None), "Probed three times")
+
+    def test_forward_not_responding_in_time_is_stopped(self):
+        self.healthy = False
+        pool = PortForwardPool(lambda: self.cluster, ready_timeout=0.5)
+
+        with self.assertRaisesRegex(TimeoutError, "is not responding"):
+            pool.get("backups", "app=server", 8080, probe=self._probe)
+
+        self.assertEqual([("forward", "server-1", 8080), ("stop", "server-1")], self.calls)
+        self.assertEqual([], pool.forwards())
+
+    def test_missing_pod_times_out(self):
+        self.cluster.apply([_pod("server-1", phase="Pending")], "backups")
+        pool = PortForwardPool(lambda: self.cluster, ready_timeout=0.5)
+
+        with self.assertRaisesRegex(TimeoutError, "running Pod not found"):
+            pool.get("backups", "app=server", 8080, probe=self._probe)
+
+        self.assertEqual([], self.calls)
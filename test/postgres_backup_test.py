@@ -2,6 +2,7 @@ import time
 import typing
 import os
 from framework import ClientServerBase
+from framework.portforwards import postgres_probe
 from framework.postgresbase import PostgresTestingHelper
 
 
@@ -14,12 +15,18 @@ class PostgresBackupTest(ClientServerBase):
 
         self.postgres = PostgresTestingHelper(
             host="127.0.0.1",
-            port=8053,
+            port=0,  # assigned by port_forward()
             user="riotkit",
             password="warisbad",
             db_name="backuprepository",
+            admin_user="postgres",
+            admin_password="warisbad",
         )
 
+    def tearDown(self) -> None:
+        self.postgres.close()
+        super().tearDown()
+
     def test_postgres_backup_and_restore_with_internal_template(self):
         self._run_simple_test(pg_template="pg15", template_type="internal")
 
@@ -32,31 +39,32 @@ class PostgresBackupTest(ClientServerBase):
 
     def _run_simple_test(self, pg_template: str, template_type: str, prepare: typing.Callable = None):
         with self.in_dir("test/data/postgres_backup_test"), \
-                self.kubernetes_namespace("subject"), \
+                self.subject_namespace(), \
                 self.show_logs_on_failure():
-            # deploy a test postgres instance
-            self.skaffold_deploy()
-            self.port_forward(local_port=8053, remote_port=5432,
-                              pod_label="app.kubernetes.io/name=postgresql",
-                              ns="subject")
+            # a test postgres instance, shared by tests
+            pg_ns = self.postgres_subject()
+            self.postgres.port = self.port_forward(remote_port=5432,
+                                                   pod_label="app.kubernetes.io/name=postgresql",
+                                                   ns=pg_ns, probe=postgres_probe)
 
             # ------------------------
             # Prepare server instance
             # ------------------------
-            self.server.i_create_a_user(
-                name="international-workers-association",
-                email="example@iwa-ait.org",
-                password="cnt1936",
-            )
-            self.server.i_create_a_collection(
-                name="iwa-ait",
-                description="IWA-AIT website files",
-                filename_template="iwa-ait-${version}.tar.gz",
-                max_backups_count=5,
-                max_one_version_size="1M",
-                max_collection_size="10M",
-                strategy_name="fifo"
-            )
+            with self.batched_apply():
+                self.server.i_create_a_user(
+                    name="international-workers-association",
+                    email="example@iwa-ait.org",
+                    password="cnt1936",
+                )
+                self.server.i_create_a_collection(
+                    name="iwa-ait",
+                    description="IWA-AIT website files",
+                    filename_template="iwa-ait-${version}.tar.gz",
+                    max_backups_count=5,
+                    max_one_version_size="1M",
+                    max_collection_size="10M",
+                    strategy_name="fifo"
+                )
             access_token = self.server.i_login(
                 username="international-workers-association",
                 password="cnt1936"
@@ -69,16 +77,17 @@ class PostgresBackupTest(ClientServerBase):
             if prepare:
                 prepare()
 
-            # Prepare the subject of our backup
+            # Prepare the subject of our backup - seeded once, then copied from the template database
             # language=postgresql
-            self.postgres.query("""
+            self.postgres.reset_from_template("bmt_movies_v1", seed=lambda: self.postgres.query("""
                 CREATE TABLE IF NOT EXISTS movies (
                     id 	INT PRIMARY KEY,
                     name VARCHAR(64) NOT NULL
                 );
                 INSERT INTO public.movies (id, name) VALUES (1, 'Ni dieu ni maitre, une historie de l"anarchisme');
                 COMMIT;
-            """)
+            """))
+            before_backup = self.postgres.fingerprint(["public.movies"])
 
             # Create a backup definition
             self.client.i_schedule_a_backup(
@@ -94,7 +103,7 @@ class PostgresBackupTest(ClientServerBase):
                 # language=yaml
                 template_vars=f"""
                     Params:
-                        hostname: test-postgresql.subject.svc.cluster.local
+                        hostname: test-postgresql.{pg_ns}.svc.cluster.local
                         port: 5432
                         db: backuprepository
                         user: riotkit
@@ -127,7 +136,8 @@ class PostgresBackupTest(ClientServerBase):
             self.assertEqual([('Ni dieu ni maitre, une historie de l"anarchisme',), ('Some-wrong-title',)],
                              self.postgres.select("SELECT name FROM public.movies"))
 
-            # Try to restore
+            # Try to restore - without our idle connections, which could block the database from being recreated
+            self.postgres.close()
             self.client.i_request_backup_action(
                 name="iwa-ait-v1-restore",
                 action="restore",
@@ -137,5 +147,4 @@ class PostgresBackupTest(ClientServerBase):
             time.sleep(4)
 
             # Check
-            self.assertEqual([('Ni dieu ni maitre, une historie de l"anarchisme',)],
-                             self.postgres.select("SELECT name FROM public.movies"))
+            self.assertEqual([], self.postgres.verify_fingerprint(before_backup))
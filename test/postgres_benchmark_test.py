@@ -0,0 +1,139 @@
+import os
+import unittest
+from framework import ClientServerBase, BUILD_DIR
+from framework.benchmark import BenchmarkResult, dataset_from_env, dataset_template, seed_dataset, \
+    database_size, job_duration, report_path, version_size, table_name, write_report
+from framework.portforwards import postgres_probe
+from framework.postgresbase import PostgresTestingHelper
+from framework.timing import tracer
+
+# restored tables are verified by fingerprints; on a mismatch differing ranges of this many ids are reported
+FINGERPRINT_CHUNK_ROWS = 10000
+
+
+@unittest.skipUnless(os.getenv("BENCHMARK") == "true", "Benchmarks are enabled with BENCHMARK=true")
+class PostgresBenchmarkTest(ClientServerBase):
+    """
+    Measures backup & restore throughput of a PostgreSQL database on generated data volumes.
+    Select volumes with BENCHMARK_PROFILES (see framework.benchmark.PROFILES) or BENCHMARK_ROWS & co.
+    """
+
+    def __init__(self, methodName: str):
+        super().__init__(methodName)
+
+        self.postgres = PostgresTestingHelper(
+            host="127.0.0.1",
+            port=0,  # assigned by port_forward()
+            user="riotkit",
+            password="warisbad",
+            db_name="backuprepository",
+            admin_user="postgres",
+            admin_password="warisbad",
+        )
+
+    def tearDown(self) -> None:
+        self.postgres.close()
+        super().tearDown()
+
+    def test_postgres_backup_and_restore_throughput(self):
+        results = []
+
+        with self.in_dir("test/data/postgres_backup_test"), \
+                self.subject_namespace(), \
+                self.show_logs_on_failure():
+            pg_ns = self.postgres_subject()
+            self.postgres.port = self.port_forward(remote_port=5432,
+                                                   pod_label="app.kubernetes.io/name=postgresql",
+                                                   ns=pg_ns, probe=postgres_probe)
+
+            with self.batched_apply():
+                self.server.i_create_a_user(
+                    name="international-workers-association",
+                    email="example@iwa-ait.org",
+                    password="cnt1936",
+                )
+                self.server.i_create_a_collection(
+                    name="benchmark",
+                    description="Benchmark backups",
+                    filename_template="benchmark-${version}.tar.gz",
+                    max_backups_count=2,
+                    max_one_version_size="50G",
+                    max_collection_size="100G",
+                    strategy_name="fifo"
+                )
+            access_token = self.server.i_login(
+                username="international-workers-association",
+                password="cnt1936"
+            )
+            self.client.i_schedule_a_backup(
+                name="benchmark",
+                operation="backup",
+                cronjob_enabled=False,
+                schedule_every="00 02 * * *",
+                collection_id="benchmark",
+                access_token=access_token,
+                template_name="pg15",
+                template_kind="internal",
+                email="example@iwa-ait.org",
+                # language=yaml
+                template_vars=f"""
+                    Params:
+                        hostname: test-postgresql.{pg_ns}.svc.cluster.local
+                        port: 5432
+                        db: backuprepository
+                        user: riotkit
+                        password: "warisbad"
+
+                    Repository:
+                        url: "http://server-backup-repository-server.backups.svc.cluster.local:8080"
+                        encryptionKeyPath: "/mnt/secrets/gpg-key"
+                        passphrase: ""
+                        recipient: "example@iwa-ait.org"
+                        collectionId: "benchmark"
+                """,
+            )
+
+            for spec in dataset_from_env():
+                results.append(self._measure(spec, access_token))
+
+        write_report(report_path("postgres", BUILD_DIR + "/benchmarks"), self.release, results)
+
+    def _measure(self, spec, access_token: str) -> BenchmarkResult:
+        print(f" >>> Benchmark dataset: {spec}")
+        # generated once per dataset, later runs copy the template database
+        template = dataset_template(spec)
+        if not self.postgres.reset_from_template(template, seed=lambda: seed_dataset(self.postgres, spec)):
+            print(f" >>> Dataset {spec.name} copied from template database {template}")
+        raw_db_bytes = database_size(self.postgres)
+        before_backup = self.postgres.fingerprint([table_name(index) for index in range(spec.tables)],
+                                                  chunk_rows=FINGERPRINT_CHUNK_ROWS)
+        self.postgres.close()
+
+        backup_name = f"benchmark-{spec.name}-backup"
+        with tracer.span("backup", dataset=spec.name) as backup:
+            self.client.i_request_backup_action(name=backup_name, action="backup", ref="benchmark")
+            assert self.client.backup_has_status(name=backup_name, expected=True, timeout=3600)
+
+        versions = self.server.i_list_versions("benchmark", access_token)
+
+        # simulate the data loss, then restore
+        for index in range(spec.tables):
+            self.postgres.query(f"DROP TABLE {table_name(index)}")
+        self.postgres.close()
+
+        restore_name = f"benchmark-{spec.name}-restore"
+        with tracer.span("restore", dataset=spec.name) as restore:
+            self.client.i_request_backup_action(name=restore_name, action="restore", ref="benchmark")
+            assert self.client.backup_has_status(name=restore_name, expected=True, timeout=3600)
+
+        self.assertEqual([], self.postgres.verify_fingerprint(before_backup))
+
+        return BenchmarkResult(
+            dataset=spec,
+            raw_db_bytes=raw_db_bytes,
+            backup_latency_seconds=round(backup.duration, 3),
+            backup_job_seconds=job_duration(self.transport, self.client.ns, backup_name),
+            restore_latency_seconds=round(restore.duration, 3),
+            restore_job_seconds=job_duration(self.transport, self.client.ns, restore_name),
+            stored_backup_bytes=version_size(versions[-1]) if versions else None,
+        )
@@ -0,0 +1,146 @@
+import unittest
+from unittest import mock
+
+import psycopg2
+
+from framework.postgresbase import ChunkFingerprint, PostgresTestingHelper, TableFingerprint, _copy_value, \
+    _CopyReader
+
+
+def _chunked(*chunks) -> TableFingerprint:
+    chunks = [ChunkFingerprint(lower=lower, upper=lower + 10, rows=rows, hash=hash_sum)
+              for lower, rows, hash_sum in chunks]
+    return TableFingerprint(table="public.movies", rows=sum(c.rows for c in chunks),
+                            hash=sum(c.hash for c in chunks), chunk_rows=10, chunks=chunks)
+
+
+class CopyFormatTest(unittest.TestCase):
+    def test_values_are_escaped_for_the_text_format(self):
+        self.assertEqual("\\N", _copy_value(None))
+        self.assertEqual("t", _copy_value(True))
+        self.assertEqual("42", _copy_value(42))
+        self.assertEqual("a\\tb\\nc\\rd\\\\e", _copy_value("a\tb\nc\rd\\e"))
+        self.assertEqual("\\\\x00ff", _copy_value(b"\x00\xff"))
+        self.assertEqual("\\\\x", _copy_value(memoryview(b"")))
+
+    def test_chunks_split_rows_at_any_position(self):
+        rows = [(index, f"movie\t{index}", None) for index in range(100)]
+        expected = "".join(f"{index}\tmovie\\t{index}\t\\N\n" for index in range(100))
+
+        for size in [1, 7, 64, len(expected), len(expected) + 1]:
+            reader = _CopyReader(iter(rows))
+            chunks = list(iter(lambda: reader.read(size), ""))
+
+            self.assertEqual(expected, "".join(chunks), f"size {size}")
+            self.assertTrue(all(len(chunk) == size for chunk in chunks[:-1]), f"size {size}")
+            self.assertEqual(100, reader.rows_count)
+
+    def test_whole_content_is_read_without_size(self):
+        reader = _CopyReader([(1, "a"), (2, "b")])
+
+        self.assertEqual("1\ta\n2\tb\n", reader.read())
+        self.assertEqual("", reader.read())
+
+
+class PooledConnectionTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.postgres = PostgresTestingHelper(db_name="backuprepository", user="riotkit", host="127.0.0.1",
+                                              password="warisbad", port=5432)
+        self.pool = mock.MagicMock()
+        self.conn = self.pool.getconn.return_value
+        self.conn.closed = 0
+        self.cursor = self.conn.cursor.return_value.__enter__.return_value
+        patcher = mock.patch.object(PostgresTestingHelper, "_get_pool", return_value=self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_transaction_is_committed_and_connection_returned(self):
+        self.postgres.query("DELETE FROM movies")
+
+        self.cursor.execute.assert_called_once_with("DELETE FROM movies", None)
+        self.conn.commit.assert_called_once()
+        self.pool.putconn.assert_called_once_with(self.conn, close=False)
+
+    def test_transaction_is_rolled_back_on_error(self):
+        self.cursor.execute.side_effect = psycopg2.DataError("invalid input")
+
+        with self.assertRaises(psycopg2.DataError):
+            self.postgres.query("INSERT INTO movies VALUES ('x')")
+
+        self.conn.rollback.assert_called_once()
+        self.conn.commit.assert_not_called()
+        self.pool.putconn.assert_called_once_with(self.conn, close=False)
+
+    def test_broken_connection_is_not_returned_to_the_pool(self):
+        self.cursor.execute.side_effect = psycopg2.InterfaceError("connection already closed")
+
+        with self.assertRaises(psycopg2.InterfaceError):
+            self.postgres.query("SELECT 1")
+
+        self.pool.putconn.assert_called_once_with(self.conn, close=True)
+
+    def test_stream_fetches_batches_with_a_named_cursor(self):
+        self.cursor.fetchmany.side_effect = [[(1,), (2,)], [(3,)], []]
+
+        self.assertEqual([(1,), (2,), (3,)], list(self.postgres.stream("SELECT id FROM movies", batch_size=2)))
+        self.assertTrue(self.conn.cursor.call_args[1]["name"].startswith("bmt_"))
+        self.cursor.fetchmany.assert_called_with(2)
+        self.conn.commit.assert_called_once()
+
+    def test_copy_rows_streams_the_generator(self):
+        copied = []
+        self.cursor.copy_expert.side_effect = lambda sql, reader, size: copied.append((sql, reader.read(), size))
+
+        loaded = self.postgres.copy_rows("movies", ((index, "title") for index in range(3)), columns=["id", "title"],
+                                         buffer_size=4096)
+
+        self.assertEqual(3, loaded)
+        self.assertEqual([("COPY movies (id, title) FROM STDIN", "0\ttitle\n1\ttitle\n2\ttitle\n", 4096)], copied)
+
+
+class TableFingerprintTest(unittest.TestCase):
+    def test_identical_tables(self):
+        before = _chunked((0, 10, 111), (10, 10, 222))
+
+        self.assertTrue(before.matches(_chunked((0, 10, 111), (10, 10, 222))))
+        self.assertEqual([], before.differing_ranges(_chunked((0, 10, 111), (10, 10, 222))))
+
+    def test_whole_table_fingerprint_ignores_chunking(self):
+        self.assertTrue(TableFingerprint(table="public.movies", rows=20, hash=333)
+                        .matches(_chunked((0, 10, 111), (10, 10, 222))))
+
+    def test_adjacent_differing_ranges_are_merged(self):
+        before = _chunked((0, 10, 1), (10, 10, 2), (20, 10, 3), (30, 10, 4), (40, 10, 5))
+        after = _chunked((0, 10, 1), (10, 10, -2), (20, 9, 3), (30, 10, 4), (40, 10, 6))
+
+        self.assertFalse(before.matches(after))
+        self.assertEqual([(10, 30), (40, 50)], before.differing_ranges(after))
+
+    def test_missing_and_extra_chunks_differ(self):
+        before = _chunked((0, 10, 1), (10, 10, 2))
+        after = _chunked((0, 10, 1), (30, 1, 7))
+
+        self.assertEqual([(10, 20), (30, 40)], before.differing_ranges(after))
+
+
+class TemplateDatabaseTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.postgres = PostgresTestingHelper(db_name="backuprepository", user="riotkit", host="127.0.0.1",
+                                              password="warisbad", port=5432)
+        self.calls = []
+
+    def _reset_from_template(self, existing: set) -> bool:
+        with mock.patch.object(PostgresTestingHelper, "database_exists", side_effect=lambda name: name in existing), \
+                mock.patch.object(PostgresTestingHelper, "reset",
+                                  side_effect=lambda template="template0": self.calls.append(("reset", template))), \
+                mock.patch.object(PostgresTestingHelper, "snapshot",
+                                  side_effect=lambda template: self.calls.append(("snapshot", template))):
+            return self.postgres.reset_from_template("bmt_movies", seed=lambda: self.calls.append(("seed",)))
+
+    def test_first_use_seeds_an_empty_database_then_snapshots_it(self):
+        self.assertTrue(self._reset_from_template(existing=set()))
+        self.assertEqual([("reset", "template0"), ("seed",), ("snapshot", "bmt_movies")], self.calls)
+
+    def test_existing_template_is_copied_without_seeding(self):
+        self.assertFalse(self._reset_from_template(existing={"bmt_movies"}))
+        self.assertEqual([("reset", "bmt_movies")], self.calls)
@@ -0,0 +1,98 @@
+import subprocess as sp
+import unittest
+
+from framework.retry import RetryPolicy, is_network_failure, is_transient, retry, retry_stats, wait_until
+from framework.transport import ApplyError, KubernetesApiError
+
+FAST = RetryPolicy(attempts=4, initial_delay=0.001, max_delay=0.002)
+
+
+class _Flaky(object):
+    def __init__(self, *errors: Exception):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "done"
+
+
+class RetryTest(unittest.TestCase):
+    def test_transient_errors_are_retried(self):
+        flaky = _Flaky(sp.CalledProcessError(1, ["skaffold", "build"]), KubernetesApiError(503, "Unavailable", ""))
+
+        self.assertEqual("done", retry("test: transient", flaky, FAST))
+        self.assertEqual(3, flaky.calls)
+        self.assertEqual([True, True, False], [attempt.error is not None
+                                               for attempt in retry_stats.attempts("test: transient")])
+
+    def test_fatal_error_is_raised_immediately(self):
+        flaky = _Flaky(ApplyError("BackupCollection/x: spec.strategyName: Invalid value"))
+
+        with self.assertRaises(ApplyError):
+            retry("test: fatal", flaky, FAST)
+        self.assertEqual(1, flaky.calls)
+
+    def test_last_error_is_raised_when_attempts_are_exhausted(self):
+        flaky = _Flaky(*[TimeoutError(str(number)) for number in range(10)])
+
+        with self.assertRaisesRegex(TimeoutError, "3"):
+            retry("test: exhausted", flaky, FAST)
+        self.assertEqual(4, flaky.calls)
+        self.assertEqual({"attempts": 4, "failures": 4}, {key: value for key, value in
+                                                          retry_stats.summary()["test: exhausted"].items()
+                                                          if key != "seconds"})
+
+    def test_deadline_stops_retrying(self):
+        flaky = _Flaky(*[TimeoutError() for _ in range(10)])
+
+        with self.assertRaises(TimeoutError):
+            retry("test: deadline", flaky, RetryPolicy(attempts=10, initial_delay=0.05, deadline=0.01))
+        self.assertEqual(1, flaky.calls)
+
+    def test_backoff_is_exponential_with_jitter_and_capped(self):
+        delays = list(RetryPolicy(attempts=6, initial_delay=1, max_delay=5, jitter=0.2).delays())
+
+        self.assertEqual(5, len(delays))
+        for delay, expected in zip(delays, [1, 2, 4, 5, 5]):
+            self.assertTrue(expected * 0.8 <= delay <= expected * 1.2, (delay, expected))
+
+    def test_classification(self):
+        self.assertTrue(is_transient(KubernetesApiError(429, "TooManyRequests", "")))
+        self.assertFalse(is_transient(KubernetesApiError(422, "Invalid", "")))
+        self.assertFalse(is_transient(AssertionError()))
+
+        try:
+            try:
+                raise KubernetesApiError(500, "InternalError", "etcd timeout")
+            except KubernetesApiError as err:
+                raise ApplyError("Secret/x: 500") from err
+        except ApplyError as err:
+            self.assertTrue(is_transient(err))
+
+    def test_manifest_rejected_by_kubectl_is_fatal(self):
+        try:
+            try:
+                raise sp.CalledProcessError(1, ["kubectl", "apply"], stderr=b'The Secret "x" is invalid')
+            except sp.CalledProcessError as err:
+                raise ApplyError('The Secret "x" is invalid') from err
+        except ApplyError as err:
+            self.assertFalse(is_transient(err))
+
+    def test_failed_commands_are_retried_only_on_network_failures(self):
+        compile_error = sp.CalledProcessError(1, ["skaffold", "build"], output=b"main.go:12: undefined: foo")
+        push_error = sp.CalledProcessError(1, ["skaffold", "build"],
+                                           output=b"Get \"http://bmt-registry:5000/v2/\": dial tcp: connection refused")
+
+        self.assertFalse(is_network_failure(compile_error))
+        self.assertTrue(is_network_failure(push_error))
+        self.assertTrue(is_network_failure(sp.TimeoutExpired(["skaffold", "deploy"], 10)))
+        self.assertFalse(is_network_failure(AssertionError()))
+
+    def test_wait_until(self):
+        values = iter([False, False, True])
+
+        self.assertTrue(wait_until(lambda: next(values), timeout=1, initial_delay=0.001))
+        self.assertFalse(wait_until(lambda: False, timeout=0.01, initial_delay=0.001))
@@ -0,0 +1,65 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from framework.scheduler import assign, collect_tests, estimate, load_durations, record_durations, selection_args
+
+TESTS_DIR = os.path.dirname(os.path.realpath(__file__))
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_longest_tests_are_spread_first(self):
+        durations = {"a": 100, "b": 60, "c": 50, "d": 40, "e": 10}
+
+        buckets = assign(list(durations), durations, workers=2)
+
+        self.assertEqual([["a", "d"], ["b", "c", "e"]], buckets)
+        self.assertEqual([140, 120], [sum(durations[test] for test in bucket) for bucket in buckets])
+
+    def test_unknown_tests_are_estimated_as_median_of_known(self):
+        durations = {"a": 10, "b": 30, "c": 1000}
+
+        buckets = assign(["a", "b", "c", "new"], durations, workers=2)
+
+        self.assertEqual([["c"], ["b", "new", "a"]], buckets)
+
+    def test_unit_tests_are_not_estimated_as_end_to_end_tests(self):
+        durations = {"e2e_a": 100, "e2e_b": 90}
+        tests = ["e2e_a", "e2e_b", "e2e_new"] + [f"unit_{index}" for index in range(20)]
+
+        buckets = assign(tests, durations, workers=3, e2e={"e2e_a", "e2e_b", "e2e_new"})
+
+        self.assertEqual([1, 1, 1], [len([test for test in bucket if test.startswith("e2e")]) for bucket in buckets],
+                         "Every end-to-end test gets its own worker")
+        self.assertEqual(95, estimate(tests, durations, {"e2e_new"})["e2e_new"])
+        self.assertLess(estimate(tests, durations, {"e2e_new"})["unit_0"], 1)
+
+    def test_end_to_end_tests_are_reported_by_collection(self):
+        tests, e2e = collect_tests([f"{TESTS_DIR}/scheduler_test.py", f"{TESTS_DIR}/installing_test.py"])
+
+        self.assertIn("test/scheduler_test.py::SchedulerTest::test_more_workers_than_tests", tests)
+        self.assertEqual({test for test in tests if test.startswith("test/installing_test.py")}, e2e)
+        self.assertTrue(e2e)
+
+    def test_more_workers_than_tests(self):
+        self.assertEqual([["a"], [], []], assign(["a"], {}, workers=3))
+
+    def test_selection_options_are_used_for_collection(self):
+        self.assertEqual(["-k", "crd", "-m", "not slow", "--deselect=test/a.py::A::test_x", "-kbackup"],
+                         selection_args(["-s", "-k", "crd", "--tb=short", "-m", "not slow",
+                                         "--deselect=test/a.py::A::test_x", "-kbackup", "-x"]))
+
+    def test_durations_are_merged_with_history(self):
+        tmp = tempfile.mkdtemp(prefix="bmt-durations-")
+        path = os.path.join(tmp, "durations.json")
+        try:
+            record_durations(path, {"a": 10, "b": 4})
+            record_durations(path, {"a": 20})
+
+            self.assertEqual({"a": 15, "b": 4}, load_durations(path))
+            with open(path) as f:
+                self.assertEqual(["a", "b"], list(json.load(f).keys()))
+        finally:
+            shutil.rmtree(tmp)
@@ -0,0 +1,56 @@
+import os
+import unittest
+from framework import ClientServerBase, BUILD_DIR
+from framework.backuprepository import generate_payload, measure_server_io, payload_sha256
+from framework.benchmark import report_path, write_report
+
+
+@unittest.skipUnless(os.getenv("BENCHMARK") == "true", "Benchmarks are enabled with BENCHMARK=true")
+class ServerIOBenchmarkTest(ClientServerBase):
+    """
+    Upload & download throughput of Backup Repository measured directly over HTTP, without backup Jobs.
+    Concurrency levels are selected with SERVER_BENCHMARK_CONCURRENCY (e.g. "1,4,16"),
+    payload size with SERVER_BENCHMARK_SIZE_MB
+    """
+
+    def test_upload_and_download_throughput(self):
+        size = int(os.getenv("SERVER_BENCHMARK_SIZE_MB", "16")) * 1024 * 1024
+        levels = [int(level) for level in os.getenv("SERVER_BENCHMARK_CONCURRENCY", "1,4,16").split(",")]
+        results = []
+
+        with self.batched_apply():
+            self.server.i_create_a_user(
+                name="international-workers-association",
+                email="example@iwa-ait.org",
+                password="cnt1936",
+            )
+            self.server.i_create_a_collection(
+                name="server-io",
+                description="Server I/O benchmark",
+                filename_template="server-io-${version}.tar.gz",
+                max_backups_count=max(levels) * 2 + 1,
+                max_one_version_size=f"{size // 1024 // 1024 + 1}M",
+                max_collection_size="1000G",
+                strategy_name="fifo"
+            )
+        self.server.i_login(username="international-workers-association", password="cnt1936")
+        api = self.server.api
+        expected_sha256 = payload_sha256(size)
+
+        for concurrency in levels:
+            results.append(measure_server_io(
+                "upload", concurrency, requests_count=concurrency * 2, payload_bytes=size,
+                call=lambda index: api.upload("server-io", generate_payload(size)),
+            ))
+
+            def download(index: int):
+                assert api.download("server-io").sha256 == expected_sha256, "Downloaded version differs"
+
+            results.append(measure_server_io(
+                "download", concurrency, requests_count=concurrency * 2, payload_bytes=size, call=download,
+            ))
+
+        for result in results:
+            print(result.to_dict())
+
+        write_report(report_path("server-io", BUILD_DIR + "/benchmarks"), self.release, results)
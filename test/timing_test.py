@@ -0,0 +1,85 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from framework.timing import Tracer, timed
+
+
+class TracerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tracer = Tracer()
+
+    def test_nested_spans_are_totalled_by_path(self):
+        with self.tracer.test("test_a"):
+            with self.tracer.span("deploy"):
+                for _ in range(2):
+                    with self.tracer.span("kubectl apply"):
+                        pass
+            with self.tracer.span("assert"):
+                pass
+
+        totals = self.tracer.test_totals("test_a")
+
+        self.assertEqual(["assert", "deploy", "deploy > kubectl apply"], sorted(totals))
+        self.assertGreaterEqual(totals["deploy"], totals["deploy > kubectl apply"])
+        self.assertEqual({}, self.tracer.test_totals("test_b"))
+
+    def test_spans_of_other_threads_belong_to_the_running_test(self):
+        def deploy():
+            with self.tracer.span("deploy in background"):
+                pass
+
+        with self.tracer.test("test_a"):
+            thread = threading.Thread(target=deploy)
+            thread.start()
+            thread.join()
+
+        self.assertEqual(["deploy in background"], list(self.tracer.test_totals("test_a")))
+
+    def test_span_knows_its_duration_when_closed(self):
+        with self.tracer.span("backup", dataset="small") as span:
+            self.assertEqual(0.0, span.duration)
+            time.sleep(0.01)
+
+        self.assertGreaterEqual(span.duration, 0.01)
+        self.assertEqual({"dataset": "small"}, span.attrs)
+
+    def test_decorated_function_is_recorded(self):
+        import framework.timing
+
+        @timed()
+        def deploy():
+            return "deployed"
+
+        original, framework.timing.tracer = framework.timing.tracer, self.tracer
+        try:
+            with self.tracer.test("test_a"):
+                self.assertEqual("deployed", deploy())
+        finally:
+            framework.timing.tracer = original
+
+        self.assertEqual(["deploy"], list(self.tracer.test_totals("test_a")))
+
+    def test_chrome_trace(self):
+        tmp = tempfile.mkdtemp(prefix="bmt-timing-")
+        self.addCleanup(shutil.rmtree, tmp)
+
+        with self.tracer.span("setup"):
+            pass
+        with self.tracer.test("test_a"):
+            with self.tracer.span("deploy", component="server"):
+                pass
+        self.tracer.export_chrome_trace(tmp + "/trace/trace.json")
+
+        with open(tmp + "/trace/trace.json") as f:
+            events = json.load(f)["traceEvents"]
+
+        self.assertEqual(["setup", "deploy", "test_a"], [event["name"] for event in events])
+        self.assertEqual(["session", "test_a", "test_a"], [event["cat"] for event in events])
+        self.assertEqual({"component": "server"}, events[1]["args"])
+        self.assertTrue(all(event["ph"] == "X" and event["pid"] == os.getpid() for event in events))
+        self.assertLessEqual(events[2]["ts"], events[1]["ts"], "Test starts before its phases")
@@ -0,0 +1,217 @@
+import base64
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import yaml
+
+from framework.transport import REQUEST_TIMEOUT, ApiTransport, ApplyError, KubectlTransport, KubectlWatch, \
+    KubernetesApiError, _KubeConfig, default_transport, set_default_transport
+
+DISCOVERY = {
+    "/api/v1": {"resources": [
+        {"name": "pods", "singularName": "pod", "kind": "Pod", "namespaced": True, "shortNames": ["po"]},
+        {"name": "pods/log", "singularName": "", "kind": "Pod", "namespaced": True},
+        {"name": "namespaces", "singularName": "namespace", "kind": "Namespace", "namespaced": False,
+         "shortNames": ["ns"]},
+    ]},
+    "/apis": {"groups": [{"preferredVersion": {"groupVersion": "backups.riotkit.org/v1alpha1"}}]},
+    "/apis/backups.riotkit.org/v1alpha1": {"resources": [
+        {"name": "requestedbackupactions", "singularName": "requestedbackupaction", "kind": "RequestedBackupAction",
+         "namespaced": True},
+    ]},
+}
+
+
+class _Response(object):
+    def __init__(self, status_code: int = 200, body: dict = None):
+        self.status_code = status_code
+        self.reason = "OK" if status_code < 400 else "Error"
+        self._body = body or {}
+        self.text = json.dumps(self._body)
+
+    def json(self) -> dict:
+        return self._body
+
+
+class _StubSession(object):
+    """
+    Answers discovery requests, other requests get responses queued by the test
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.responses = {}
+
+    def request(self, method: str, url: str, **kwargs) -> _Response:
+        path = url[len("https://127.0.0.1:6443"):]
+        self.requests.append((method, path, kwargs))
+
+        if method == "GET" and path in DISCOVERY:
+            return _Response(body=DISCOVERY[path])
+        return self.responses.get((method, path), _Response(404, {"reason": "NotFound", "message": path}))
+
+
+def _config(token: str = "secret-token") -> _KubeConfig:
+    config = _KubeConfig.__new__(_KubeConfig)
+    config.server, config.verify, config.cert, config.token = "https://127.0.0.1:6443", False, None, token
+    return config
+
+
+class ApiTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.transport = ApiTransport(_config())
+        self.session = self.transport._session = _StubSession()
+
+    def test_authorization_is_set_on_the_session(self):
+        self.assertEqual("Bearer secret-token", ApiTransport(_config())._session.headers["Authorization"])
+        self.assertNotIn("Authorization", ApiTransport(_config(token=None))._session.headers)
+
+    def test_namespaced_and_cluster_scoped_urls(self):
+        self.session.responses[("GET", "/api/v1/namespaces/backups/pods/server-0")] = _Response(body={"kind": "Pod"})
+        self.session.responses[("GET", "/api/v1/namespaces/backups")] = _Response(body={"kind": "Namespace"})
+        self.session.responses[("GET", "/apis/backups.riotkit.org/v1alpha1/namespaces/subject/"
+                                       "requestedbackupactions")] = _Response(body={"items": [{"kind": "x"}]})
+
+        self.assertEqual({"kind": "Pod"}, self.transport.get("po", "server-0", "backups"))
+        self.assertEqual({"kind": "Namespace"}, self.transport.get("namespace", "backups", ns=""))
+        self.assertEqual([{"kind": "x"}], self.transport.list("requestedbackupaction", "subject"))
+        self.assertIsNone(self.transport.get("pod", "missing", "backups"))
+
+    def test_discovery_is_done_once(self):
+        for _ in range(3):
+            self.transport.get("pod", "server-0", "backups")
+
+        discovery = [path for method, path, _ in self.session.requests if path in DISCOVERY]
+        self.assertEqual(["/api/v1", "/apis", "/apis/backups.riotkit.org/v1alpha1"], discovery)
+
+    def test_unknown_kind_refreshes_discovery_once(self):
+        with self.assertRaisesRegex(KubernetesApiError, "doesn't have a resource type 'scheduledbackup'"):
+            self.transport.list("scheduledbackup", "subject")
+
+        self.assertEqual(2, [path for _, path, _ in self.session.requests].count("/api/v1"))
+
+    def test_documents_are_applied_server_side(self):
+        self.session.responses[("PATCH", "/apis/backups.riotkit.org/v1alpha1/namespaces/subject/"
+                                         "requestedbackupactions/backup-1")] = _Response()
+        self.session.responses[("PATCH", "/api/v1/namespaces/subject")] = _Response()
+
+        self.transport.apply([
+            {"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": "subject"}},
+            {"apiVersion": "backups.riotkit.org/v1alpha1", "kind": "RequestedBackupAction",
+             "metadata": {"name": "backup-1"}, "spec": {"action": "backup"}},
+        ], ns="subject")
+
+        patches = [(path, kwargs) for method, path, kwargs in self.session.requests if method == "PATCH"]
+        self.assertEqual(2, len(patches))
+        for path, kwargs in patches:
+            self.assertEqual({"fieldManager": "bmt", "force": "true"}, kwargs["params"])
+            self.assertEqual("application/apply-patch+yaml", kwargs["headers"]["Content-Type"])
+            self.assertEqual(REQUEST_TIMEOUT, kwargs["timeout"])
+
+        self.assertNotIn("namespace", json.loads(patches[0][1]["data"])["metadata"], "Namespace is cluster-scoped")
+        self.assertEqual("subject", json.loads(patches[1][1]["data"])["metadata"]["namespace"])
+
+    def test_rejected_document_is_reported_with_its_index(self):
+        self.session.responses[("PATCH", "/api/v1/namespaces/subject/pods/broken")] = \
+            _Response(422, {"reason": "Invalid", "message": "spec.containers: Required value"})
+
+        with self.assertRaises(ApplyError) as context:
+            self.transport.apply([{"apiVersion": "v1", "kind": "Pod", "metadata": {"name": "broken"}}], ns="subject")
+
+        self.assertEqual(0, context.exception.index)
+        self.assertIn("Pod/broken: 422 Invalid: spec.containers: Required value", str(context.exception))
+
+    def test_streams_have_no_read_timeout(self):
+        self.session.responses[("GET", "/api/v1/namespaces/backups/pods/server-0/log")] = _Response()
+
+        self.transport.request("GET", "/api/v1/namespaces/backups/pods/server-0/log", stream=True)
+        self.transport.request("GET", "/api/v1/namespaces/backups/pods/server-0/log", timeout=1)
+
+        self.assertEqual([(REQUEST_TIMEOUT[0], None), 1], [kwargs["timeout"] for _, _, kwargs in self.session.requests])
+
+
+class KubeConfigTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="bmt-kubeconfig-")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _write(self, name: str, user: dict, cluster: dict = None, context: str = "k3d-bmt") -> str:
+        path = f"{self.tmp}/{name}"
+        cluster = dict({"server": "https://0.0.0.0:6443/"}, **(cluster or {}))
+        with open(path, "w") as f:
+            yaml.safe_dump({
+                "current-context": context,
+                "clusters": [{"name": "k3d-bmt", "cluster": cluster}],
+                "users": [{"name": "admin@k3d-bmt", "user": user}],
+                "contexts": [{"name": "k3d-bmt", "context": {"cluster": "k3d-bmt", "user": "admin@k3d-bmt"}}],
+            }, f)
+        return path
+
+    def test_token_and_insecure_cluster(self):
+        config = _KubeConfig([self._write("config", {"token": "abc"}, {"insecure-skip-tls-verify": True})])
+
+        self.assertEqual("https://0.0.0.0:6443", config.server)
+        self.assertEqual("abc", config.token)
+        self.assertFalse(config.verify)
+        self.assertIsNone(config.cert)
+
+    def test_embedded_client_certificates_are_written_to_files(self):
+        encode = lambda content: base64.b64encode(content).decode('utf-8')
+        config = _KubeConfig([self._write("config",
+                                          {"client-certificate-data": encode(b"CERT"),
+                                           "client-key-data": encode(b"KEY")},
+                                          {"certificate-authority-data": encode(b"CA")})])
+
+        with open(config.verify, "rb") as ca, open(config.cert[0], "rb") as cert, open(config.cert[1], "rb") as key:
+            self.assertEqual([b"CA", b"CERT", b"KEY"], [ca.read(), cert.read(), key.read()])
+        self.assertIsNone(config.token)
+
+    def test_certificate_files_and_first_file_wins(self):
+        first = self._write("first", {"client-certificate": "/certs/client.crt", "client-key": "/certs/client.key"},
+                            {"certificate-authority": "/certs/ca.crt"})
+        second = self._write("second", {"token": "ignored"}, context="other")
+
+        config = _KubeConfig([first, self.tmp + "/missing", second])
+
+        self.assertEqual("/certs/ca.crt", config.verify)
+        self.assertEqual(("/certs/client.crt", "/certs/client.key"), config.cert)
+        self.assertIsNone(config.token)
+
+    def test_missing_context_is_refused(self):
+        with self.assertRaisesRegex(ValueError, "Cannot find current context 'other'"):
+            _KubeConfig([self._write("config", {"token": "abc"}, context="other")])
+
+    def test_auth_plugins_fall_back_to_kubectl(self):
+        path = self._write("config", {"exec": {"command": "aws", "args": ["eks", "get-token"]}})
+
+        with self.assertRaisesRegex(ValueError, "plugins are not supported"):
+            _KubeConfig([path])
+
+        previous = set_default_transport(None)
+        try:
+            with mock.patch.dict(os.environ, {"KUBECONFIG": path, "BMT_KUBE_TRANSPORT": "api"}):
+                self.assertIsInstance(default_transport(), KubectlTransport)
+        finally:
+            set_default_transport(previous)
+
+
+class KubectlWatchTest(unittest.TestCase):
+    def test_pretty_printed_and_concatenated_documents_are_parsed(self):
+        output = json.dumps({"type": "ADDED", "object": {"metadata": {"name": "a"}}}, indent=4) + "\n" \
+            + json.dumps({"type": "MODIFIED", "object": {"metadata": {"name": "a"}}}) \
+            + json.dumps({"type": "DELETED", "object": {"metadata": {"name": "a"}}}) + "\n"
+        script = f"import sys; sys.stdout.write({output!r})"
+
+        with KubectlWatch([sys.executable, "-c", script]) as watch:
+            events = list(watch.events(time.monotonic() + 10))
+
+        self.assertEqual(["ADDED", "MODIFIED", "DELETED"], [event["type"] for event in events])
+        self.assertEqual({"metadata": {"name": "a"}}, events[0]["object"])